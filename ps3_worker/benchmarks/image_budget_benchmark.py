@@ -0,0 +1,163 @@
+"""
+Compara la codificación fija de las páginas (150 dpi, 1600 px, calidad 75) con
+la adaptativa (`services/page_encoder.py`): píxeles, bytes, tokens estimados por
+proveedor y tiempo de codificación, sobre un directorio de PDFs o PDFs sintéticos:
+
+    python -m ps3_worker.benchmarks.image_budget_benchmark --corpus papers/
+
+Con `--ab` además ejecuta la extracción con ambas codificaciones contra el
+proveedor configurado (o un archivo grabado con `--replay`) y mide el acuerdo
+entre ambas y, si hay un `{pdf}.json` en `--expected` (lista de filas), contra
+los valores esperados:
+
+    python -m ps3_worker.benchmarks.image_budget_benchmark --corpus papers/ --ab --expected fixtures/expected/
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from ps3_worker.benchmarks.pipeline_benchmark import load_corpus
+from ps3_worker.constants import LLM_PROVIDER, LLM_MODEL_NAME
+from ps3_worker.services.doc_managament import DocManagament
+from ps3_worker.services.llm_recorder import ReplayChatClient, get_archive
+from ps3_worker.services.page_encoder import TOKEN_PROVIDERS, image_report
+from ps3_worker.services.pdf_pipeline import PDFPipeline
+from ps3_worker.services.vllm_client import LLMProvider, VLLMChatClient
+
+ENCODERS = ("fixed", "adaptive")
+# Columnas que no se comparan en el A/B
+IGNORED_COLUMNS = {"doi", "odds_path", "category"}
+
+
+def encode(pdf_bytes: bytes, encoder: str) -> Dict[str, Any]:
+    document = DocManagament(pdf_bytes)
+    started = time.perf_counter()
+    if encoder == "adaptive":
+        document.to_adaptive_jpgs()
+        report = document.encoding_report
+    else:
+        document.to_jpgs()
+        report = image_report(document.page_images)
+    report["encode_s"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, float) and pd.isna(value):
+        return None
+    return value
+
+
+def frame_agreement(left: pd.DataFrame, right: pd.DataFrame) -> Optional[float]:
+    """Fracción de celdas iguales entre dos resultados (filas en el orden de las variantes)"""
+    columns = [column for column in left.columns if column in right.columns and column not in IGNORED_COLUMNS]
+    rows = max(len(left), len(right))
+    if not columns or not rows:
+        return None
+    equal = 0
+    for i in range(min(len(left), len(right))):
+        equal += sum(_normalize(left.iloc[i][column]) == _normalize(right.iloc[i][column]) for column in columns)
+    return round(equal / (rows * len(columns)), 3)
+
+
+async def run_ab(corpus, args, work_dir: str) -> Dict[str, Any]:
+    archive = get_archive(args.replay) if args.replay else None
+
+    def make_client() -> VLLMChatClient:
+        if archive is not None:
+            replay = ReplayChatClient(args.provider, args.model, archive)
+            return VLLMChatClient(LLMProvider(args.provider), args.model, client=replay)
+        return VLLMChatClient(LLMProvider(args.provider), args.model)
+
+    documents = []
+    for index, (filename, pdf_bytes) in enumerate(corpus):
+        frames = {}
+        for encoder in ENCODERS:
+            pipeline = PDFPipeline(vllm_client=make_client(), image_encoder=encoder, cache_artifacts=False)
+            try:
+                frames[encoder], _ = await pipeline.extract_data_from_pdf(
+                    pdf_bytes, os.path.join(work_dir, f"ab_{encoder}_{index}"), filename=filename
+                )
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"{filename} ({encoder}): {e}")
+        entry: Dict[str, Any] = {"pdf": filename, "variants": {encoder: len(frame) for encoder, frame in frames.items()}}
+        if len(frames) == len(ENCODERS):
+            entry["agreement"] = frame_agreement(frames["fixed"], frames["adaptive"])
+
+        expected_path = os.path.join(args.expected, os.path.splitext(filename)[0] + ".json") if args.expected else ""
+        if expected_path and os.path.exists(expected_path):
+            with open(expected_path) as f:
+                expected = pd.DataFrame(json.load(f))
+            entry["accuracy"] = {encoder: frame_agreement(expected, frame) for encoder, frame in frames.items()}
+        documents.append(entry)
+
+    result: Dict[str, Any] = {"documents": documents}
+    if archive is not None:
+        result["replay"] = archive.report()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Codificación fija frente a adaptativa de las páginas")
+    parser.add_argument("--corpus", default="", help="Directorio con PDFs (por defecto, PDFs sintéticos)")
+    parser.add_argument("--tasks", type=int, default=5, help="PDFs sintéticos si no hay corpus")
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--ab", action="store_true", help="Ejecutar la extracción con ambas codificaciones")
+    parser.add_argument("--expected", default="", help="Directorio con los resultados esperados ({pdf}.json)")
+    parser.add_argument("--replay", default="", help="Archivo grabado con LLM_RECORD_MODE=record")
+    parser.add_argument("--provider", default=LLM_PROVIDER)
+    parser.add_argument("--model", default=LLM_MODEL_NAME)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    pdfs = len(glob.glob(os.path.join(args.corpus, "*.pdf"))) if args.corpus else 0
+    corpus = load_corpus(args.corpus, pdfs or args.tasks, args.pages)
+
+    totals: Dict[str, Dict[str, float]] = {
+        encoder: {"images": 0, "pixels": 0, "bytes": 0, "encode_s": 0.0, **{p: 0 for p in TOKEN_PROVIDERS}}
+        for encoder in ENCODERS
+    }
+    documents: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for index, (filename, pdf_bytes) in enumerate(corpus):
+            entry: Dict[str, Any] = {"pdf": filename}
+            for encoder in ENCODERS:
+                report = encode(pdf_bytes, encoder)
+                entry[encoder] = {
+                    "images": report["images"],
+                    "kinds": report.get("kinds"),
+                    "megapixels": round(report["pixels"] / 1e6, 2),
+                    "kb": round(report["bytes"] / 1024, 1),
+                    "tokens": report["tokens"],
+                }
+                total = totals[encoder]
+                for key in ("images", "pixels", "bytes", "encode_s"):
+                    total[key] += report[key]
+                for provider, tokens in report["tokens"].items():
+                    total[provider] += tokens
+            documents.append(entry)
+
+        results: Dict[str, Any] = {"documents": documents, "totals": totals}
+        fixed_tokens = {p: totals["fixed"][p] for p in TOKEN_PROVIDERS}
+        results["token_reduction"] = {
+            provider: round(1 - totals["adaptive"][provider] / tokens, 3) if tokens else None
+            for provider, tokens in fixed_tokens.items()
+        }
+        if args.ab:
+            results["ab"] = asyncio.run(run_ab(corpus, args, work_dir))
+
+    print(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark del tiempo de arranque del worker.
+
+Importa los módulos de entrada en un intérprete nuevo con `python -X importtime`
+(varias veces, se queda con la mejor ejecución), reporta el tiempo total y los
+paquetes que más tardan, y comprueba que los SDK de los proveedores y el stack
+de ML no se cargan al arrancar. Sale con código 1 si se supera el presupuesto o
+se importa algún módulo prohibido, para usarlo como comprobación en CI:
+
+    python -m ps3_worker.benchmarks.import_time_benchmark
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+DEFAULT_MODULES = ("ps3_worker.consumers.data_consumer_in",)
+# Paquetes que solo deben cargarse cuando un cliente o método los necesita
+LAZY_PACKAGES = (
+    "google.generativeai", "google.genai", "openai", "anthropic", "ollama",
+    "langchain", "langchain_community", "langchain_experimental", "torch", "transformers", "qdrant_client",
+)
+
+
+def import_profile(module: str) -> Dict[str, Any]:
+    """Tiempo propio y acumulado (µs) de cada módulo importado por `module` en un intérprete nuevo"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONWARNINGS": "ignore"},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {module}: {result.stderr.strip().splitlines()[-1:]}")
+
+    modules: Dict[str, Dict[str, int]] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue
+        modules[name.strip()] = {"self_us": int(self_us), "cumulative_us": int(cumulative_us)}
+    return {"total_us": modules.get(module, {}).get("cumulative_us", 0), "modules": modules}
+
+
+def heaviest_packages(modules: Dict[str, Dict[str, int]], top: int) -> List[Dict[str, Any]]:
+    packages: Dict[str, int] = {}
+    for name, times in modules.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + times["self_us"]
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "ms": round(us / 1000, 1)} for package, us in ranked]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de importación del worker")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="Módulos de entrada separados por comas")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Paquetes más lentos que se reportan")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Tiempo máximo por módulo (0 = sin límite)")
+    parser.add_argument("--forbid", default=",".join(LAZY_PACKAGES), help="Paquetes que no deben importarse")
+    args = parser.parse_args()
+
+    forbidden = [package for package in args.forbid.split(",") if package]
+    results = {}
+    failed = False
+    for module in filter(None, args.modules.split(",")):
+        profile = min((import_profile(module) for _ in range(args.runs)), key=lambda p: p["total_us"])
+        loaded = sorted(
+            package for package in forbidden
+            if any(name == package or name.startswith(f"{package}.") for name in profile["modules"])
+        )
+        total_ms = profile["total_us"] / 1000
+        over_budget = bool(args.budget_ms) and total_ms > args.budget_ms
+        failed = failed or over_budget or bool(loaded)
+        results[module] = {
+            "total_ms": round(total_ms, 1),
+            "budget_ms": args.budget_ms or None,
+            "over_budget": over_budget,
+            "modules": len(profile["modules"]),
+            "forbidden_imported": loaded,
+            "heaviest": heaviest_packages(profile["modules"], args.top),
+        }
+
+    print(json.dumps(results, indent=2))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
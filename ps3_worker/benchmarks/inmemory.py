@@ -0,0 +1,186 @@
+"""
+Sustitutos en memoria de MinioManager y MongoManager para ejecutar el pipeline
+y el consumer sin servicios externos. Solo implementan lo que usan MinioService
+y MongoService.
+"""
+import copy
+import io
+import itertools
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from minio.error import S3Error
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from ps3_worker.services.minio_service import MIN_MULTIPART_PART_SIZE, MinioObjectsMixin
+
+
+class _ObjectResponse(io.BytesIO):
+    def release_conn(self):
+        pass
+
+
+class InMemoryMinioClient:
+    """Subconjunto del cliente de minio-py sobre un diccionario"""
+
+    def __init__(self):
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+        # Partes en que se dividió la última subida de cada objeto
+        self.parts: Dict[Tuple[str, str], int] = {}
+
+    def get_object(self, bucket_name: str, object_name: str) -> _ObjectResponse:
+        try:
+            return _ObjectResponse(self.objects[(bucket_name, object_name)])
+        except KeyError:
+            # Igual que minio-py: S3Error con código NoSuchKey
+            raise S3Error(
+                None, "NoSuchKey", "The specified key does not exist.", f"/{bucket_name}/{object_name}",
+                None, None, bucket_name=bucket_name, object_name=object_name
+            )
+
+    def put_object(self, bucket_name: str, object_name: str, data, length: int, part_size: int = 0, **kwargs):
+        # Igual que minio-py: partes de al menos 5 MiB y lectura de exactamente `length` bytes
+        if part_size and part_size < MIN_MULTIPART_PART_SIZE:
+            raise ValueError(f"part_size {part_size} menor que el mínimo de S3")
+        part_size = part_size or max(length, 1)
+        chunks = []
+        read = 0
+        while read < length:
+            chunk = data.read(min(part_size, length - read))
+            if not chunk:
+                raise IOError(f"Se esperaban {length} bytes y solo se leyeron {read}")
+            chunks.append(bytes(chunk))
+            read += len(chunk)
+        self.objects[(bucket_name, object_name)] = b"".join(chunks)
+        self.parts[(bucket_name, object_name)] = max(len(chunks), 1)
+
+    def copy_object(self, bucket_name: str, object_name: str, source, **kwargs):
+        self.objects[(bucket_name, object_name)] = self.objects[(source.bucket_name, source.object_name)]
+
+
+class InMemoryMinioManager(MinioObjectsMixin):
+    def __init__(self):
+        self.client = InMemoryMinioClient()
+        self.buckets = set()
+
+    def make_bucket(self, bucket_name: str):
+        self.buckets.add(bucket_name)
+
+    def put(self, bucket_name: str, object_name: str, data: bytes):
+        self.client.objects[(bucket_name, object_name)] = data
+
+    def upload_file(self, bucket_name: str, object_name: str, file_path: str):
+        with open(file_path, "rb") as f:
+            self.put(bucket_name, object_name, f.read())
+
+    def download_file(self, bucket_name: str, object_name: str, file_path: str):
+        with open(file_path, "wb") as f:
+            f.write(self.client.objects[(bucket_name, object_name)])
+
+
+def _matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(document, option) for option in condition):
+                return False
+            continue
+        value = document.get(key)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class _UpdateResult(SimpleNamespace):
+    pass
+
+
+class InMemoryCollection:
+    """Subconjunto de una colección de pymongo (filtros de igualdad, $ne, $lt, $in y $or)"""
+
+    def __init__(self):
+        self.documents: List[Dict[str, Any]] = []
+        self.unique_keys: List[str] = []
+        self._ids = itertools.count(1)
+
+    def create_index(self, key: str, unique: bool = False):
+        if unique and key not in self.unique_keys:
+            self.unique_keys.append(key)
+
+    def find_one(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        for document in self.documents:
+            if _matches(document, query):
+                return copy.deepcopy(document)
+        return None
+
+    def _apply(self, document: Dict[str, Any], update: Dict[str, Any], inserting: bool):
+        if not any(key.startswith("$") for key in update):
+            update = {"$set": update}
+        document.update(update.get("$set", {}))
+        if inserting:
+            document.update(update.get("$setOnInsert", {}))
+        for key in update.get("$unset", {}):
+            document.pop(key, None)
+
+    def _check_unique(self, candidate: Dict[str, Any]):
+        for key in self.unique_keys:
+            if any(doc is not candidate and doc.get(key) == candidate.get(key) for doc in self.documents):
+                raise DuplicateKeyError(f"E11000 duplicate key: {key}={candidate.get(key)}")
+
+    def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> _UpdateResult:
+        for document in self.documents:
+            if _matches(document, query):
+                self._apply(document, update, inserting=False)
+                return _UpdateResult(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            document = {"_id": next(self._ids), **{k: v for k, v in query.items() if not k.startswith("$")}}
+            self._apply(document, update, inserting=True)
+            self._check_unique(document)
+            self.documents.append(document)
+            return _UpdateResult(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return _UpdateResult(matched_count=0, modified_count=0, upserted_id=None)
+
+    def find_one_and_update(self, query, update, upsert: bool = False, return_document=ReturnDocument.BEFORE):
+        for document in self.documents:
+            if _matches(document, query):
+                before = copy.deepcopy(document)
+                self._apply(document, update, inserting=False)
+                return copy.deepcopy(document) if return_document == ReturnDocument.AFTER else before
+        if upsert:
+            result = self.update_one(query, update, upsert=True)
+            return self.find_one({"_id": result.upserted_id}) if return_document == ReturnDocument.AFTER else None
+        return None
+
+    def bulk_write(self, operations, ordered: bool = True) -> _UpdateResult:
+        modified = 0
+        for operation in operations:
+            modified += self.update_one(operation._filter, operation._doc, upsert=bool(operation._upsert)).modified_count
+        return _UpdateResult(modified_count=modified)
+
+
+class InMemoryMongoManager:
+    def __init__(self):
+        self.db: Dict[str, InMemoryCollection] = _Collections()
+
+    def find_one(self, collection: str, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.db[collection].find_one(query)
+
+    def update_one(self, collection: str, query: Dict[str, Any], update_data: Dict[str, Any]) -> int:
+        return self.db[collection].update_one(query, {"$set": update_data}, upsert=True).modified_count
+
+    def close(self):
+        pass
+
+
+class _Collections(dict):
+    def __missing__(self, name: str) -> InMemoryCollection:
+        collection = self[name] = InMemoryCollection()
+        return collection
@@ -0,0 +1,142 @@
+"""
+Comprobaciones de las operaciones en memoria de MinioService contra el
+sustituto de `inmemory.py`, que ejecuta el mismo código del manager
+(`MinioObjectsMixin`) que en producción:
+
+- ida y vuelta de bytes: subida, descarga y copia en servidor,
+- subida de un parquet sin escribir ningún archivo en disco,
+- subida de tamaño multipart (más de MINIO_MULTIPART_PART_SIZE).
+
+Sale con código 1 si falla alguna, para usarlo como comprobación en CI:
+
+    python -m ps3_worker.benchmarks.minio_inmemory_check
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Callable, Dict, List, Set
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ps3_worker.benchmarks.inmemory import InMemoryMinioManager
+from ps3_worker.constants import MINIO_BUCKET_PARQUETS, MINIO_BUCKET_PDFS, MINIO_MULTIPART_PART_SIZE
+from ps3_worker.services.minio_service import MinioService
+
+# Archivos abiertos para escritura desde Python mientras `_watching` está activo
+_written: List[str] = []
+_watching = False
+
+
+def _audit(event: str, args) -> None:
+    if not _watching or event != "open":
+        return
+    path, mode, flags = args
+    writing = (mode and any(flag in mode for flag in "wax+")) or (
+        isinstance(flags, int) and flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT)
+    )
+    if writing:
+        _written.append(str(path))
+
+
+def _files(directories: List[str]) -> Set[str]:
+    found = set()
+    for directory in directories:
+        for root, _, names in os.walk(directory):
+            found.update(os.path.join(root, name) for name in names)
+    return found
+
+
+def check_roundtrip(service: MinioService, manager: InMemoryMinioManager) -> Dict[str, Any]:
+    data = os.urandom(256 * 1024)
+    manager.put(MINIO_BUCKET_PDFS, "check/pdfs/document.pdf", data)
+    downloaded = service.download_pdf_bytes("check", "document.pdf")
+
+    service.upload_bytes(MINIO_BUCKET_PARQUETS, "check/parquets/data.bin", data)
+    uploaded = manager.get_object_bytes(MINIO_BUCKET_PARQUETS, "check/parquets/data.bin")
+
+    copied_path = service.copy_parquet("check/parquets/data.bin", "check-copy")
+    copied = manager.get_object_bytes(MINIO_BUCKET_PARQUETS, copied_path) if copied_path else None
+
+    return {
+        "ok": downloaded == data and uploaded == data and copied == data,
+        "bytes": len(data),
+        "download": downloaded == data,
+        "upload": uploaded == data,
+        "copy": copied == data,
+    }
+
+
+def check_parquet_without_files(service: MinioService, manager: InMemoryMinioManager) -> Dict[str, Any]:
+    global _watching
+    df = pd.DataFrame({"gene": ["MYH7", "KCNH2"], "odds_path": [4.3, 18.7], "category": ["PS3", "PS3_moderate"]})
+    # pyarrow escribe desde C++ sin pasar por los audit hooks: se comparan también los directorios
+    directories = [tempfile.gettempdir(), os.getcwd()]
+    before = _files(directories)
+
+    _written.clear()
+    _watching = True
+    try:
+        object_name = service.upload_parquet("check", "results.parquet", df, "odds_path")
+    finally:
+        _watching = False
+
+    new_files = sorted(_files(directories) - before)
+    table = pq.read_table(pa.BufferReader(manager.get_object_bytes(MINIO_BUCKET_PARQUETS, object_name))) \
+        if object_name else None
+    same_rows = table is not None and table.to_pandas().equals(df)
+    return {
+        "ok": same_rows and not _written and not new_files,
+        "object": object_name,
+        "same_rows": same_rows,
+        "files_opened_for_writing": list(_written),
+        "new_files": new_files,
+    }
+
+
+def check_multipart(service: MinioService, manager: InMemoryMinioManager) -> Dict[str, Any]:
+    data = os.urandom(2 * MINIO_MULTIPART_PART_SIZE + 1)
+    object_name = "check/parquets/large.bin"
+    service.upload_bytes(MINIO_BUCKET_PARQUETS, object_name, data)
+    parts = manager.client.parts.get((MINIO_BUCKET_PARQUETS, object_name), 0)
+    same_bytes = manager.get_object_bytes(MINIO_BUCKET_PARQUETS, object_name) == data
+    return {
+        "ok": same_bytes and parts == 3,
+        "bytes": len(data),
+        "part_size": MINIO_MULTIPART_PART_SIZE,
+        "parts": parts,
+        "same_bytes": same_bytes,
+    }
+
+
+CHECKS: Dict[str, Callable[[MinioService, InMemoryMinioManager], Dict[str, Any]]] = {
+    "roundtrip": check_roundtrip,
+    "parquet_without_files": check_parquet_without_files,
+    "multipart": check_multipart,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprobaciones de las operaciones en memoria de MinIO")
+    parser.add_argument("--checks", default=",".join(CHECKS), help="Comprobaciones separadas por comas")
+    args = parser.parse_args()
+
+    sys.addaudithook(_audit)
+    results = {}
+    for name in filter(None, args.checks.split(",")):
+        manager = InMemoryMinioManager()
+        try:
+            results[name] = CHECKS[name](MinioService(minio_manager=manager), manager)
+        except Exception as e:
+            results[name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    print(json.dumps(results, indent=2))
+    if not all(result["ok"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark del backend local con Ollama.
+
+Lanza las mismas peticiones de extracción (con páginas de un PDF como
+imágenes, si se indica `--pdf`) contra un servidor Ollama local con distintos
+niveles de paralelismo y reporta el tiempo de carga del modelo, la latencia,
+las peticiones por minuto y los tokens generados por segundo. Para que el
+paralelismo sea real, el servidor debe arrancarse con un `OLLAMA_NUM_PARALLEL`
+igual o mayor que el nivel más alto:
+
+    OLLAMA_NUM_PARALLEL=4 ollama serve
+    python -m ps3_worker.benchmarks.ollama_benchmark --model gemma3:4b --pdf paper.pdf --pages 2 --parallel 1,2,4
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from ps3_shared.entities.gene_variant import FunctionalVariants
+from ps3_worker.constants import OLLAMA_HOST, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, OLLAMA_NUM_THREAD
+from ps3_worker.prompts.extract_variants_prompt import variants_prompt
+from ps3_worker.services.ollama_runtime import OllamaRuntime, default_options
+from ps3_worker.services.page_image import PageImage
+from ps3_worker.services.vllm_client import OllamaChatClient
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def page_images(pdf_path: str, pages: int) -> List[PageImage]:
+    from ps3_worker.services.doc_managament import DocManagament
+
+    document = DocManagament(pdf_path)
+    document.to_adaptive_jpgs()
+    return document.page_images[:pages]
+
+
+def run_level(client: OllamaChatClient, parallel: int, image_paths: List[PageImage], args) -> Dict[str, Any]:
+    def request(_):
+        started = time.perf_counter()
+        try:
+            client.send_message_once(variants_prompt, image_paths, FunctionalVariants)
+            return time.perf_counter() - started, dict(client.last_usage), None
+        except Exception as e:
+            return time.perf_counter() - started, {}, e
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        results = list(pool.map(request, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [latency for latency, _, error in results if error is None]
+    output_tokens = sum(usage.get("output_tokens", 0) for _, usage, _ in results)
+    return {
+        "parallel": parallel,
+        "requests": args.requests,
+        "errors": sum(error is not None for _, _, error in results),
+        "wall_s": round(wall, 2),
+        "requests_per_min": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "p50_s": round(_percentile(latencies, 0.5), 2),
+        "p95_s": round(_percentile(latencies, 0.95), 2),
+        "output_tokens_per_s": round(output_tokens / wall, 1) if wall else 0.0,
+        "input_tokens": sum(usage.get("input_tokens", 0) for _, usage, _ in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del backend local con Ollama")
+    parser.add_argument("--model", default="gemma3:4b", help="Modelo de visión pequeño ya descargado en Ollama")
+    parser.add_argument("--host", default=OLLAMA_HOST)
+    parser.add_argument("--pdf", help="PDF cuyas páginas se envían como imágenes")
+    parser.add_argument("--pages", type=int, default=2, help="Páginas del PDF por petición")
+    parser.add_argument("--requests", type=int, default=8, help="Peticiones por nivel de paralelismo")
+    parser.add_argument("--parallel", default="1,2,4", help="Niveles de paralelismo separados por comas")
+    parser.add_argument("--num-ctx", type=int, default=OLLAMA_NUM_CTX)
+    parser.add_argument("--num-thread", type=int, default=OLLAMA_NUM_THREAD)
+    parser.add_argument("--keep-alive", default=OLLAMA_KEEP_ALIVE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    options = default_options(args.num_ctx, args.num_thread)
+    results: Dict[str, Any] = {"model": args.model, "options": options, "levels": []}
+
+    image_paths = page_images(args.pdf, args.pages) if args.pdf else []
+    results["images_per_request"] = len(image_paths)
+    for index, parallel in enumerate(int(level) for level in args.parallel.split(",")):
+        runtime = OllamaRuntime(
+            host=args.host, num_parallel=parallel, keep_alive=args.keep_alive, options=options
+        )
+        client = OllamaChatClient(args.model, runtime=runtime)
+        try:
+            load_s = client.prewarm()
+            if index == 0:
+                # La primera carga incluye leer el modelo del disco; las siguientes lo encuentran cargado
+                results["load_s"] = round(load_s, 2)
+            # Petición de calentamiento (caché de la imagen y del prompt) fuera de la medición
+            run_level(client, 1, image_paths, argparse.Namespace(requests=1))
+            results["levels"].append(run_level(client, parallel, image_paths, args))
+        finally:
+            runtime.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark del traspaso de las páginas del rasterizador a los clientes LLM.
+
+Compara el camino anterior, en el que las páginas se escribían como JPG en
+disco y cada llamada las volvía a leer y a codificar en base64, con el actual,
+en el que el rasterizador produce `PageImage` en memoria que comparten todas
+las llamadas del documento. Para cada PDF se codifican las páginas y se
+construyen, con `--concurrency` hilos, las peticiones de `--calls` llamadas
+(la de variantes y una por variante) con los constructores reales de cada
+proveedor, sin enviarlas; `--hold-ms` mantiene viva cada petición el tiempo
+que tardaría en enviarse. Reporta el CPU total y por llamada y el pico de
+memoria (tracemalloc) de cada camino:
+
+    python -m ps3_worker.benchmarks.page_image_benchmark --corpus papers/ --calls 20 --concurrency 4
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from ps3_worker.benchmarks.pipeline_benchmark import load_corpus
+from ps3_worker.services.doc_managament import DocManagament
+from ps3_worker.services.vllm_client import (
+    ClaudeChatClient, GeminiChatClient, OllamaChatClient, OpenAIChatClient
+)
+
+MODES = ("disk", "memory")
+PROMPT = "Extract the functional data of the variant from the attached pages."
+
+
+def request_builders() -> Dict[str, Callable[[List[Any]], Any]]:
+    """Constructores de la petición de cada cliente, sin crear los clientes de los SDK"""
+    openai_client = object.__new__(OpenAIChatClient)
+    claude_client = object.__new__(ClaudeChatClient)
+    gemini_client = object.__new__(GeminiChatClient)
+    ollama_client = object.__new__(OllamaChatClient)
+    for client in (openai_client, claude_client, gemini_client, ollama_client):
+        client.model_name = "benchmark"
+    return {
+        "openai": lambda images: openai_client._build_messages(PROMPT, images),
+        "claude": lambda images: claude_client._build_request(PROMPT, images, None),
+        "gemini": lambda images: gemini_client._build_request(PROMPT, images, None),
+        "ollama": lambda images: ollama_client._build_messages(PROMPT, images),
+    }
+
+
+def rasterize(pdf_bytes: bytes, mode: str, work_dir: str) -> List[Any]:
+    """Imágenes que recibe el cliente: rutas a JPG en disco o `PageImage` en memoria"""
+    document = DocManagament(pdf_bytes)
+    if mode == "memory":
+        document.to_adaptive_jpgs()
+        return document.page_images
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    document.to_adaptive_jpgs(output_dir=output_dir)
+    return [os.path.join(output_dir, image.name) for image in document.page_images]
+
+
+def run_document(pdf_bytes: bytes, mode: str, build: Callable[[List[Any]], Any], args, work_dir: str) -> int:
+    images = rasterize(pdf_bytes, mode, work_dir)
+
+    def call(_):
+        request = build(images)
+        # La petición sigue en memoria mientras se envía
+        time.sleep(args.hold_ms / 1000)
+        return request is not None
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        return sum(pool.map(call, range(args.calls)))
+
+
+def run_mode(corpus, mode: str, build: Callable[[List[Any]], Any], args, work_dir: str) -> Dict[str, Any]:
+    # Primera pasada sin tracemalloc para medir CPU y tiempo; la segunda solo mide el pico de memoria
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    calls = sum(run_document(pdf_bytes, mode, build, args, work_dir) for _, pdf_bytes in corpus)
+    cpu_s = time.process_time() - cpu_started
+    wall_s = time.perf_counter() - started
+
+    # CPU de las llamadas sin la rasterización, que es igual en ambos caminos salvo la escritura
+    raster_started = time.process_time()
+    documents = [rasterize(pdf_bytes, mode, work_dir) for _, pdf_bytes in corpus]
+    raster_cpu_s = time.process_time() - raster_started
+    calls_started = time.process_time()
+    for images in documents:
+        for _ in range(args.calls):
+            build(images)
+    calls_cpu_s = time.process_time() - calls_started
+    del documents
+
+    tracemalloc.start()
+    try:
+        for _, pdf_bytes in corpus:
+            run_document(pdf_bytes, mode, build, args, work_dir)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "calls": calls,
+        "wall_s": round(wall_s, 3),
+        "cpu_s": round(cpu_s, 3),
+        "rasterize_cpu_s": round(raster_cpu_s, 3),
+        "cpu_ms_per_call": round(calls_cpu_s / calls * 1000, 3) if calls else 0.0,
+        "peak_mb": round(peak / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del traspaso de páginas en memoria a los clientes LLM")
+    parser.add_argument("--corpus", help="Directorio con PDFs (si no, PDFs sintéticos)")
+    parser.add_argument("--documents", type=int, default=3, help="Documentos del corpus que se procesan")
+    parser.add_argument("--pages", type=int, default=8, help="Páginas de los PDFs sintéticos")
+    parser.add_argument("--calls", type=int, default=20, help="Llamadas al LLM por documento")
+    parser.add_argument("--concurrency", type=int, default=4, help="Llamadas simultáneas por documento")
+    parser.add_argument("--hold-ms", type=float, default=20.0, help="Tiempo que cada petición sigue en memoria")
+    parser.add_argument("--providers", default="openai,claude,gemini,ollama")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    corpus = load_corpus(args.corpus, args.documents, args.pages)
+    builders = request_builders()
+    results: Dict[str, Any] = {"documents": len(corpus), "calls_per_document": args.calls, "providers": {}}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for provider in filter(None, args.providers.split(",")):
+            modes = {mode: run_mode(corpus, mode, builders[provider], args, work_dir) for mode in MODES}
+            disk, memory = modes["disk"], modes["memory"]
+            modes["cpu_per_call_ratio"] = (
+                round(disk["cpu_ms_per_call"] / memory["cpu_ms_per_call"], 1) if memory["cpu_ms_per_call"] else None
+            )
+            modes["peak_memory_ratio"] = round(disk["peak_mb"] / memory["peak_mb"], 2) if memory["peak_mb"] else None
+            results["providers"][provider] = modes
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Benchmark offline del pipeline con el proveedor LLM simulado.
+
+Ejecuta `PDFPipeline.extract_data_from_pdf` y `process_message` sobre un corpus
+de PDFs (o PDFs sintéticos) con MinIO y MongoDB en memoria, y reporta el tiempo
+por etapa, CPU, RSS máximo y tareas/hora. Con `--baseline` compara contra una
+ejecución guardada y termina con error si alguna métrica empeora más de `--tolerance`:
+
+    python -m ps3_worker.benchmarks.pipeline_benchmark --tasks 20 --latency-ms 200 --save-baseline baseline.json
+    python -m ps3_worker.benchmarks.pipeline_benchmark --tasks 20 --latency-ms 200 --baseline baseline.json
+
+Con `--replay` las respuestas salen de un archivo grabado con tráfico real
+(`LLM_RECORD_MODE=record`) y se reportan las peticiones que no estaban grabadas.
+Con `--cascade` un segundo proveedor simulado (`--cheap-latency-ms`) hace de
+modelo barato y se reporta la tasa de escalado por esquema. Con
+`--artifact-cache` las tareas comparten una caché de artefactos nueva (los
+PDFs repetidos y el segundo modo de `--mode both` la encuentran caliente);
+sin él no se usa la caché, para medir siempre la conversión completa.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import fitz
+
+from ps3_worker.benchmarks.inmemory import InMemoryMinioManager, InMemoryMongoManager
+from ps3_worker.constants import LLM_PROVIDER, LLM_MODEL_NAME, MINIO_BUCKET_PDFS
+from ps3_worker.services.artifact_cache import ArtifactCache
+from ps3_worker.services.fake_llm import FakeChatClient
+from ps3_worker.services.llm_cascade import CascadeChatClient
+from ps3_worker.services.llm_recorder import ReplayChatClient, get_archive
+from ps3_worker.services.minio_service import MinioService
+from ps3_worker.services.mongo_service import MongoService
+from ps3_worker.services.pdf_pipeline import PDFPipeline
+from ps3_worker.services.task_state_writer import task_state_writer
+from ps3_worker.services.tracing import Span, tracer
+from ps3_worker.services.vllm_client import LLMProvider, VLLMChatClient
+
+# Métricas comparadas con el baseline: True si un valor mayor es peor
+COMPARED_METRICS = {
+    "wall_s": True,
+    "cpu_s": True,
+    "peak_rss_mb": True,
+    "tasks_per_hour": False,
+}
+
+
+def synthetic_pdf(index: int, pages: int) -> bytes:
+    """PDF con texto y figuras simples, distinto para cada índice"""
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Synthetic study {index} - page {page_number + 1}", fontsize=16)
+        for line in range(40):
+            page.insert_text((72, 110 + line * 16), f"MYH7 p.Arg{403 + line}Gln functional assay replicate {line}")
+        page.draw_rect(fitz.Rect(320, 500, 520, 700), color=(0, 0, 0), fill=(0.8, 0.8, 0.8))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def load_corpus(corpus_dir: str, tasks: int, pages: int) -> List[Tuple[str, bytes]]:
+    paths = sorted(glob.glob(os.path.join(corpus_dir, "*.pdf"))) if corpus_dir else []
+    if paths:
+        documents = []
+        for path in paths:
+            with open(path, "rb") as f:
+                documents.append((os.path.basename(path), f.read()))
+        return [documents[i % len(documents)] for i in range(tasks)]
+    return [(f"synthetic_{i}.pdf", synthetic_pdf(i, pages)) for i in range(tasks)]
+
+
+class StageTimes:
+    """Listener del tracer que acumula el tiempo de cada etapa"""
+
+    def __init__(self):
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    def __call__(self, span: Span):
+        self.totals[span.name] += span.duration_s
+        self.counts[span.name] += 1
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"count": self.counts[name], "total_s": round(total, 4)}
+            for name, total in sorted(self.totals.items())
+        }
+
+
+def _usage() -> Tuple[float, float]:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    peak_rss = usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+    return usage.ru_utime + usage.ru_stime, peak_rss
+
+
+async def _run_pipeline(corpus, make_pipeline, work_dir: str) -> Tuple[int, int]:
+    completed = failed = 0
+    for i, (filename, pdf_bytes) in enumerate(corpus):
+        pipeline = make_pipeline()
+        output_path = os.path.join(work_dir, f"pipeline_{i}")
+        with tracer.task(f"bench-pipeline-{i}"):
+            try:
+                await pipeline.extract_data_from_pdf(pdf_bytes, output_path, filename=filename)
+                completed += 1
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"{filename}: {e}")
+                failed += 1
+    return completed, failed
+
+
+async def _run_consumer(corpus, make_pipeline, dedup: bool) -> Tuple[int, int]:
+    from ps3_worker.consumers.data_consumer_in import process_message
+
+    minio_manager = InMemoryMinioManager()
+    mongo_manager = InMemoryMongoManager()
+    task_state_writer.mongo_service = MongoService(mongo_manager=mongo_manager)
+
+    def services_factory():
+        return MinioService(minio_manager=minio_manager), MongoService(mongo_manager=mongo_manager), \
+            make_pipeline()
+
+    completed = failed = 0
+    for filename, pdf_bytes in corpus:
+        task_id = uuid.uuid4().hex
+        minio_manager.put(MINIO_BUCKET_PDFS, f"{task_id}/pdfs/{filename}", pdf_bytes)
+        body = json.dumps({
+            "task_id": task_id,
+            "filename": filename,
+            "minio_path": f"{task_id}/pdfs/{filename}",
+            "force": not dedup,
+        }).encode()
+        try:
+            await process_message(body, services_factory=services_factory)
+            completed += 1
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"{filename}: {e}")
+            failed += 1
+    task_state_writer.flush()
+    return completed, failed
+
+
+async def run(args) -> Dict[str, dict]:
+    corpus = load_corpus(args.corpus, args.tasks, args.pages)
+    fake_clients: List[FakeChatClient] = []
+    cascades: List[CascadeChatClient] = []
+
+    archive = get_archive(args.replay) if args.replay else None
+
+    def make_client() -> VLLMChatClient:
+        if archive is not None:
+            replay = ReplayChatClient(args.provider, args.model, archive, simulate_latency=args.replay_latency)
+            return VLLMChatClient(LLMProvider(args.provider), args.model, client=replay)
+        fake = FakeChatClient(
+            fixtures_dir=args.fixtures,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            seed=args.seed + len(fake_clients),
+            array_items=args.variants
+        )
+        fake_clients.append(fake)
+        if not args.cascade:
+            return VLLMChatClient(LLMProvider.fake, "fake", client=fake)
+
+        cheap = FakeChatClient(
+            model_name="fake-cheap",
+            fixtures_dir=args.fixtures,
+            latency_ms=args.cheap_latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            seed=args.seed + 1000 + len(fake_clients),
+            array_items=args.variants
+        )
+        fake_clients.append(cheap)
+        cascade = CascadeChatClient(cheap, fake, audit_rate=args.audit_rate, seed=args.seed)
+        cascades.append(cascade)
+        return VLLMChatClient(LLMProvider.fake, "fake", client=cascade)
+
+    modes = ["pipeline", "consumer"] if args.mode == "both" else [args.mode]
+    results: Dict[str, dict] = {}
+    tracer.exporter = "none"
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        artifact_cache = ArtifactCache(os.path.join(work_dir, "artifacts")) if args.artifact_cache else None
+
+        def make_pipeline() -> PDFPipeline:
+            return PDFPipeline(
+                vllm_client=make_client(), artifact_cache=artifact_cache, cache_artifacts=artifact_cache is not None
+            )
+
+        for mode in modes:
+            stages = StageTimes()
+            tracer.span_listeners.append(stages)
+            calls_before = sum(fake.calls for fake in fake_clients)
+            cpu_before, _ = _usage()
+            started = time.perf_counter()
+            try:
+                if mode == "pipeline":
+                    completed, failed = await _run_pipeline(corpus, make_pipeline, work_dir)
+                else:
+                    completed, failed = await _run_consumer(corpus, make_pipeline, args.dedup)
+            finally:
+                tracer.span_listeners.remove(stages)
+            wall = time.perf_counter() - started
+            cpu_after, peak_rss = _usage()
+
+            results[mode] = {
+                "tasks": len(corpus),
+                "completed": completed,
+                "failed": failed,
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu_after - cpu_before, 3),
+                "peak_rss_mb": round(peak_rss, 1),
+                "tasks_per_hour": round(completed / wall * 3600, 1) if wall else 0.0,
+                "llm_calls": sum(fake.calls for fake in fake_clients) - calls_before,
+                "stages": stages.report(),
+            }
+
+    if archive is not None:
+        results["replay"] = archive.report()
+    if cascades:
+        results["cascade"] = merge_cascade_reports([cascade.report() for cascade in cascades])
+    return results
+
+
+def merge_cascade_reports(reports: List[Dict[str, dict]]) -> Dict[str, dict]:
+    merged: Dict[str, dict] = {}
+    for report in reports:
+        for schema, stats in report.items():
+            total = merged.setdefault(schema, {"calls": 0, "escalated": 0, "reasons": defaultdict(int), "agreement": []})
+            total["calls"] += stats["calls"]
+            total["escalated"] += stats["escalated"]
+            for reason, count in stats["reasons"].items():
+                total["reasons"][reason] += count
+            if stats["agreement"] is not None:
+                total["agreement"].append(stats["agreement"])
+    return {
+        schema: {
+            "calls": total["calls"],
+            "escalation_rate": round(total["escalated"] / total["calls"], 3) if total["calls"] else 0.0,
+            "reasons": dict(total["reasons"]),
+            "agreement": round(sum(total["agreement"]) / len(total["agreement"]), 3) if total["agreement"] else None,
+        }
+        for schema, total in sorted(merged.items())
+    }
+
+
+def compare_with_baseline(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Lista de regresiones (métricas que empeoran más que la tolerancia)"""
+    regressions = []
+    for mode, current in results.items():
+        previous = baseline.get(mode)
+        if not previous or "wall_s" not in current:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{mode}.{metric}: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline de PDFs")
+    parser.add_argument("--corpus", default="", help="Directorio con PDFs de ejemplo (por defecto, PDFs sintéticos)")
+    parser.add_argument("--tasks", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=8, help="Páginas de los PDFs sintéticos")
+    parser.add_argument("--mode", choices=["pipeline", "consumer", "both"], default="both")
+    parser.add_argument("--fixtures", default="", help="Directorio con respuestas grabadas ({Schema}.json)")
+    parser.add_argument("--replay", default="", help="Archivo grabado con LLM_RECORD_MODE=record (en lugar del proveedor simulado)")
+    parser.add_argument("--replay-latency", action="store_true", help="Reproducir la latencia grabada")
+    parser.add_argument("--provider", default=LLM_PROVIDER, help="Proveedor grabado en el archivo de replay")
+    parser.add_argument("--model", default=LLM_MODEL_NAME, help="Modelo grabado en el archivo de replay")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--cascade", action="store_true", help="Modelo barato simulado delante del principal")
+    parser.add_argument("--cheap-latency-ms", type=float, default=0.0, help="Latencia del modelo barato (--cascade)")
+    parser.add_argument("--audit-rate", type=float, default=0.0, help="Respuestas aceptadas que se auditan (--cascade)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--variants", type=int, default=3, help="Variantes por PDF en las respuestas sintéticas")
+    parser.add_argument("--dedup", action="store_true", help="No forzar el reprocesado de PDFs repetidos")
+    parser.add_argument("--artifact-cache", action="store_true", help="Compartir una caché de artefactos entre tareas")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default="", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--save-baseline", default="", help="Guardar los resultados como baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("Regresiones respecto al baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print("Sin regresiones respecto al baseline")
+
+
+if __name__ == "__main__":
+    main()
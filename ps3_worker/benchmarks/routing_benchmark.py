@@ -0,0 +1,126 @@
+"""
+Benchmark del router de proveedores con proveedores simulados.
+
+Cada proveedor tiene una latencia lognormal con una fracción de peticiones
+atascadas (`--stall-rate`, `--stall-ms`) y una tasa de errores propia. Se
+comparan tres configuraciones con las mismas peticiones: un solo proveedor,
+failover sin hedging y failover con hedging en el p95, y se reportan los
+percentiles de latencia, errores e intentos lanzados por petición:
+
+    python -m ps3_worker.benchmarks.routing_benchmark --requests 300 --median-ms 200 --stall-rate 0.05
+"""
+import argparse
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from ps3_shared.entities.gene_variant import FunctionalVariants
+from ps3_worker.services.fake_llm import FakeChatClient
+from ps3_worker.services.llm_router import LatencyTracker, Route, RoutingChatClient
+
+
+def latency_distribution(median_ms: float, sigma: float, stall_rate: float, stall_ms: float) -> Callable:
+    """Lognormal alrededor de `median_ms` con atascos ocasionales de `stall_ms`"""
+    mu = math.log(max(median_ms, 1e-3))
+
+    def sample(rng) -> float:
+        if stall_rate and rng.random() < stall_rate:
+            return stall_ms
+        return rng.lognormvariate(mu, sigma)
+
+    return sample
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def run_scenario(router: RoutingChatClient, fakes: List[FakeChatClient], args) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+
+    def request(index: int):
+        started = time.perf_counter()
+        try:
+            router.send_message_once(f"petición {index}", model=FunctionalVariants)
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, e
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for latency, error in pool.map(request, range(args.requests)):
+            latencies.append(latency)
+            errors += error is not None
+
+    calls = sum(fake.calls for fake in fakes)
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "attempts_per_request": round(calls / args.requests, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del router de proveedores LLM")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--providers", type=int, default=2, help="Proveedores simulados")
+    parser.add_argument("--median-ms", type=float, default=200.0)
+    parser.add_argument("--sigma", type=float, default=0.25, help="Dispersión de la lognormal")
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall-ms", type=float, default=2000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tasa de errores del proveedor primario")
+    parser.add_argument("--quantile", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    distribution = latency_distribution(args.median_ms, args.sigma, args.stall_rate, args.stall_ms)
+
+    def build(providers: int, hedge: bool):
+        fakes = [
+            FakeChatClient(
+                model_name=f"fake-{i}",
+                seed=args.seed + i,
+                latency_fn=distribution,
+                error_rate=args.error_rate if i == 0 else 0.0,
+                read_images=False
+            )
+            for i in range(providers)
+        ]
+        # El primario recibe todo el tráfico; el resto solo failover y hedging
+        routes = [Route(f"fake/{fake.model_name}", fake, 1.0 if i == 0 else 0.0) for i, fake in enumerate(fakes)]
+        router = RoutingChatClient(
+            routes,
+            tracker=LatencyTracker(),
+            hedge=hedge,
+            hedge_quantile=args.quantile,
+            hedge_min_delay_s=0.0,
+            hedge_default_delay_s=args.stall_ms / 1000,
+            seed=args.seed
+        )
+        return router, fakes
+
+    results = {}
+    for name, providers, hedge in (
+        ("single", 1, False),
+        ("failover", args.providers, False),
+        ("hedged", args.providers, True),
+    ):
+        router, fakes = build(providers, hedge)
+        results[name] = run_scenario(router, fakes, args)
+        results[name]["latency"] = router.tracker.snapshot()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Prueba de carga del SSEService.
+
+Simula miles de tareas concurrentes emitiendo progreso, con varios suscriptores
+por tarea (algunos lentos), y reporta memoria y latencia de entrega de eventos:
+
+    python -m ps3_worker.benchmarks.sse_load --tasks 5000 --subscribers 2 --slow-ratio 0.2
+"""
+import argparse
+import asyncio
+import random
+import resource
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from typing import List
+
+from ps3_worker.services.sse_service import EventQueue, SSEService
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _produce(service: SSEService, task_id: str, n_events: int, interval: float):
+    for i in range(n_events):
+        await service.send_progress_event(task_id, "processing", int(i * 100 / n_events), f"Paso {i}")
+        await asyncio.sleep(interval)
+    await service.send_completion_event(task_id, {"events": n_events})
+
+
+async def _consume(queue: EventQueue, delay: float, latencies: List[float], completed: List[int]):
+    while True:
+        event = await queue.get()
+        sent_at = datetime.fromisoformat(event["timestamp"])
+        latencies.append((datetime.now() - sent_at).total_seconds() * 1000)
+        if event["event"] == "completion":
+            completed.append(1)
+            return
+        if delay:
+            await asyncio.sleep(delay)
+
+
+async def run(args) -> dict:
+    service = SSEService(history_maxlen=args.history)
+    rng = random.Random(args.seed)
+    latencies: List[float] = []
+    completed: List[int] = []
+    queues: List[EventQueue] = []
+    consumers = []
+
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    for task in range(args.tasks):
+        task_id = f"task-{task}"
+        for _ in range(args.subscribers):
+            queue = await service.register_connection(task_id, maxsize=args.queue_size)
+            queues.append(queue)
+            delay = args.slow_delay if rng.random() < args.slow_ratio else 0.0
+            consumers.append(asyncio.create_task(_consume(queue, delay, latencies, completed)))
+
+    producers = [
+        _produce(service, f"task-{task}", args.events, args.interval)
+        for task in range(args.tasks)
+    ]
+    await asyncio.gather(*producers)
+    await asyncio.wait_for(asyncio.gather(*consumers), timeout=args.timeout)
+
+    elapsed = time.perf_counter() - started
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "tasks": args.tasks,
+        "subscribers": len(queues),
+        "events_sent": args.tasks * (args.events + 1),
+        "events_delivered": len(latencies),
+        "events_coalesced": sum(queue.coalesced for queue in queues),
+        "events_dropped": sum(queue.dropped for queue in queues),
+        "completions_delivered": len(completed),
+        "elapsed_s": round(elapsed, 3),
+        "latency_ms_p50": round(statistics.median(latencies), 3) if latencies else 0.0,
+        "latency_ms_p95": round(_percentile(latencies, 95), 3),
+        "latency_ms_p99": round(_percentile(latencies, 99), 3),
+        "tracemalloc_peak_mb": round(peak_bytes / 1024 / 1024, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio SSE")
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=50, help="Eventos de progreso por tarea")
+    parser.add_argument("--subscribers", type=int, default=2, help="Suscriptores por tarea")
+    parser.add_argument("--slow-ratio", type=float, default=0.2, help="Fracción de suscriptores lentos")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="Retardo por evento de un suscriptor lento (s)")
+    parser.add_argument("--interval", type=float, default=0.001, help="Intervalo entre eventos de una tarea (s)")
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--history", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+    # Los eventos terminales nunca se descartan: cada suscriptor debe recibir su completion
+    if report["completions_delivered"] != report["subscribers"]:
+        raise SystemExit("Se perdieron eventos terminales")
+
+
+if __name__ == "__main__":
+    main()
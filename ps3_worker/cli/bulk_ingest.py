@@ -0,0 +1,647 @@
+"""
+Ingesta masiva de PDFs sin AMQP.
+
+Procesa un directorio (recursivo) o un manifiesto de PDFs con el mismo
+`PDFPipeline` que el consumer, con `--concurrency` documentos a la vez y
+`--variant-concurrency` extracciones por variante simultáneas en cada uno, y
+escribe los resultados en parquet local o en MinIO (archivos por tarea y/o
+dataset particionado, según `--write-mode`). Pensado para cargas iniciales de
+corpus grandes y para planificar capacidad:
+
+    python -m ps3_worker.cli.bulk_ingest --input papers/ --output local:results/ --concurrency 8
+    python -m ps3_worker.cli.bulk_ingest --manifest corpus.txt --output minio --concurrency 16 --limit 200
+
+El manifiesto tiene una ruta por línea o un objeto JSON por línea
+(`{"path": "a.pdf", "keep_pages": [3], "drop_pages": [12]}`); las rutas
+relativas son relativas al manifiesto.
+
+Cada documento terminado se añade al archivo de estado (`--state`, JSONL), así
+que una ejecución interrumpida se retoma donde se quedó: se saltan los
+documentos completados, sin datos y los fallos permanentes (salvo con
+`--retry-failed`) y se reintentan los fallos transitorios. Un primer Ctrl+C
+deja de lanzar documentos y espera a los que están en curso; el segundo los
+cancela. Al terminar se imprime un informe JSON con el rendimiento, el
+consumo de tokens y el coste estimado con los precios de `LLM_PRICES_PATH`.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ps3_worker.constants import LLM_PRICES_PATH, LLM_VARIANT_CONCURRENCY, PARQUET_WRITE_MODE
+from ps3_worker.errors import PermanentTaskError, TransientTaskError, classify_failure
+from ps3_worker.services.dedup_service import compute_content_hash
+from ps3_worker.services.pdf_pipeline import PDFPipeline
+from ps3_worker.services.tracing import TaskTrace, tracer
+
+logger = logging.getLogger(__name__)
+
+# Estados finales de un documento en el archivo de estado
+DONE_STATUSES = ("completed", "duplicate", "no_data")
+TASK_ID_PREFIX = "bulk-"
+
+
+def find_pdfs(input_dir: str) -> List[Dict[str, Any]]:
+    """PDFs de un directorio y sus subdirectorios, en orden estable"""
+    items = []
+    for directory, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(".pdf"):
+                items.append({"path": os.path.abspath(os.path.join(directory, name))})
+    return sorted(items, key=lambda item: item["path"])
+
+
+def read_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """Entradas de un manifiesto: una ruta o un objeto JSON (`path`, `keep_pages`, `drop_pages`) por línea"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    items = []
+    with open(manifest_path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line) if line.startswith("{") else {"path": line}
+                path = item["path"]
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Línea {number} del manifiesto no válida: {e}")
+            item["path"] = os.path.abspath(os.path.join(base_dir, path))
+            for key in ("keep_pages", "drop_pages"):
+                if item.get(key):
+                    item[key] = [int(page) for page in item[key]]
+            items.append(item)
+    return items
+
+
+class IngestState:
+    """
+    Archivo JSONL con el resultado de cada documento procesado. Se escribe una
+    línea por documento al terminarlo (con fsync), de modo que una ejecución
+    interrumpida solo repite los documentos que estaban en curso. Si un
+    documento aparece varias veces, cuenta la última.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.records[record["path"]] = record
+                    except (KeyError, ValueError):
+                        # Última línea a medias si el proceso murió mientras escribía
+                        continue
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def should_skip(self, path: str, retry_failed: bool = False) -> bool:
+        record = self.records.get(path)
+        if record is None:
+            return False
+        if record["status"] in DONE_STATUSES:
+            return True
+        return record["status"] == "failed" and not record.get("transient") and not retry_failed
+
+    def completed_by_hash(self) -> Dict[str, Dict[str, Any]]:
+        """Documentos completados por hash del contenido, para no repetir copias del mismo PDF"""
+        return {
+            record["content_hash"]: record for record in self.records.values()
+            if record["status"] == "completed" and record.get("content_hash")
+        }
+
+    def append(self, record: Dict[str, Any]):
+        self.records[record["path"]] = record
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _write_parquet(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+
+
+class LocalParquetSink:
+    """
+    Resultados en un directorio local con la misma estructura que en MinIO:
+    `<root>/<task_id>/parquets/...` (archivos por tarea) y `<root>/dataset/`
+    (dataset particionado por gen y fecha de ingesta).
+    """
+
+    def __init__(self, root: str, write_mode: str = PARQUET_WRITE_MODE):
+        self.root = os.path.abspath(root)
+        self.write_mode = write_mode
+        self._dataset_writer = None
+
+    def describe(self) -> str:
+        return f"local:{self.root}"
+
+    def write(
+        self,
+        task_id: str,
+        filename: str,
+        content_hash: str,
+        df_odds_path: pd.DataFrame,
+        df_explanations: pd.DataFrame
+    ) -> List[Any]:
+        """Rutas de los parquets por tarea y referencia al dataset"""
+        outputs: List[Any] = []
+        if self.write_mode in ("files", "both"):
+            name = os.path.splitext(filename)[0] + ".parquet"
+            for parquet_type, df in (("odds_path", df_odds_path), ("explanations", df_explanations)):
+                if df.empty:
+                    continue
+                path = os.path.join(self.root, task_id, "parquets", f"{parquet_type}_{name}")
+                _write_parquet(df, path)
+                outputs.append(path)
+        if self.write_mode in ("dataset", "both"):
+            if self._dataset_writer is None:
+                import pyarrow.fs as pafs
+                from ps3_worker.services.research_dataset import ResearchDatasetWriter
+                self._dataset_writer = ResearchDatasetWriter(
+                    filesystem=pafs.LocalFileSystem(), root=os.path.join(self.root, "dataset")
+                )
+            # Referencia (raíz + filtro por task_id), válida aunque se compacte el dataset
+            outputs.append(self._dataset_writer.write_task_results(df_odds_path, df_explanations, task_id, content_hash))
+        return outputs
+
+
+class MinioSink:
+    """Resultados en MinIO, igual que los escribe el consumer"""
+
+    def __init__(self, write_mode: str = PARQUET_WRITE_MODE):
+        from ps3_worker.services.minio_service import MinioService
+
+        self.write_mode = write_mode
+        self.minio_service = MinioService()
+        self._dataset_writer = None
+
+    def describe(self) -> str:
+        return "minio"
+
+    def write(
+        self,
+        task_id: str,
+        filename: str,
+        content_hash: str,
+        df_odds_path: pd.DataFrame,
+        df_explanations: pd.DataFrame
+    ) -> List[Any]:
+        """Rutas de los parquets por tarea y referencia al dataset"""
+        outputs: List[Any] = []
+        if self.write_mode in ("files", "both"):
+            from ps3_worker.consumers.data_consumer_in import upload_task_parquets
+            outputs.extend(upload_task_parquets(self.minio_service, task_id, filename, df_odds_path, df_explanations))
+        if self.write_mode in ("dataset", "both"):
+            if self._dataset_writer is None:
+                from ps3_worker.services.research_dataset import ResearchDatasetWriter
+                self._dataset_writer = ResearchDatasetWriter()
+            # Referencia (raíz + filtro por task_id), válida aunque se compacte el dataset
+            outputs.append(self._dataset_writer.write_task_results(df_odds_path, df_explanations, task_id, content_hash))
+        return outputs
+
+
+def make_sink(output: str, write_mode: str):
+    """`minio` o `local:<directorio>` (también basta el directorio)"""
+    if output == "minio":
+        return MinioSink(write_mode)
+    return LocalParquetSink(output[len("local:"):] if output.startswith("local:") else output, write_mode)
+
+
+def load_prices(path: str = LLM_PRICES_PATH) -> Dict[str, Dict[str, float]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"No se pudieron cargar los precios de {path}: {e}")
+        return {}
+
+
+def estimate_cost(usage: Dict[str, Any], prices: Dict[str, Dict[str, float]]) -> Optional[float]:
+    """Coste en USD del consumo de un modelo; None si el modelo no tiene precio"""
+    price = prices.get(usage.get("model") or "")
+    if price is None:
+        return None
+    input_tokens = usage.get("input_tokens", 0)
+    cached_tokens = usage.get("cached_tokens", 0)
+    # Claude cuenta los tokens leídos de la caché aparte; el resto los incluye en input_tokens
+    uncached = input_tokens if usage.get("provider") == "claude" else max(input_tokens - cached_tokens, 0)
+    cost = (
+        uncached * price.get("input", 0.0)
+        + cached_tokens * price.get("cached_input", price.get("input", 0.0))
+        + usage.get("output_tokens", 0) * price.get("output", 0.0)
+    ) / 1e6
+    return round(cost, 6)
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class BulkIngest:
+    """Procesa una lista de PDFs con un pipeline compartido y concurrencia por documento"""
+
+    def __init__(
+        self,
+        pipeline: PDFPipeline,
+        sink,
+        state: IngestState,
+        concurrency: int = 4,
+        retry_failed: bool = False,
+        progress_interval_s: float = 5.0
+    ):
+        self.pipeline = pipeline
+        self.sink = sink
+        self.state = state
+        self.concurrency = max(1, concurrency)
+        self.retry_failed = retry_failed
+        self.progress_interval_s = progress_interval_s
+        self.stop = asyncio.Event()
+        self.records: List[Dict[str, Any]] = []
+        self.in_flight = 0
+        self._completed_by_hash = state.completed_by_hash()
+        self._pending_by_hash: Dict[str, asyncio.Future] = {}
+        self._total = 0
+        self._started = 0.0
+        self._last_progress = 0.0
+
+    async def run(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        pending = [item for item in items if not self.state.should_skip(item["path"], self.retry_failed)]
+        self._total = len(pending)
+        self._started = time.perf_counter()
+        cpu_started = time.process_time()
+        logger.info(
+            f"Ingesta masiva: {len(pending)} documentos pendientes de {len(items)} "
+            f"({len(items) - len(pending)} ya procesados), concurrencia {self.concurrency}"
+        )
+
+        iterator = iter(pending)
+        workers = [asyncio.create_task(self._worker(iterator)) for _ in range(min(self.concurrency, len(pending)))]
+        self._install_signal_handlers(workers)
+        try:
+            results = await asyncio.gather(*workers, return_exceptions=True)
+            for result in results:
+                # Los documentos cancelados con el segundo Ctrl+C quedan pendientes para la próxima ejecución
+                if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                    raise result
+        finally:
+            self._remove_signal_handlers()
+            self._print_progress(force=True)
+
+        report = self.report(time.perf_counter() - self._started, time.process_time() - cpu_started)
+        report["documents"]["listed"] = len(items)
+        report["documents"]["skipped"] = len(items) - len(pending)
+        report["documents"]["not_started"] = len(pending) - len(self.records)
+        return report
+
+    async def _worker(self, iterator: Iterator[Dict[str, Any]]):
+        while not self.stop.is_set():
+            item = next(iterator, None)
+            if item is None:
+                return
+            self.in_flight += 1
+            try:
+                record = await self.process(item)
+            finally:
+                self.in_flight -= 1
+            self.state.append(record)
+            self.records.append(record)
+            self._print_progress()
+
+    async def process(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Procesa un documento y devuelve su registro para el archivo de estado"""
+        path = item["path"]
+        record: Dict[str, Any] = {"path": path}
+        started = time.perf_counter()
+        try:
+            pdf_bytes = await asyncio.to_thread(self._read, path)
+            content_hash = compute_content_hash(pdf_bytes)
+            task_id = TASK_ID_PREFIX + content_hash[:32]
+            record.update(content_hash=content_hash, task_id=task_id)
+
+            # Copias del mismo PDF (en esta ejecución o en una anterior) reutilizan el resultado
+            original = await self._wait_for_original(content_hash)
+            if original is not None:
+                record.update(status="duplicate", duplicate_of=original["path"], outputs=original.get("outputs", []))
+                return record
+
+            future = asyncio.get_running_loop().create_future()
+            self._pending_by_hash[content_hash] = future
+            try:
+                await self._extract(item, pdf_bytes, record)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Se marca como recuperada para que asyncio no avise si no hay copias esperando
+                future.exception()
+                raise
+            else:
+                self._completed_by_hash[content_hash] = record
+                future.set_result(record)
+            finally:
+                if self._pending_by_hash.get(content_hash) is future:
+                    self._pending_by_hash.pop(content_hash, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failure = classify_failure(e)
+            logger.error(f"Error procesando {path} ({failure.reason}): {e}")
+            record.update(
+                status="no_data" if failure.reason == "no_data" else "failed",
+                reason=failure.reason,
+                transient=failure.transient,
+                error=str(e)[:1000]
+            )
+        finally:
+            record["duration_s"] = round(time.perf_counter() - started, 3)
+            record["finished_at"] = datetime.now().isoformat()
+        return record
+
+    async def _wait_for_original(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Espera a la copia del mismo PDF que se está extrayendo y devuelve su registro.
+
+        Devuelve None si esta copia debe extraerlo: no hay otra en curso o la original
+        falló de forma transitoria y esta es la primera en retomarla. Un fallo permanente
+        de la original, o un segundo fallo transitorio, se propaga a las copias que esperan
+        para no repetir la extracción completa por cada una.
+        """
+        failed_once = False
+        while True:
+            original = self._completed_by_hash.get(content_hash)
+            if original is not None:
+                return original
+            pending = self._pending_by_hash.get(content_hash)
+            if pending is None:
+                return None
+
+            # asyncio.wait no cancela la futura ni lanza su excepción
+            await asyncio.wait([pending])
+            if pending.cancelled():
+                error: BaseException = TransientTaskError("Extracción de la copia original cancelada", reason="cancelled")
+            elif pending.exception() is None:
+                return pending.result()
+            else:
+                error = pending.exception()
+
+            if failed_once or not classify_failure(error).transient:
+                raise error
+            # Solo la primera copia que despierte encuentra la entrada libre y la retoma;
+            # el resto espera a esa nueva extracción y recibe su resultado o su fallo
+            failed_once = True
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def _extract(self, item: Dict[str, Any], pdf_bytes: bytes, record: Dict[str, Any]):
+        """Ejecuta el pipeline y escribe los resultados; completa `record` aunque falle"""
+        task_id, content_hash = record["task_id"], record["content_hash"]
+        filename = os.path.basename(item["path"])
+        page_overrides = {key: item[key] for key in ("keep_pages", "drop_pages") if item.get(key)}
+        with tempfile.TemporaryDirectory() as temp_dir, tracer.task(task_id, source="bulk_ingest") as trace:
+            try:
+                # Sin task_id el pipeline no publica progreso por SSE ni estado en MongoDB
+                df_odds_path, df_explanations = await self.pipeline.extract_data_from_pdf(
+                    pdf_bytes, os.path.join(temp_dir, "images"), None, filename=filename, **page_overrides
+                )
+                if df_odds_path.empty and df_explanations.empty:
+                    raise PermanentTaskError("No se pudieron extraer datos del PDF", reason="no_data")
+
+                with tracer.span("upload", destination=self.sink.describe()):
+                    outputs = await asyncio.to_thread(
+                        self.sink.write, task_id, filename, content_hash, df_odds_path, df_explanations
+                    )
+                record.update(status="completed", rows=len(df_odds_path), outputs=outputs)
+            finally:
+                # El consumo de los documentos fallidos también cuenta en el coste
+                record.update(self._trace_usage(trace))
+
+    @staticmethod
+    def _trace_usage(trace: TaskTrace) -> Dict[str, Any]:
+        summary = trace.summary()
+        pages = sum(
+            int(span.attributes.get("pages") or 0) for span in trace.spans if span.name == "rasterize"
+        )
+        return {
+            "pages": pages,
+            "stages": {name: stage["total_s"] for name, stage in summary["stages"].items()},
+            "llm": summary["llm"],
+        }
+
+    def _install_signal_handlers(self, workers: List[asyncio.Task]):
+        loop = asyncio.get_running_loop()
+
+        def interrupt():
+            if self.stop.is_set():
+                logger.warning("Cancelando los documentos en curso; se repetirán al retomar la ingesta")
+                for worker in workers:
+                    worker.cancel()
+                return
+            self.stop.set()
+            logger.warning(
+                f"Interrupción recibida: esperando a {self.in_flight} documentos en curso "
+                "(Ctrl+C de nuevo para cancelarlos)"
+            )
+
+        try:
+            loop.add_signal_handler(signal.SIGINT, interrupt)
+            loop.add_signal_handler(signal.SIGTERM, interrupt)
+        except (NotImplementedError, RuntimeError):
+            # Fuera del hilo principal o en plataformas sin señales en el bucle
+            pass
+
+    def _remove_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    def _print_progress(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last_progress < self.progress_interval_s:
+            return
+        self._last_progress = now
+        done = len(self.records)
+        statuses = Counter(record["status"] for record in self.records)
+        elapsed = now - self._started
+        # Sin un segundo de historia la velocidad no es representativa
+        rate = done / elapsed if elapsed >= 1 else 0.0
+        speed = f"{rate * 60:.1f} docs/min" if rate else "- docs/min"
+        eta = _format_duration((self._total - done) / rate) if rate else "-"
+        print(
+            f"[{done}/{self._total}] completados={statuses['completed']} duplicados={statuses['duplicate']} "
+            f"sin_datos={statuses['no_data']} fallidos={statuses['failed']} en_curso={self.in_flight} | "
+            f"{speed} | transcurrido {_format_duration(elapsed)} | ETA {eta}",
+            file=sys.stderr,
+            flush=True
+        )
+
+    def report(self, wall_s: float, cpu_s: float, prices: Optional[Dict[str, Dict[str, float]]] = None) -> Dict[str, Any]:
+        """Rendimiento, consumo de tokens y coste estimado de los documentos procesados en esta ejecución"""
+        prices = load_prices() if prices is None else prices
+        statuses = Counter(record["status"] for record in self.records)
+        failures = Counter(record.get("reason") for record in self.records if record["status"] == "failed")
+        processed = [record for record in self.records if record.get("llm")]
+
+        by_model: Dict[tuple, Dict[str, Any]] = {}
+        for record in processed:
+            for usage in record["llm"].get("by_model", []):
+                key = (usage.get("provider"), usage.get("model"))
+                totals = by_model.setdefault(key, defaultdict(float, provider=key[0], model=key[1]))
+                for counter, value in usage.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        totals[counter] += value
+        models = []
+        for totals in by_model.values():
+            usage = {key: (round(value, 3) if isinstance(value, float) else value) for key, value in totals.items()}
+            for counter in ("calls", "errors", "images", "input_tokens", "output_tokens", "cached_tokens", "retries"):
+                usage[counter] = int(usage.get(counter, 0))
+            usage["cost_usd"] = estimate_cost(usage, prices)
+            models.append(usage)
+        costs = [usage["cost_usd"] for usage in models if usage["cost_usd"] is not None]
+        cost_usd = round(sum(costs), 4) if costs else None
+
+        stages: Dict[str, float] = defaultdict(float)
+        for record in processed:
+            for name, seconds in record.get("stages", {}).items():
+                stages[name] += seconds
+
+        completed = statuses["completed"]
+        pages = sum(record.get("pages", 0) for record in self.records)
+        llm_calls = sum(usage["calls"] for usage in models)
+        return {
+            "documents": {
+                "processed": len(self.records),
+                "completed": completed,
+                "duplicates": statuses["duplicate"],
+                "no_data": statuses["no_data"],
+                "failed": statuses["failed"],
+                "failures": dict(failures),
+            },
+            "concurrency": {
+                "documents": self.concurrency,
+                "variants_per_document": self.pipeline.variant_concurrency,
+            },
+            "wall_s": round(wall_s, 2),
+            "cpu_s": round(cpu_s, 2),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "throughput": {
+                "documents_per_hour": round(len(self.records) / wall_s * 3600, 1) if wall_s else 0.0,
+                "pages_per_hour": round(pages / wall_s * 3600, 1) if wall_s else 0.0,
+                "llm_calls_per_minute": round(llm_calls / wall_s * 60, 1) if wall_s else 0.0,
+            },
+            "pages": pages,
+            "rows": sum(record.get("rows", 0) for record in self.records),
+            "llm": {"calls": llm_calls, "by_model": models},
+            "cost_usd": cost_usd,
+            "cost_per_document_usd": round(cost_usd / len(processed), 5) if cost_usd is not None and processed else None,
+            "unpriced_models": sorted(usage["model"] or "" for usage in models if usage["cost_usd"] is None),
+            "stage_mean_s": {
+                name: round(total / len(processed), 3) for name, total in sorted(stages.items())
+            } if processed else {},
+            "document_mean_s": round(
+                sum(record["duration_s"] for record in processed) / len(processed), 3
+            ) if processed else None,
+        }
+
+
+async def run(args) -> Dict[str, Any]:
+    items = read_manifest(args.manifest) if args.manifest else find_pdfs(args.input)
+    if args.limit:
+        items = items[:args.limit]
+
+    loop = asyncio.get_running_loop()
+    # Cada documento ocupa un hilo para la llamada de variantes y hasta `variant_concurrency` para las extracciones
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=args.concurrency * (args.variant_concurrency + 1) + 4, thread_name_prefix="bulk-ingest"
+    ))
+
+    pipeline = PDFPipeline(variant_concurrency=args.variant_concurrency)
+    sink = make_sink(args.output, args.write_mode)
+    state = IngestState(args.state or os.path.join(
+        sink.root if isinstance(sink, LocalParquetSink) else ".", "bulk_ingest_state.jsonl"
+    ))
+    try:
+        ingest = BulkIngest(
+            pipeline, sink, state,
+            concurrency=args.concurrency,
+            retry_failed=args.retry_failed,
+            progress_interval_s=args.progress_interval
+        )
+        report = await ingest.run(items)
+    finally:
+        state.close()
+        pipeline.close()
+    report["output"] = sink.describe()
+    report["state"] = os.path.abspath(state.path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta masiva de PDFs con el pipeline del worker, sin AMQP")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directorio con PDFs (se recorre recursivamente)")
+    source.add_argument("--manifest", help="Archivo con una ruta o un objeto JSON por línea")
+    parser.add_argument("--output", default="local:bulk_results", help="minio o local:<directorio>")
+    parser.add_argument(
+        "--write-mode", choices=["files", "dataset", "both"], default=PARQUET_WRITE_MODE,
+        help="Parquets por tarea, dataset particionado o ambos"
+    )
+    parser.add_argument("--state", default="", help="Archivo de estado (por defecto, en el directorio de salida)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Documentos procesados a la vez")
+    parser.add_argument(
+        "--variant-concurrency", type=int, default=LLM_VARIANT_CONCURRENCY,
+        help="Extracciones por variante simultáneas en cada documento"
+    )
+    parser.add_argument("--limit", type=int, default=0, help="Procesar solo los primeros N documentos")
+    parser.add_argument("--retry-failed", action="store_true", help="Reintentar también los fallos permanentes")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Segundos entre líneas de progreso")
+    parser.add_argument("--report", default="", help="Guardar también el informe final en este archivo")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+    report = asyncio.run(run(args))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
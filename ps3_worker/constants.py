@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from config import dotenv_path
 
@@ -11,11 +12,151 @@ AMQP_USERNAME = os.getenv("AMQP_USERNAME", "guest")
 AMQP_PASSWORD = os.getenv("AMQP_PASSWORD", "guest")
 AMQP_VIRTUAL_HOST = os.getenv("AMQP_VIRTUAL_HOST", "/")
 AMQP_QUEUE_PDF_PROCESSING = os.getenv("AMQP_QUEUE_PDF_PROCESSING", "pdf_processing")
+AMQP_QUEUE_PDF_PROCESSING_DLQ = os.getenv("AMQP_QUEUE_PDF_PROCESSING_DLQ", f"{AMQP_QUEUE_PDF_PROCESSING}.dead")
+AMQP_RETRY_QUEUE_PREFIX = os.getenv("AMQP_RETRY_QUEUE_PREFIX", f"{AMQP_QUEUE_PDF_PROCESSING}.retry")
+AMQP_MAX_RETRIES = int(os.getenv("AMQP_MAX_RETRIES", "5"))
+AMQP_RETRY_BASE_DELAY_MS = int(os.getenv("AMQP_RETRY_BASE_DELAY_MS", "10000"))
+# Esperas máximas (con el mayor retardo) a que otro worker termine el mismo PDF antes de ir a la dead-letter
+AMQP_MAX_WAITS = int(os.getenv("AMQP_MAX_WAITS", "24"))
+
+# Transporte de eventos de progreso hacia el proceso de la API: "none", "memory" o "amqp"
+SSE_TRANSPORT = os.getenv("SSE_TRANSPORT", "none")
+SSE_EVENTS_EXCHANGE = os.getenv("SSE_EVENTS_EXCHANGE", "ps3.task_events")
+SSE_PUBLISH_INTERVAL = float(os.getenv("SSE_PUBLISH_INTERVAL", "0.5"))
+SSE_HISTORY_MAXLEN = int(os.getenv("SSE_HISTORY_MAXLEN", "100"))
+SSE_HISTORY_TTL = float(os.getenv("SSE_HISTORY_TTL", "600"))
+SSE_IDLE_TTL = float(os.getenv("SSE_IDLE_TTL", "3600"))
+SSE_QUEUE_MAXSIZE = int(os.getenv("SSE_QUEUE_MAXSIZE", "64"))
+
+# Trazas por tarea: "json" (logs estructurados), "otel" (OpenTelemetry) o "none"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "json")
+
+# Métricas en formato Prometheus (puerto 0 desactiva el endpoint)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Directorio compartido para agregar las métricas de varios procesos del worker
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5.0"))
+
+# Proveedor de modelos de lenguaje del pipeline (gemini, ollama, openai, claude, fake o router)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gpt-5")
+# Extraer las variantes en streaming y empezar cada variante en cuanto llega (opcional hasta validarlo)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() == "true"
+# Extracciones por variante simultáneas dentro de una misma tarea
+LLM_VARIANT_CONCURRENCY = int(os.getenv("LLM_VARIANT_CONCURRENCY", "4"))
+# Máximo de variantes por documento; por encima se cancela la extracción
+MAX_VARIANTS_PER_DOCUMENT = int(os.getenv("MAX_VARIANTS_PER_DOCUMENT", "20"))
+
+# Router entre proveedores (LLM_PROVIDER=router): "proveedor:modelo:peso" separados por comas
+LLM_ROUTES = os.getenv("LLM_ROUTES", "openai:gpt-5:3,claude:claude-sonnet-4-5:1,gemini:gemini-2.5-pro:1")
+# Petición de respaldo a otro proveedor si el primario tarda más que este cuantil de su latencia
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "1.0"))
+# Espera antes del respaldo mientras no hay muestras suficientes de latencia
+LLM_HEDGE_DEFAULT_DELAY_S = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_S", "30.0"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_LATENCY_MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", "20"))
+# Fallos consecutivos tras los que un proveedor deja de recibir tráfico durante LLM_PROVIDER_COOLDOWN_S
+LLM_PROVIDER_MAX_FAILURES = int(os.getenv("LLM_PROVIDER_MAX_FAILURES", "3"))
+LLM_PROVIDER_COOLDOWN_S = float(os.getenv("LLM_PROVIDER_COOLDOWN_S", "30.0"))
+
+# Cascada: modelo barato ("proveedor:modelo", vacío la desactiva) que responde primero; solo las
+# respuestas que no pasan los validadores se repiten con el modelo principal
+LLM_CASCADE_MODEL = os.getenv("LLM_CASCADE_MODEL", "")
+LLM_CASCADE_SCHEMAS = os.getenv("LLM_CASCADE_SCHEMAS", "FunctionalVariants,ResearchData")
+# Fracción máxima de campos vacíos y de campos "not specified" para aceptar la respuesta barata
+LLM_CASCADE_MAX_MISSING = float(os.getenv("LLM_CASCADE_MAX_MISSING", "0.3"))
+LLM_CASCADE_MAX_NOT_SPECIFIED = float(os.getenv("LLM_CASCADE_MAX_NOT_SPECIFIED", "0.4"))
+# Fracción de respuestas aceptadas que se repiten con el modelo principal para medir el acuerdo
+LLM_CASCADE_AUDIT_RATE = float(os.getenv("LLM_CASCADE_AUDIT_RATE", "0.0"))
+
+# Grabación de tráfico real: "off", "record", "replay" o "replay_or_record"
+LLM_RECORD_MODE = os.getenv("LLM_RECORD_MODE", "off")
+LLM_ARCHIVE_PATH = os.getenv("LLM_ARCHIVE_PATH", "llm_archive.jsonl.gz")
+
+# Backend local con Ollama (LLM_PROVIDER=ollama)
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Tiempo que el modelo sigue cargado tras la última petición ("30m", "1h", "-1" = siempre)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Peticiones simultáneas al servidor: debe coincidir con OLLAMA_NUM_PARALLEL del servidor
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+# Contexto e hilos de CPU por petición (0 = valor del servidor)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "16384"))
+OLLAMA_NUM_THREAD = int(os.getenv("OLLAMA_NUM_THREAD", "0"))
+OLLAMA_REQUEST_TIMEOUT_S = float(os.getenv("OLLAMA_REQUEST_TIMEOUT_S", "600"))
+# Cargar el modelo al arrancar el worker
+OLLAMA_PREWARM = os.getenv("OLLAMA_PREWARM", "true").lower() == "true"
+
+# Proveedor simulado (LLM_PROVIDER=fake) para pruebas y benchmarks
+FAKE_LLM_FIXTURES_DIR = os.getenv("FAKE_LLM_FIXTURES_DIR", "")
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "0"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_ERROR_STATUS = int(os.getenv("FAKE_LLM_ERROR_STATUS", "429"))
+FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED", "0"))
+
+# Codificación de las páginas: "fixed" (150 dpi, 1600 px) o "adaptive" (según el contenido de cada página),
+# opcional hasta que el A/B de image_budget_benchmark confirme que la precisión no cambia
+IMAGE_ENCODER = os.getenv("IMAGE_ENCODER", "fixed")
+# Presupuesto por documento del codificador adaptativo (0 = sin límite)
+IMAGE_PIXEL_BUDGET = int(os.getenv("IMAGE_PIXEL_BUDGET", "24000000"))
+IMAGE_TOKEN_BUDGET = int(os.getenv("IMAGE_TOKEN_BUDGET", "0"))
+# Las páginas codificadas se pasan al LLM en memoria; si se indica, se escriben además en
+# <directorio>/<hash del PDF>/ para depuración
+PAGE_IMAGES_DEBUG_DIR = os.getenv("PAGE_IMAGES_DEBUG_DIR", "")
+
+# Filtro de páginas antes de codificarlas, desactivado por defecto: los campos keep_pages / drop_pages del
+# mensaje se aplican igualmente. Reglas activas: blank y duplicate; references y acknowledgements son opcionales
+PAGE_FILTER_ENABLED = os.getenv("PAGE_FILTER_ENABLED", "false").lower() == "true"
+PAGE_FILTER_RULES = os.getenv("PAGE_FILTER_RULES", "blank,duplicate")
+# Bits distintos (de 256) entre las huellas dHash de dos páginas casi iguales
+PAGE_FILTER_MAX_DISTANCE = int(os.getenv("PAGE_FILTER_MAX_DISTANCE", "10"))
+
+# Extracción por variante con el texto y los recortes de tablas y figuras: "off" (páginas completas) o "regions"
+LAYOUT_MODE = os.getenv("LAYOUT_MODE", "off")
+LAYOUT_MAX_TILES = int(os.getenv("LAYOUT_MAX_TILES", "6"))
+LAYOUT_MAX_TEXT_CHARS = int(os.getenv("LAYOUT_MAX_TEXT_CHARS", "60000"))
+
+# Tabla de alias de genes (símbolo<TAB>alias,alias) para agrupar las variantes repetidas de un documento
+GENE_ALIASES_PATH = os.getenv(
+    "GENE_ALIASES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gene_aliases.tsv")
+)
+
+# Precios de lista por modelo (USD por millón de tokens) para estimar el coste de las ingestas masivas
+LLM_PRICES_PATH = os.getenv(
+    "LLM_PRICES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "llm_prices.json")
+)
+
+# Caché en disco local de los artefactos de cada PDF (páginas, texto, regiones, embeddings) por su sha256
+ARTIFACT_CACHE_ENABLED = os.getenv("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ps3_artifacts"))
+# Tamaño máximo antes de desalojar los documentos menos usados (0 = sin límite)
+ARTIFACT_CACHE_MAX_MB = int(os.getenv("ARTIFACT_CACHE_MAX_MB", "2048"))
+ARTIFACT_CACHE_EVICT_INTERVAL_S = float(os.getenv("ARTIFACT_CACHE_EVICT_INTERVAL_S", "60"))
+
+# Modelo de embeddings (EmbeddingStore)
+EMBEDDINGS_MODEL_NAME = os.getenv("EMBEDDINGS_MODEL_NAME", "NeuML/bioclinical-modernbert-base-embeddings")
+# Pesos safetensors mapeados en memoria y compartidos entre procesos a través de la caché de páginas
+EMBEDDINGS_MMAP = os.getenv("EMBEDDINGS_MMAP", "true").lower() == "true"
+# Cargar el modelo y hacer una pasada de prueba en segundo plano al arrancar el worker
+EMBEDDINGS_WARMUP = os.getenv("EMBEDDINGS_WARMUP", "false").lower() == "true"
 
 # Configuración de MongoDB
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "ps3_webapp")
 MONGO_COLLECTION_TASKS = os.getenv("MONGO_COLLECTION_TASKS", "tasks")
+MONGO_COLLECTION_PDF_INDEX = os.getenv("MONGO_COLLECTION_PDF_INDEX", "pdf_index")
+# Intervalo (segundos) entre escrituras en bloque del estado de las tareas
+TASK_STATE_FLUSH_INTERVAL = float(os.getenv("TASK_STATE_FLUSH_INTERVAL", "2.0"))
+
+# Deduplicación de tareas por hash del PDF
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_MODE = os.getenv("DEDUP_MODE", "link")  # "link" reutiliza los parquets, "copy" los copia en MinIO
+DEDUP_LEASE_SECONDS = int(os.getenv("DEDUP_LEASE_SECONDS", "1800"))
+# Cada cuánto renueva el lease el worker que procesa el PDF
+DEDUP_LEASE_RENEW_SECONDS = float(os.getenv("DEDUP_LEASE_RENEW_SECONDS", "300"))
 
 # Configuración de MinIO
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
@@ -24,6 +165,14 @@ MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
 MINIO_BUCKET_PDFS = os.getenv("MINIO_BUCKET_PDFS", "pdfs")
 MINIO_BUCKET_PARQUETS = os.getenv("MINIO_BUCKET_PARQUETS", "parquets")
+# Tamaño de parte para subidas multipart (mínimo 5 MiB según S3)
+MINIO_MULTIPART_PART_SIZE = int(os.getenv("MINIO_MULTIPART_PART_SIZE", str(16 * 1024 * 1024)))
+
+# Escritura de resultados: "files" (dos parquets por tarea), "dataset" (dataset particionado) o "both"
+PARQUET_WRITE_MODE = os.getenv("PARQUET_WRITE_MODE", "files")
+PARQUET_DATASET_PREFIX = os.getenv("PARQUET_DATASET_PREFIX", "dataset/research")
+PARQUET_DATASET_COMPACT_MIN_FILES = int(os.getenv("PARQUET_DATASET_COMPACT_MIN_FILES", "16"))
+PARQUET_DATASET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_DATASET_ROW_GROUP_SIZE", "65536"))
 
 # Configuración de la API
 API_KEY = os.getenv("API_KEY", "")
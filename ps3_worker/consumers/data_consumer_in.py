@@ -1,18 +1,35 @@
 import os
+import asyncio
+import contextlib
 import tempfile
 import json
 import logging
-from typing import Any, Dict
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import pandas as pd
+import pika
 
 from ps3_shared.lib.amqp import AMQPManager
 from ps3_worker.constants import (
     AMQP_HOST, AMQP_PORT, AMQP_USERNAME, AMQP_PASSWORD, 
-    AMQP_VIRTUAL_HOST, AMQP_QUEUE_PDF_PROCESSING
+    AMQP_VIRTUAL_HOST, AMQP_QUEUE_PDF_PROCESSING,
+    AMQP_QUEUE_PDF_PROCESSING_DLQ, AMQP_RETRY_QUEUE_PREFIX,
+    AMQP_MAX_RETRIES, AMQP_MAX_WAITS, AMQP_RETRY_BASE_DELAY_MS, DEDUP_ENABLED, EMBEDDINGS_WARMUP, OLLAMA_PREWARM,
+    PARQUET_WRITE_MODE
+)
+from ps3_worker.errors import PermanentTaskError, TaskError, TransientTaskError, classify_failure
+from ps3_worker.services.dedup_service import DedupService, compute_content_hash
+from ps3_worker.services.metrics import (
+    CACHE_REQUESTS, QUEUE_WAIT, TASKS_IN_FLIGHT, TASKS_TOTAL, start_metrics_server
 )
 from ps3_worker.services.minio_service import MinioService
 from ps3_worker.services.mongo_service import MongoService
 from ps3_worker.services.pdf_pipeline import PDFPipeline
+from ps3_worker.services.research_dataset import ResearchDatasetWriter
+from ps3_worker.services.task_state_writer import task_state_writer
+from ps3_worker.services.tracing import TaskTrace, tracer
+from ps3_worker.services.vllm_client import prewarm_local_models
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -21,9 +38,207 @@ logger = logging.getLogger(__name__)
 # Nombre de la cola a consumir
 QUEUE_NAME: str = AMQP_QUEUE_PDF_PROCESSING
 
-async def process_message(body: bytes) -> None:
+# Cabeceras AMQP usadas para el seguimiento de reintentos y fallos
+ATTEMPT_HEADER = "x-attempt"
+# Esperas que no consumen intentos (PDF duplicado en curso en otro worker)
+WAIT_HEADER = "x-wait-count"
+FAILURE_REASON_HEADER = "x-failure-reason"
+FAILURE_MESSAGE_HEADER = "x-failure-message"
+FAILURE_CLASS_HEADER = "x-failure-class"
+FAILED_AT_HEADER = "x-failed-at"
+
+
+def retry_queue_name(attempt: int) -> str:
+    """Nombre de la cola de espera usada tras el intento `attempt`"""
+    return f"{AMQP_RETRY_QUEUE_PREFIX}.{attempt}"
+
+
+def retry_delay_ms(attempt: int) -> int:
+    """Retardo exponencial antes de volver a la cola principal"""
+    return AMQP_RETRY_BASE_DELAY_MS * 2 ** (attempt - 1)
+
+
+def should_retry(failure: TaskError, attempt: int, waits: int = 0) -> bool:
+    """Indica si un fallo debe reencolarse en lugar de ir a la dead-letter"""
+    if not failure.transient:
+        return False
+    if not failure.counts_as_attempt:
+        return waits < AMQP_MAX_WAITS
+    return attempt <= AMQP_MAX_RETRIES
+
+
+def declare_topology(channel) -> None:
+    """
+    Declara las colas de reintento y dead-letter.
+
+    Cada reintento tiene su propia cola con TTL fijo (exponencial según el intento)
+    que reenvía los mensajes caducados a la cola principal. Así no hay bloqueo
+    de cabeza de cola entre mensajes con retardos distintos.
+    """
+    channel.queue_declare(queue=AMQP_QUEUE_PDF_PROCESSING_DLQ, durable=True)
+    for attempt in range(1, AMQP_MAX_RETRIES + 1):
+        channel.queue_declare(
+            queue=retry_queue_name(attempt),
+            durable=True,
+            arguments={
+                "x-message-ttl": retry_delay_ms(attempt),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": QUEUE_NAME,
+            }
+        )
+
+
+def get_attempt(properties) -> int:
+    """Obtiene el número de intento de las cabeceras del mensaje"""
+    headers = getattr(properties, "headers", None) or {}
+    try:
+        return max(1, int(headers.get(ATTEMPT_HEADER, 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def get_wait_count(properties) -> int:
+    """Obtiene el número de esperas sin consumir intentos de las cabeceras del mensaje"""
+    headers = getattr(properties, "headers", None) or {}
+    try:
+        return max(0, int(headers.get(WAIT_HEADER, 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def observe_queue_wait(properties, attempt: int) -> None:
+    """Registra el tiempo en cola si el productor fijó la propiedad `timestamp`"""
+    published_at = getattr(properties, "timestamp", None)
+    if published_at:
+        QUEUE_WAIT.observe(max(time.time() - published_at, 0.0), retry=str(attempt > 1).lower())
+
+
+def _republish(ch, queue: str, body: bytes, properties, headers: Dict[str, Any]) -> None:
+    """Publica de nuevo el mensaje conservando sus propiedades y cabeceras"""
+    merged_headers = dict(getattr(properties, "headers", None) or {})
+    merged_headers.update(headers)
+    ch.basic_publish(
+        exchange="",
+        routing_key=queue,
+        body=body,
+        properties=pika.BasicProperties(
+            content_type=getattr(properties, "content_type", None) or "application/json",
+            delivery_mode=2,
+            timestamp=int(time.time()),
+            headers=merged_headers
+        )
+    )
+
+
+def route_failed_message(ch, body: bytes, properties, attempt: int, failure: TaskError, waits: int = 0) -> None:
+    """Envía un mensaje fallido a la cola de reintento o a la dead-letter"""
+    failure_headers = {
+        FAILURE_REASON_HEADER: failure.reason,
+        FAILURE_MESSAGE_HEADER: str(failure)[:1000],
+        FAILURE_CLASS_HEADER: "transient" if failure.transient else "permanent",
+        FAILED_AT_HEADER: datetime.now().isoformat(),
+    }
+
+    if should_retry(failure, attempt, waits):
+        if failure.counts_as_attempt:
+            delay_level, next_attempt, next_waits = attempt, attempt + 1, waits
+        else:
+            # Esperas que no consumen intentos (p. ej. PDF duplicado en curso) usan el mayor retardo
+            delay_level, next_attempt, next_waits = AMQP_MAX_RETRIES, attempt, waits + 1
+        queue = retry_queue_name(delay_level)
+        _republish(
+            ch, queue, body, properties,
+            {**failure_headers, ATTEMPT_HEADER: next_attempt, WAIT_HEADER: next_waits}
+        )
+        logger.warning(
+            f"Fallo transitorio ({failure.reason}) en intento {attempt}, "
+            f"reintento en {retry_delay_ms(delay_level)} ms vía '{queue}'"
+        )
+    else:
+        _republish(
+            ch, AMQP_QUEUE_PDF_PROCESSING_DLQ, body, properties,
+            {**failure_headers, ATTEMPT_HEADER: attempt, WAIT_HEADER: waits}
+        )
+        logger.error(
+            f"Mensaje enviado a dead-letter '{AMQP_QUEUE_PDF_PROCESSING_DLQ}' "
+            f"tras {attempt} intento(s) y {waits} espera(s): {failure.reason}"
+        )
+
+
+def upload_task_parquets(
+    minio_service: MinioService,
+    task_id: str,
+    filename: str,
+    df_odds_path: pd.DataFrame,
+    df_explanations: pd.DataFrame
+) -> List[str]:
+    """
+    Sube los parquets de odds path y explicaciones de una tarea y devuelve sus rutas.
+
+    Si falla la subida de algún DataFrame con datos lanza TransientTaskError: un
+    resultado parcial no debe registrarse como la respuesta canónica del PDF.
+    """
+    parquet_paths = []
+    failed = []
+
+    if not df_odds_path.empty:
+        # Subir DataFrame de odds path
+        odds_path_filename = f"odds_path_{filename.replace('.pdf', '.parquet')}"
+        odds_path_minio_path = minio_service.upload_parquet(
+            task_id, odds_path_filename, df_odds_path, "odds_path"
+        )
+        if odds_path_minio_path:
+            parquet_paths.append(odds_path_minio_path)
+            logger.info(f"Archivo odds path subido: {odds_path_minio_path}")
+        else:
+            failed.append(odds_path_filename)
+
+    if not df_explanations.empty:
+        # Subir DataFrame de explicaciones
+        explanations_filename = f"explanations_{filename.replace('.pdf', '.parquet')}"
+        explanations_minio_path = minio_service.upload_parquet(
+            task_id, explanations_filename, df_explanations, "explanations"
+        )
+        if explanations_minio_path:
+            parquet_paths.append(explanations_minio_path)
+            logger.info(f"Archivo explicaciones subido: {explanations_minio_path}")
+        else:
+            failed.append(explanations_filename)
+
+    if failed:
+        raise TransientTaskError(
+            f"No se pudieron subir a MinIO los parquets de la tarea {task_id}: {', '.join(failed)}",
+            reason="minio_upload"
+        )
+    return parquet_paths
+
+
+def result_fields(parquet_paths: List[str], dataset_ref: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Campos del resultado en el estado de la tarea: parquets por tarea y referencia al dataset"""
+    fields: Dict[str, Any] = {"parquet_paths": parquet_paths}
+    if parquet_paths:
+        fields["parquet_path"] = parquet_paths[0]
+    if dataset_ref:
+        fields["dataset_ref"] = dataset_ref
+    return fields
+
+
+def create_services() -> Tuple[MinioService, MongoService, PDFPipeline]:
+    """Servicios que usa cada tarea (los benchmarks inyectan versiones en memoria)"""
+    return MinioService(), MongoService(), PDFPipeline()
+
+
+async def process_message(
+    body: bytes,
+    attempt: int = 1,
+    services_factory: Callable[[], Tuple[MinioService, MongoService, PDFPipeline]] = create_services,
+    waits: int = 0
+) -> None:
     """
-    Procesa un mensaje de la cola AMQP que contiene información de una tarea PDF
+    Procesa un mensaje de la cola AMQP que contiene información de una tarea PDF.
+
+    Los fallos se propagan como TaskError para que el callback decida si el
+    mensaje se reintenta o va a la cola de dead-letter.
     """
     try:
         # Parsear el mensaje
@@ -31,117 +246,185 @@ async def process_message(body: bytes) -> None:
         task_id: str = data["task_id"]
         filename: str = data["filename"]
         minio_path: str = data["minio_path"]
-        
-        logger.info(f"Iniciando procesamiento de tarea: {task_id}, archivo: {filename}")
-        
-        # Inicializar servicios
-        minio_service = MinioService()
-        mongo_service = MongoService()
-        pdf_pipeline = PDFPipeline()
-        
-        try:
-            # Actualizar estado de la tarea a "processing"
-            mongo_service.update_task_status(task_id, "processing")
-            
-            # Crear directorio temporal para el PDF
-            with tempfile.TemporaryDirectory() as temp_dir:
-                pdf_temp_path = os.path.join(temp_dir, filename)
-                
-                # Descargar PDF de MinIO
-                logger.info(f"Descargando PDF de MinIO: {minio_path}")
-                pdf_downloaded = minio_service.download_pdf(task_id, filename, pdf_temp_path)
-                
-                if not pdf_downloaded:
-                    raise Exception(f"No se pudo descargar el PDF de MinIO: {minio_path}")
-                
-                # Crear directorio temporal para las imágenes
-                images_temp_dir = os.path.join(temp_dir, "images")
-                os.makedirs(images_temp_dir, exist_ok=True)
-                
-                # Procesar PDF con el pipeline
-                logger.info(f"Procesando PDF con pipeline: {pdf_temp_path}")
-                df_odds_path, df_explanations = await pdf_pipeline.extract_data_from_pdf(
-                    pdf_temp_path, images_temp_dir, task_id
-                )
-                
-                # Verificar que se obtuvieron datos
-                if df_odds_path.empty and df_explanations.empty:
-                    raise Exception("No se pudieron extraer datos del PDF")
-                
-                # Subir archivos parquet a MinIO
-                parquet_paths = []
-                
-                if not df_odds_path.empty:
-                    # Subir DataFrame de odds path
-                    odds_path_filename = f"odds_path_{filename.replace('.pdf', '.parquet')}"
-                    odds_path_minio_path = minio_service.upload_parquet(
-                        task_id, odds_path_filename, df_odds_path, "odds_path"
+        force: bool = bool(data.get("force", False))
+        # Páginas que el filtro debe conservar o descartar (numeradas desde 1)
+        page_overrides: Dict[str, List[int]] = {
+            key: [int(page) for page in data.get(key) or []] for key in ("keep_pages", "drop_pages")
+        }
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        raise PermanentTaskError(f"Mensaje mal formado: {e}", reason="invalid_message")
+
+    logger.info(f"Iniciando procesamiento de tarea: {task_id}, archivo: {filename} (intento {attempt})")
+
+    TASKS_IN_FLIGHT.inc()
+    try:
+        with tracer.task(task_id, attempt=attempt) as trace:
+            await _process_task(
+                trace, task_id, filename, minio_path, force, attempt, services_factory, page_overrides, waits
+            )
+    finally:
+        TASKS_IN_FLIGHT.dec()
+
+
+async def _process_task(
+    trace: TaskTrace,
+    task_id: str,
+    filename: str,
+    minio_path: str,
+    force: bool,
+    attempt: int,
+    services_factory: Callable[[], Tuple[MinioService, MongoService, PDFPipeline]],
+    page_overrides: Optional[Dict[str, List[int]]] = None,
+    waits: int = 0
+) -> None:
+    """Ejecuta una tarea ya parseada dentro de su traza"""
+    # Inicializar servicios
+    minio_service, mongo_service, pdf_pipeline = services_factory()
+    dedup_service = DedupService(mongo_service, minio_service)
+    content_hash = None
+    lease_acquired = False
+
+    try:
+        # Actualizar estado de la tarea a "processing"
+        task_state_writer.set_status(task_id, "processing", attempt=attempt)
+
+        # Crear directorio temporal de trabajo; `lease_stack` renueva el lease del PDF mientras se procesa
+        with tempfile.TemporaryDirectory() as temp_dir, contextlib.ExitStack() as lease_stack:
+            # Descargar PDF de MinIO directamente a memoria
+            logger.info(f"Descargando PDF de MinIO: {minio_path}")
+            with tracer.span("download", filename=filename) as span:
+                pdf_bytes = minio_service.download_pdf_bytes(task_id, filename)
+                if span is not None:
+                    span.set_attribute("bytes", len(pdf_bytes))
+
+            # Deduplicar por hash del contenido: reutilizar resultados o esperar al worker que lo procesa
+            content_hash = compute_content_hash(pdf_bytes)
+
+            if DEDUP_ENABLED and not force:
+                with tracer.span("dedup"):
+                    existing = dedup_service.find_completed(content_hash)
+                CACHE_REQUESTS.inc(cache="dedup", result="hit" if existing else "miss")
+                if existing:
+                    parquet_paths = dedup_service.reuse(task_id, existing)
+                    task_state_writer.set_status(
+                        task_id,
+                        "completed",
+                        **result_fields(parquet_paths, existing.get("dataset_ref")),
+                        content_hash=content_hash,
+                        duplicate_of=existing.get("task_id"),
+                        trace_summary=trace.summary()
                     )
-                    if odds_path_minio_path:
-                        parquet_paths.append(odds_path_minio_path)
-                        logger.info(f"Archivo odds path subido: {odds_path_minio_path}")
-                
-                if not df_explanations.empty:
-                    # Subir DataFrame de explicaciones
-                    explanations_filename = f"explanations_{filename.replace('.pdf', '.parquet')}"
-                    explanations_minio_path = minio_service.upload_parquet(
-                        task_id, explanations_filename, df_explanations, "explanations"
+                    logger.info(
+                        f"Tarea {task_id} resuelta como duplicado de {existing.get('task_id')}: {parquet_paths}"
                     )
-                    if explanations_minio_path:
-                        parquet_paths.append(explanations_minio_path)
-                        logger.info(f"Archivo explicaciones subido: {explanations_minio_path}")
-                
-                # Actualizar tarea en MongoDB
-                if parquet_paths:
-                    # Actualizar rutas de archivos parquet
-                    mongo_service.update_task_paths(
-                        task_id, 
-                        parquet_path=parquet_paths[0] if parquet_paths else None
+                    TASKS_TOTAL.inc(status="duplicate")
+                    return
+
+                with tracer.span("dedup.claim"):
+                    dedup_service.claim(content_hash, task_id)
+                lease_acquired = True
+                lease_stack.enter_context(dedup_service.lease_heartbeat(content_hash, task_id))
+
+            # Crear directorio temporal para las imágenes
+            images_temp_dir = os.path.join(temp_dir, "images")
+            os.makedirs(images_temp_dir, exist_ok=True)
+
+            # Procesar PDF con el pipeline
+            logger.info(f"Procesando PDF con pipeline: {filename}")
+            df_odds_path, df_explanations = await pdf_pipeline.extract_data_from_pdf(
+                pdf_bytes, images_temp_dir, task_id, filename=filename, **(page_overrides or {})
+            )
+
+            # Verificar que se obtuvieron datos
+            if df_odds_path.empty and df_explanations.empty:
+                raise PermanentTaskError("No se pudieron extraer datos del PDF", reason="no_data")
+
+            parquet_paths: List[str] = []
+            dataset_ref: Optional[Dict[str, Any]] = None
+
+            # Subir archivos parquet por tarea a MinIO
+            if PARQUET_WRITE_MODE in ("files", "both"):
+                with tracer.span("upload"):
+                    parquet_paths = upload_task_parquets(
+                        minio_service, task_id, filename, df_odds_path, df_explanations
                     )
-                    
-                    # Marcar tarea como completada
-                    mongo_service.update_task_status(
+
+            # Añadir resultados al dataset particionado; se guarda una referencia
+            # (raíz + filtro por task_id) porque la compactación reescribe los archivos
+            if PARQUET_WRITE_MODE in ("dataset", "both"):
+                with tracer.span("dataset_write"):
+                    dataset_ref = ResearchDatasetWriter().write_task_results(
+                        df_odds_path, df_explanations, task_id, content_hash
+                    )
+
+            # Actualizar tarea en MongoDB
+            if parquet_paths or dataset_ref:
+                # Marcar tarea como completada con las rutas de los parquets (un único $set)
+                with tracer.span("mongo"):
+                    task_state_writer.set_status(
                         task_id, 
                         "completed",
-                        parquet_paths=parquet_paths
+                        **result_fields(parquet_paths, dataset_ref),
+                        content_hash=content_hash,
+                        trace_summary=trace.summary()
                     )
-                    
-                    logger.info(f"Tarea {task_id} completada exitosamente. Archivos parquet: {parquet_paths}")
-                else:
-                    raise Exception("No se pudieron subir los archivos parquet a MinIO")
-                
-        except Exception as e:
-            logger.error(f"Error procesando tarea {task_id}: {e}")
-            
-            # Marcar tarea como fallida
-            mongo_service.update_task_status(
-                task_id, 
-                "failed",
-                error_message=str(e)
-            )
-            
-            raise
-            
-        finally:
-            # Cerrar servicios
-            minio_service.close()
-            mongo_service.close()
-            pdf_pipeline.close()
-            
+
+                    if lease_acquired:
+                        dedup_service.complete(content_hash, task_id, parquet_paths, dataset_ref)
+
+                logger.info(
+                    f"Tarea {task_id} completada exitosamente. Archivos parquet: {parquet_paths}, "
+                    f"dataset: {dataset_ref}"
+                )
+                TASKS_TOTAL.inc(status="completed")
+            else:
+                raise TransientTaskError(
+                    "No se pudieron subir los archivos parquet a MinIO", reason="minio_upload"
+                )
+
     except Exception as e:
-        logger.error(f"Error inesperado en process_message: {e}")
+        failure = classify_failure(e)
+        retrying = should_retry(failure, attempt, waits)
+        logger.error(f"Error procesando tarea {task_id} ({failure.reason}): {e}")
+
+        if lease_acquired:
+            dedup_service.release(content_hash, task_id, failure)
+
+        # Marcar tarea como fallida o pendiente de reintento
+        task_state_writer.set_status(
+            task_id, 
+            "retrying" if retrying else "failed",
+            error_message=str(e),
+            failure_reason=failure.reason,
+            attempt=attempt,
+            trace_summary=trace.summary()
+        )
+        TASKS_TOTAL.inc(status="retrying" if retrying else "failed")
+
+        raise failure from e
+
+    finally:
+        # Cerrar servicios
+        minio_service.close()
+        mongo_service.close()
+        pdf_pipeline.close()
 
 
 def amqp_callback(ch, method, properties, body: bytes) -> None:
     """
-    Callback para procesar mensajes AMQP
+    Callback para procesar mensajes AMQP.
+
+    Los fallos transitorios se reenvían a una cola de espera con TTL exponencial
+    y los permanentes (o los que agotan los reintentos) a la dead-letter.
     """
+    attempt = get_attempt(properties)
+    waits = get_wait_count(properties)
+    observe_queue_wait(properties, attempt)
     try:
-        logger.info(f"Mensaje recibido en {QUEUE_NAME}")
+        logger.info(f"Mensaje recibido en {QUEUE_NAME} (intento {attempt})")
         
         # Procesar el mensaje de forma asíncrona
-        import asyncio
-        asyncio.run(process_message(body))
+        asyncio.run(process_message(body, attempt, waits=waits))
         
         # Confirmar procesamiento exitoso
         ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -149,10 +432,16 @@ def amqp_callback(ch, method, properties, body: bytes) -> None:
         
     except Exception as e:
         logger.error(f"Error en callback AMQP: {e}")
-        
-        # Rechazar el mensaje en caso de error
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        logger.error(f"Mensaje rechazado: {method.delivery_tag}")
+        failure = classify_failure(e)
+
+        try:
+            route_failed_message(ch, body, properties, attempt, failure, waits)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        except Exception as publish_error:
+            # Si no se puede reenviar, devolver el mensaje a la cola para no perderlo
+            logger.error(f"Error reenviando mensaje {method.delivery_tag}: {publish_error}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            logger.error(f"Mensaje devuelto a la cola: {method.delivery_tag}")
 
 
 def data_consumer() -> None:
@@ -169,9 +458,21 @@ def data_consumer() -> None:
             virtual_host=AMQP_VIRTUAL_HOST
         )
         
-        # Conectar y declarar cola
+        # Conectar y declarar colas
         amqp.connect()
         amqp.declare_queue(QUEUE_NAME)
+        declare_topology(amqp.channel)
+
+        # Endpoint de métricas (o solo instantáneas si otro proceso ya sirve el puerto)
+        start_metrics_server()
+
+        # Modelos locales cargados antes de la primera tarea
+        if OLLAMA_PREWARM:
+            prewarm_local_models()
+        if EMBEDDINGS_WARMUP:
+            # torch solo se importa si se pide el precalentamiento
+            from ps3_worker.services.embeddings_store import warmup_in_background
+            warmup_in_background()
         
         logger.info(f"Esperando mensajes en la cola '{QUEUE_NAME}'. Para salir presiona CTRL+C.")
         
@@ -183,6 +484,7 @@ def data_consumer() -> None:
     except Exception as e:
         logger.error(f"Error en consumer: {e}")
     finally:
+        task_state_writer.close()
         try:
             amqp.close()
             logger.info("Conexión AMQP cerrada")
@@ -0,0 +1,126 @@
+import json
+from typing import Optional
+
+
+class TaskError(Exception):
+    """Error base del procesamiento de una tarea"""
+
+    transient: bool = False
+    # Si es False, el reintento no consume uno de los intentos disponibles
+    counts_as_attempt: bool = True
+
+    def __init__(self, message: str, reason: Optional[str] = None):
+        super().__init__(message)
+        self.reason = reason or self.__class__.__name__
+
+
+class TransientTaskError(TaskError):
+    """Fallo temporal (proveedor caído, timeout de MinIO...): la tarea puede reintentarse"""
+
+    transient = True
+
+
+class DuplicateInProgressError(TransientTaskError):
+    """Otro worker tiene el lease del mismo PDF: se espera a que termine sin gastar intentos"""
+
+    counts_as_attempt = False
+
+    def __init__(self, message: str, reason: Optional[str] = "duplicate_in_progress"):
+        super().__init__(message, reason=reason)
+
+
+class PermanentTaskError(TaskError):
+    """Fallo definitivo (PDF corrupto, número de variantes inválido...): reintentar no sirve"""
+
+    transient = False
+
+
+# Códigos HTTP que indican un fallo temporal del proveedor
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Nombres de excepciones de los SDKs (openai, anthropic, google, minio, pymongo)
+# que indican un fallo temporal. Se comparan por nombre para no importar los SDKs.
+TRANSIENT_EXCEPTION_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServerError",
+    "MaxRetryError",
+    "ProtocolError",
+    "ReadTimeoutError",
+    "AutoReconnect",
+    "NetworkTimeout",
+    "ServerSelectionTimeoutError",
+    "ConnectionFailure",
+}
+
+# Excepciones que indican un PDF inválido o un mensaje mal formado
+PERMANENT_EXCEPTION_NAMES = {
+    "FileDataError",
+    "EmptyFileError",
+    "ValidationError",
+}
+
+# Códigos de error de S3/MinIO que indican que el objeto no existe: reintentar no sirve.
+# El resto de errores de S3 (5xx, SlowDown...) y los de red siguen siendo transitorios.
+PERMANENT_S3_ERROR_CODES = {
+    "NoSuchKey",
+    "NoSuchBucket",
+}
+
+
+def error_status_code(error: BaseException) -> Optional[int]:
+    """Código HTTP de la excepción de un SDK (`status_code` o `code`), si lo tiene"""
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def classify_failure(error: BaseException) -> TaskError:
+    """
+    Clasifica una excepción como transitoria o permanente.
+
+    Devuelve siempre un TaskError: si la excepción ya lo es se devuelve tal cual,
+    si no se envuelve conservando el mensaje original como motivo.
+    """
+    if isinstance(error, TaskError):
+        return error
+
+    names = {cls.__name__ for cls in type(error).__mro__}
+    message = f"{type(error).__name__}: {error}"
+
+    status_code = error_status_code(error)
+    if status_code in TRANSIENT_STATUS_CODES:
+        return TransientTaskError(message, reason=f"http_{status_code}")
+
+    # El resto de 4xx (petición mal formada, autenticación...) se repetiría igual
+    if status_code is not None and 400 <= status_code < 500:
+        return PermanentTaskError(message, reason=f"http_{status_code}")
+
+    # Excepciones que se marcan a sí mismas como no reintentables (p. ej. ReplayMissError)
+    if getattr(error, "retryable", True) is False:
+        return PermanentTaskError(message, reason=type(error).__name__)
+
+    s3_code = getattr(error, "code", None)
+    if isinstance(s3_code, str) and s3_code in PERMANENT_S3_ERROR_CODES:
+        return PermanentTaskError(message, reason=s3_code)
+
+    if names & PERMANENT_EXCEPTION_NAMES:
+        return PermanentTaskError(message, reason=type(error).__name__)
+
+    if names & TRANSIENT_EXCEPTION_NAMES:
+        return TransientTaskError(message, reason=type(error).__name__)
+
+    if isinstance(error, (json.JSONDecodeError, KeyError, ValueError, TypeError)):
+        return PermanentTaskError(message, reason=type(error).__name__)
+
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return TransientTaskError(message, reason=type(error).__name__)
+
+    # Por defecto se considera transitorio: el número de reintentos está acotado
+    # y el mensaje acaba en la cola de dead-letter si sigue fallando.
+    return TransientTaskError(message, reason=type(error).__name__)
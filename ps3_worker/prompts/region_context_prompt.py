@@ -0,0 +1,11 @@
+region_context_prompt = """
+
+### Article content provided:
+Instead of the full page images you receive the full text of the article (below) and image crops of the tables and figures that are most relevant for this variant. The images are given in this order:
+{regions}
+
+Use the tables and figures for the control counts (pathogenic, benign and functionally abnormal variants) and the text for everything else.
+
+### Article text:
+{text}
+"""
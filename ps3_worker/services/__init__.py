@@ -1,12 +1,20 @@
+from .dedup_service import DedupService
 from .minio_service import MinioService
 from .mongo_service import MongoService
 from .pdf_pipeline import PDFPipeline
 from .sse_service import SSEService, sse_service
+from .task_state_writer import TaskStateWriter, task_state_writer
+from .tracing import Tracer, tracer
 
 __all__ = [
+    "DedupService",
     "MinioService",
     "MongoService",
     "PDFPipeline",
     "SSEService",
-    "sse_service"
+    "sse_service",
+    "TaskStateWriter",
+    "task_state_writer",
+    "Tracer",
+    "tracer"
 ] 
\ No newline at end of file
@@ -0,0 +1,344 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from ps3_worker.constants import (
+    ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_MB, ARTIFACT_CACHE_EVICT_INTERVAL_S
+)
+from ps3_worker.services.metrics import ARTIFACT_CACHE_EVICTED, CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Archivo cuya fecha de modificación marca el último uso de un documento (orden LRU)
+ACCESS_FILE = ".access"
+LOCK_FILE = ".lock"
+TMP_PREFIX = ".tmp-"
+# Temporales de escrituras interrumpidas (worker caído) que se borran al desalojar
+STALE_TMP_S = 3600
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def artifact_key(kind: str, **params: Any) -> str:
+    """Clave de un artefacto que depende de parámetros ("pages-adaptive-3f2a...")"""
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return f"{kind}-{digest}"
+
+
+def _remove(path: str):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _link_or_copy(source: str, target: str):
+    """Hard link (sin copiar datos) o copia si la caché está en otro sistema de archivos"""
+    _remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _tree_size(path: str) -> int:
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(directory, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+class ArtifactCache:
+    """
+    Caché en disco local de los artefactos derivados de un PDF (imágenes de las
+    páginas, texto por página, regiones de tablas y figuras, embeddings),
+    compartida por las tareas y reintentos de todos los workers de la máquina.
+
+    Cada documento ocupa `root/<hash[:2]>/<sha256 del PDF>/`, con un archivo
+    o directorio por artefacto. Las escrituras se hacen en un temporal dentro
+    de `root` y se publican con `os.replace`/`os.rename`, así que un lector
+    nunca ve un artefacto a medias y, si dos workers generan el mismo, se
+    conserva el primero. Los directorios se entregan como hard links en el
+    directorio de trabajo de la tarea, de modo que desalojar un documento no
+    afecta a las tareas que lo están usando.
+
+    Cuando el tamaño total supera `max_bytes` se borran los documentos usados
+    hace más tiempo (como mucho una vez cada `evict_interval_s` por proceso y
+    con un lock de archivo para que no desalojen dos workers a la vez).
+    """
+
+    def __init__(
+        self,
+        root: str = ARTIFACT_CACHE_DIR,
+        max_bytes: int = ARTIFACT_CACHE_MAX_MB * 1024 * 1024,
+        evict_interval_s: float = ARTIFACT_CACHE_EVICT_INTERVAL_S
+    ):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.evict_interval_s = evict_interval_s
+        self._last_eviction = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_dir(self, content_hash: str) -> str:
+        if not CONTENT_HASH_PATTERN.match(content_hash or ""):
+            raise ValueError(f"Hash de contenido no válido para la caché de artefactos: {content_hash!r}")
+        return os.path.join(self.root, content_hash[:2], content_hash)
+
+    def _path(self, content_hash: str, key: str) -> str:
+        return os.path.join(self.entry_dir(content_hash), key)
+
+    def _tmp_path(self) -> str:
+        return os.path.join(self.root, f"{TMP_PREFIX}{os.getpid()}-{uuid.uuid4().hex}")
+
+    def _touch(self, content_hash: str):
+        path = os.path.join(self.entry_dir(content_hash), ACCESS_FILE)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            try:
+                with open(path, "a"):
+                    pass
+            except OSError:
+                pass
+
+    @staticmethod
+    def _record(result: str):
+        CACHE_REQUESTS.inc(cache="artifacts", result=result)
+
+    def get_bytes(self, content_hash: str, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(content_hash, key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._record("miss")
+            return None
+        self._touch(content_hash)
+        self._record("hit")
+        return data
+
+    def put_bytes(self, content_hash: str, key: str, data: bytes):
+        path = self._path(content_hash, key)
+        tmp_path = self._tmp_path()
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el artefacto {key} de {content_hash[:12]}: {e}")
+            _remove(tmp_path)
+            return
+        self._touch(content_hash)
+        self._maybe_evict()
+
+    def get_json(self, content_hash: str, key: str) -> Optional[Any]:
+        data = self.get_bytes(content_hash, key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            logger.warning(f"Artefacto {key} de {content_hash[:12]} inválido: {e}")
+            return None
+
+    def put_json(self, content_hash: str, key: str, value: Any):
+        self.put_bytes(content_hash, key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def fetch_dir(self, content_hash: str, key: str, dest_dir: str) -> bool:
+        """Enlaza en `dest_dir` los archivos de un artefacto de tipo directorio; False si no está en la caché"""
+        source = self._path(content_hash, key)
+        try:
+            names = os.listdir(source)
+        except FileNotFoundError:
+            self._record("miss")
+            return False
+
+        os.makedirs(dest_dir, exist_ok=True)
+        linked: List[str] = []
+        try:
+            for name in names:
+                target = os.path.join(dest_dir, name)
+                _link_or_copy(os.path.join(source, name), target)
+                linked.append(target)
+        except OSError as e:
+            # Otro worker lo desalojó mientras se enlazaba: se trata como un fallo de caché
+            logger.warning(f"Artefacto {key} de {content_hash[:12]} desalojado durante la lectura: {e}")
+            for target in linked:
+                _remove(target)
+            self._record("miss")
+            return False
+
+        self._touch(content_hash)
+        self._record("hit")
+        return True
+
+    def store_dir(self, content_hash: str, key: str, source_dir: str, names: Optional[List[str]] = None):
+        """Copia los archivos de `source_dir` (o solo `names`) como artefacto de tipo directorio"""
+        final_path = self._path(content_hash, key)
+        if os.path.isdir(final_path):
+            self._touch(content_hash)
+            return
+
+        tmp_path = self._tmp_path()
+        try:
+            os.makedirs(tmp_path)
+            for name in names if names is not None else os.listdir(source_dir):
+                path = os.path.join(source_dir, name)
+                if os.path.isfile(path):
+                    shutil.copyfile(path, os.path.join(tmp_path, name))
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.rename(tmp_path, final_path)
+        except OSError as e:
+            _remove(tmp_path)
+            # Si otro worker publicó el mismo artefacto primero, el rename falla y se conserva el suyo
+            if not os.path.isdir(final_path):
+                logger.warning(f"No se pudo guardar el artefacto {key} de {content_hash[:12]}: {e}")
+            return
+        self._touch(content_hash)
+        self._maybe_evict()
+
+    def get_files(self, content_hash: str, key: str) -> Optional[Dict[str, bytes]]:
+        """Contenido de los archivos de un artefacto de tipo directorio; None si no está en la caché"""
+        source = self._path(content_hash, key)
+        files: Dict[str, bytes] = {}
+        try:
+            for name in os.listdir(source):
+                with open(os.path.join(source, name), "rb") as f:
+                    files[name] = f.read()
+        except FileNotFoundError:
+            # Ausente o desalojado por otro worker mientras se leía
+            self._record("miss")
+            return None
+        self._touch(content_hash)
+        self._record("hit")
+        return files
+
+    def put_files(self, content_hash: str, key: str, files: Dict[str, bytes]):
+        """Guarda `files` (nombre -> contenido) como artefacto de tipo directorio"""
+        final_path = self._path(content_hash, key)
+        if os.path.isdir(final_path):
+            self._touch(content_hash)
+            return
+
+        tmp_path = self._tmp_path()
+        try:
+            os.makedirs(tmp_path)
+            for name, data in files.items():
+                with open(os.path.join(tmp_path, name), "wb") as f:
+                    f.write(data)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.rename(tmp_path, final_path)
+        except OSError as e:
+            _remove(tmp_path)
+            if not os.path.isdir(final_path):
+                logger.warning(f"No se pudo guardar el artefacto {key} de {content_hash[:12]}: {e}")
+            return
+        self._touch(content_hash)
+        self._maybe_evict()
+
+    def materialize(self, content_hash: str, key: str, dest_dir: str, build: Callable[[str], bool]) -> bool:
+        """
+        Deja el artefacto en `dest_dir`: desde la caché si está o generándolo
+        con `build(dest_dir)`, que se guarda si devuelve True. Devuelve si fue
+        un acierto de caché. `dest_dir` solo debe contener el artefacto.
+        """
+        if self.fetch_dir(content_hash, key, dest_dir):
+            return True
+        if build(dest_dir):
+            self.store_dir(content_hash, key, dest_dir)
+        return False
+
+    def _maybe_evict(self):
+        if not self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_eviction < self.evict_interval_s:
+                return
+            self._last_eviction = now
+        try:
+            self.evict()
+        except OSError as e:
+            logger.warning(f"Error al desalojar la caché de artefactos {self.root}: {e}")
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith("."):
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir():
+                    continue
+                try:
+                    last_access = os.stat(os.path.join(entry.path, ACCESS_FILE)).st_mtime
+                except FileNotFoundError:
+                    last_access = entry.stat().st_mtime
+                entries.append({"path": entry.path, "bytes": _tree_size(entry.path), "last_access": last_access})
+        return entries
+
+    def evict(self) -> int:
+        """Borra los documentos menos usados hasta quedar por debajo de `max_bytes`; devuelve los bytes liberados"""
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Otro worker está desalojando
+                return 0
+            try:
+                for entry in os.scandir(self.root):
+                    if entry.name.startswith(TMP_PREFIX) and time.time() - entry.stat().st_mtime > STALE_TMP_S:
+                        _remove(entry.path)
+
+                entries = self._entries()
+                total = sum(entry["bytes"] for entry in entries)
+                freed = evicted = 0
+                for entry in sorted(entries, key=lambda entry: entry["last_access"]):
+                    if total - freed <= self.max_bytes:
+                        break
+                    # Renombrar primero: el documento desaparece de golpe para los demás workers
+                    trash_path = self._tmp_path()
+                    try:
+                        os.rename(entry["path"], trash_path)
+                    except OSError:
+                        continue
+                    _remove(trash_path)
+                    freed += entry["bytes"]
+                    evicted += 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        if evicted:
+            ARTIFACT_CACHE_EVICTED.inc(evicted)
+            logger.info(
+                f"Caché de artefactos: {evicted} documentos desalojados, {freed / 1e6:.1f} MB liberados "
+                f"({(total - freed) / 1e6:.1f}/{self.max_bytes / 1e6:.0f} MB)"
+            )
+        return freed
+
+
+_artifact_cache: Optional[ArtifactCache] = None
+_artifact_cache_lock = threading.Lock()
+
+
+def get_artifact_cache() -> ArtifactCache:
+    """Caché de artefactos del proceso, creada en el primer uso"""
+    global _artifact_cache
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache()
+        return _artifact_cache
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from ps3_worker.constants import DEDUP_LEASE_RENEW_SECONDS, DEDUP_LEASE_SECONDS, DEDUP_MODE
+from ps3_worker.errors import DuplicateInProgressError, PermanentTaskError, TaskError
+from ps3_worker.services.minio_service import MinioService
+from ps3_worker.services.mongo_service import MongoService
+
+logger = logging.getLogger(__name__)
+
+
+def compute_content_hash(data: bytes) -> str:
+    """Hash SHA-256 del contenido completo de un PDF"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class DedupService:
+    """Servicio para evitar reprocesar PDFs ya procesados o en proceso por otro worker"""
+
+    def __init__(self, mongo_service: MongoService, minio_service: MinioService,
+                 mode: str = DEDUP_MODE, lease_seconds: int = DEDUP_LEASE_SECONDS,
+                 renew_seconds: float = DEDUP_LEASE_RENEW_SECONDS):
+        self.mongo_service = mongo_service
+        self.minio_service = minio_service
+        self.mode = mode
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = renew_seconds
+
+    def find_completed(self, content_hash: str) -> Optional[dict]:
+        """
+        Devuelve la entrada del índice si el PDF ya se procesó con éxito.
+
+        Si otra tarea falló con el mismo PDF de forma permanente (sin datos, número
+        de variantes inválido...) lanza el mismo PermanentTaskError en lugar de
+        repetir el pipeline completo para llegar al mismo fallo.
+        """
+        entry = self.mongo_service.get_pdf_index_entry(content_hash)
+        if entry and entry.get("status") == "failed" and entry.get("permanent"):
+            raise PermanentTaskError(
+                f"El PDF {content_hash[:12]} ya falló de forma permanente en la tarea "
+                f"{entry.get('failed_task_id')}: {entry.get('failure_message')}",
+                reason=entry.get("failure_reason")
+            )
+        if entry and entry.get("status") == "completed" and (entry.get("parquet_paths") or entry.get("dataset_ref")):
+            return entry
+        return None
+
+    def claim(self, content_hash: str, task_id: str) -> None:
+        """
+        Adquiere el lease del PDF para esta tarea.
+
+        Si otro worker lo tiene, lanza DuplicateInProgressError para que el mensaje
+        espere en la cola de reintento y, al volver, reutilice el resultado.
+        """
+        if not self.mongo_service.acquire_pdf_lease(content_hash, task_id, self.lease_seconds):
+            raise DuplicateInProgressError(
+                f"El PDF {content_hash[:12]} ya está siendo procesado por otra tarea"
+            )
+        logger.info(f"Lease del PDF {content_hash[:12]} adquirido por la tarea {task_id}")
+
+    def renew(self, content_hash: str, task_id: str) -> bool:
+        """Prolonga el lease; False si la tarea ya no lo tiene"""
+        return self.mongo_service.renew_pdf_lease(content_hash, task_id, self.lease_seconds)
+
+    @contextmanager
+    def lease_heartbeat(self, content_hash: str, task_id: str) -> Iterator[None]:
+        """
+        Renueva el lease cada `renew_seconds` mientras dura el bloque, para que un
+        PDF que tarda más que el lease no lo adquiera otro worker a mitad de proceso.
+
+        Se renueva desde un hilo y no desde el bucle de eventos, que el pipeline
+        puede tener ocupado con trabajo síncrono (rasterizado, filtro de páginas).
+        """
+        stop = threading.Event()
+
+        def renew_periodically():
+            while not stop.wait(self.renew_seconds):
+                try:
+                    if not self.renew(content_hash, task_id):
+                        logger.warning(f"La tarea {task_id} ya no tiene el lease del PDF {content_hash[:12]}")
+                        return
+                except Exception as e:
+                    logger.error(f"Error al renovar el lease del PDF {content_hash[:12]}: {e}")
+
+        thread = threading.Thread(target=renew_periodically, name=f"lease-{content_hash[:12]}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join(timeout=5)
+
+    def reuse(self, task_id: str, entry: dict) -> List[str]:
+        """
+        Enlaza o copia los parquets de una tarea anterior con el mismo PDF.
+
+        La referencia al dataset (`dataset_ref`) no se copia: filtra por la tarea
+        original y sigue siendo válida aunque se compacte la partición.
+        """
+        source_paths: List[str] = entry.get("parquet_paths") or []
+        if self.mode != "copy":
+            return list(source_paths)
+
+        copied_paths = []
+        for source_path in source_paths:
+            copied_path = self.minio_service.copy_parquet(source_path, task_id)
+            # Si la copia falla se enlaza el original para no perder el resultado
+            copied_paths.append(copied_path or source_path)
+        return copied_paths
+
+    def complete(
+        self,
+        content_hash: str,
+        task_id: str,
+        parquet_paths: List[str],
+        dataset_ref: Optional[dict] = None
+    ) -> None:
+        """Registra el resultado del PDF en el índice"""
+        self.mongo_service.complete_pdf_index_entry(content_hash, task_id, parquet_paths, dataset_ref)
+
+    def release(self, content_hash: str, task_id: str, failure: Optional[TaskError] = None) -> None:
+        """Libera el lease tras un fallo; los permanentes quedan registrados para los duplicados"""
+        if failure is not None and not failure.transient:
+            self.mongo_service.release_pdf_lease(content_hash, task_id, failure.reason, str(failure)[:1000])
+        else:
+            self.mongo_service.release_pdf_lease(content_hash, task_id)
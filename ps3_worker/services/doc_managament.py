@@ -1,46 +1,66 @@
 import base64
+import hashlib
 import io
+import json
 import os
 import shutil
+import tempfile
 
 import fitz
 from PIL import Image
-from pdf2image import convert_from_path
-from langchain_community.embeddings import HuggingFaceEmbeddings
 
+from ps3_worker.services.page_encoder import PageEncoder
+from ps3_worker.services.page_filter import PageFilter, skipped_pages
+from ps3_worker.services.page_image import PageImage
 
-class DocManagament:
-    def __init__(self, pdf_base64, temp_filename=None):
-        # Generar hash único para el PDF
-        self.pdf_hash = self._generate_hash(pdf_base64)
 
-        if not os.path.exists("data"):
-            os.makedirs("data")
+# Texto de cada página en la caché de artefactos
+PAGE_TEXT_ARTIFACT = "text.json"
+# Número de páginas, informe de la codificación y metadatos de las imágenes guardadas
+PAGES_MANIFEST = "manifest.json"
+
 
-        self.data_dir = os.path.join("data", self.pdf_hash)
-        os.makedirs(self.data_dir, exist_ok=True)
-        if temp_filename is None:
-            temp_filename = f"{self.pdf_hash}.pdf"
+class DocManagament:
+    def __init__(self, pdf_source, temp_filename=None, artifact_cache=None):
+        # El PDF puede llegar en memoria (bytes/memoryview), como ruta a un archivo o en base64
         try:
-            self.pdf_path = self._save_base64_to_pdf(
-                pdf_base64, os.path.join(self.data_dir, temp_filename)
-            )
+            self.pdf_bytes = self._load_pdf_bytes(pdf_source)
         except Exception as e:
-            raise ValueError(f"Error al decodificar y guardar el PDF: {e}")
+            raise ValueError(f"Error al decodificar el PDF: {e}")
+
+        # Generar hash único para el PDF
+        self.pdf_hash = self._generate_hash(self.pdf_bytes)
+        # Artefactos reutilizables entre tareas (texto por página); None para no usar caché
+        self.artifact_cache = artifact_cache
+
+        # Directorio de trabajo fuera del directorio actual; solo se crea si se escribe algo en él
+        self.data_dir = os.path.join(tempfile.gettempdir(), "ps3_worker", self.pdf_hash)
+
+        # Solo se escribe el PDF en disco si se pide un nombre de archivo;
+        # PyMuPDF trabaja directamente sobre los bytes en memoria
+        if isinstance(pdf_source, str) and os.path.isfile(pdf_source):
+            self.pdf_path = os.path.abspath(pdf_source)
+        elif temp_filename is not None:
+            self.pdf_path = self._save_pdf(os.path.join(self.data_dir, temp_filename))
+        else:
+            self.pdf_path = None
 
-        # pyrefly: ignore  # missing-attribute, bad-argument-type
-        self.path = self.pdf_path.replace(".pdf", "")
+        self.path = os.path.join(self.data_dir, self.pdf_hash)
         self.document = None
         self.raw_text = None
+        self.page_texts = None
         self.n_pages = None
+        self.encoding_report = None
+        # Páginas codificadas en memoria (PageImage) que se envían al LLM
+        self.page_images = []
+        self.page_decisions = None
 
-        print(f"Objeto DocManagament creado para el archivo: {self.pdf_path}")
+        print(f"Objeto DocManagament creado para el archivo: {self.pdf_path or f'<memoria:{self.pdf_hash[:12]}>'}")
         print("Intentando extraer texto crudo del PDF...")
 
         try:
-            self.convert_pdf_to_grayscale(self.pdf_path, f"{self.path}_normalized.pdf")
             # pyrefly: ignore  # bad-assignment
-            self.raw_text = self.extract_text(self.pdf_path)
+            self.raw_text = self.extract_text()
 
             if self.raw_text:
                 print("Texto crudo extraído exitosamente.")
@@ -50,33 +70,55 @@ class DocManagament:
             print(f"Error al extraer texto crudo del PDF: {e}")
             print("Las operaciones de chunking no estarán disponibles.")
 
-    def _generate_hash(self, pdf_base64):
-        return (
-            base64.urlsafe_b64encode(
-                (
-                    base64.b64encode(pdf_base64.encode("utf-8"))
-                    if isinstance(pdf_base64, str)
-                    else pdf_base64
-                )[:16]
-            )
-            .decode("utf-8")
-            .replace("=", "")
-        )
+    def _load_pdf_bytes(self, pdf_source):
+        if isinstance(pdf_source, bytes):
+            return pdf_source
+        if isinstance(pdf_source, (bytearray, memoryview)):
+            return bytes(pdf_source)
+        if isinstance(pdf_source, str) and os.path.isfile(pdf_source):
+            with open(pdf_source, "rb") as f:
+                return f.read()
+        return base64.b64decode(pdf_source)
+
+    def _generate_hash(self, pdf_bytes):
+        return hashlib.sha256(pdf_bytes).hexdigest()
 
-    def _save_base64_to_pdf(self, pdf_base64, filename):
-        decoded_data = base64.b64decode(pdf_base64)
+    def _save_pdf(self, filename):
         path = os.path.abspath(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, "wb") as f:
-            f.write(decoded_data)
+            f.write(self.pdf_bytes)
         return path
 
-    def extract_text(self, input_pdf):
-        doc = fitz.open(input_pdf)
-        final_text = ""
-        for page in doc:
-            final_text += "\n" + page.get_text()
-        doc.close()
-        return final_text
+    def open_document(self):
+        """Abre el PDF con PyMuPDF directamente desde memoria"""
+        return fitz.open(stream=self.pdf_bytes, filetype="pdf")
+
+    def extract_text(self, input_pdf=None):
+        if input_pdf:
+            doc = fitz.open(input_pdf)
+            final_text = "".join("\n" + page.get_text() for page in doc)
+            doc.close()
+            return final_text
+
+        self.page_texts = self.extract_page_texts()
+        return "".join("\n" + text for text in self.page_texts)
+
+    def extract_page_texts(self):
+        """Texto de cada página, desde la caché de artefactos si ya se extrajo en otra tarea"""
+        if self.artifact_cache is not None:
+            cached = self.artifact_cache.get_json(self.pdf_hash, PAGE_TEXT_ARTIFACT)
+            if isinstance(cached, list):
+                return cached
+
+        doc = self.open_document()
+        try:
+            page_texts = [page.get_text() for page in doc]
+        finally:
+            doc.close()
+        if self.artifact_cache is not None:
+            self.artifact_cache.put_json(self.pdf_hash, PAGE_TEXT_ARTIFACT, page_texts)
+        return page_texts
 
     def convert_pdf_to_grayscale(self, input_pdf_path, output_pdf_path, dpi=200):
         pdf_document = fitz.open(input_pdf_path)
@@ -103,24 +145,22 @@ class DocManagament:
         pdf_document.close()
         print(f"PDF convertido a escala de grises y guardado en: {output_pdf_path}")
 
-    def to_jpgs(self, output_dir=None, dpi=150, max_width=1600, max_height=None, quality=75, grayscale=False):
+    def to_jpgs(self, output_dir=None, dpi=150, max_width=1600, max_height=None, quality=75, grayscale=False,
+                skip_pages=None):
+        """
+        Codifica las páginas a JPG en memoria (`self.page_images`); con
+        `output_dir` se escriben además en disco.
+        """
         try:
-            if output_dir is None:
-                output_dir = self.data_dir
-            os.makedirs(output_dir, exist_ok=True)
-            print(f"Convirtiendo '{self.pdf_path}' a JPGs en '{output_dir}' (dpi={dpi}, quality={quality})...")
-
-            images = convert_from_path(
-                self.pdf_path,
-                poppler_path=r"C:\\Program Files\\Poppler\\Library\\bin",
-                dpi=dpi,
-            )
-            for i, image in enumerate(images):
-                jpg_path = os.path.join(output_dir, f"page_{i+1}.jpg")
-                if grayscale:
-                    image = image.convert("L")
-                else:
-                    image = image.convert("RGB")
+            print(f"Convirtiendo '{self.pdf_path or self.pdf_hash[:12]}' a JPGs (dpi={dpi}, quality={quality})...")
+
+            page_images = []
+            document = self.open_document()
+            for i, page in enumerate(document):
+                if skip_pages and i + 1 in skip_pages:
+                    continue
+                pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if grayscale else fitz.csRGB)
+                image = Image.frombytes("L" if grayscale else "RGB", (pix.width, pix.height), pix.samples)
 
                 orig_w, orig_h = image.size
                 scale_w = max_width / orig_w if max_width else 1.0
@@ -136,7 +176,6 @@ class DocManagament:
                     image = image.resize((new_w, new_h), resampling)
 
                 save_kwargs = {
-                    "format": "JPEG",
                     "quality": int(quality),
                     "optimize": True,
                     "progressive": True,
@@ -146,16 +185,106 @@ class DocManagament:
                 except Exception:
                     pass
 
-                image.save(jpg_path, **save_kwargs)
+                page_images.append(PageImage.from_pil(image, name=f"page_{i+1}.jpg", page=i + 1, **save_kwargs))
 
-            self.n_pages = len(images)  # type: ignore
+            self.n_pages = len(document)  # type: ignore
+            document.close()
+            self.page_images = page_images
+            self.encoding_report = None
+            self._write_page_images(output_dir)
 
-            print(
-                f"Se han guardado {self.n_pages} páginas como archivos JPG en '{output_dir}'."
-            )
+            print(f"Se han codificado {len(page_images)} de {self.n_pages} páginas como JPG.")
+        except Exception as e:
+            print(f"Ocurrió un error durante la conversión a JPGs: {e}")
+
+    def to_adaptive_jpgs(self, output_dir=None, encoder=None, skip_pages=None):
+        """
+        Codifica las páginas a JPG en memoria (`self.page_images`) con
+        resolución, recorte y color adaptados a su contenido; con `output_dir`
+        se escriben además en disco.
+        """
+        try:
+            print(f"Convirtiendo '{self.pdf_path or self.pdf_hash[:12]}' a JPGs adaptativos...")
+
+            document = self.open_document()
+            self.encoding_report = (encoder or PageEncoder()).encode(document, skip_pages=skip_pages)
+            self.n_pages = len(document)  # type: ignore
+            document.close()
+            self.page_images = [page.pop("image") for page in self.encoding_report["pages"] if "image" in page]
+            self._write_page_images(output_dir)
+
+            print(f"Se han codificado {self.encoding_report['images']} de {self.n_pages} páginas como JPG.")
         except Exception as e:
             print(f"Ocurrió un error durante la conversión a JPGs: {e}")
 
+    def _write_page_images(self, output_dir):
+        """Copia en disco de las páginas codificadas (depuración); no se usa para enviarlas al LLM"""
+        if not output_dir:
+            return
+        paths = {image.name: image.save(output_dir) for image in self.page_images}
+        for page in (self.encoding_report or {}).get("pages", []):
+            if page.get("name") in paths:
+                page["path"] = paths[page["name"]]
+        print(f"Se han guardado {len(paths)} páginas como archivos JPG en '{output_dir}'.")
+
+    def load_or_render_pages(self, key, render, output_dir=None):
+        """
+        Deja en `self.page_images` las páginas codificadas por `render()`
+        (`to_jpgs` o `to_adaptive_jpgs` con sus parámetros), reutilizando las de
+        la caché de artefactos si el PDF ya se codificó con la misma `key`. Con
+        `output_dir` se escriben además en disco. Devuelve si las imágenes
+        vinieron de la caché.
+        """
+        if self.artifact_cache is None:
+            render()
+            self._write_page_images(output_dir)
+            return False
+
+        files = self.artifact_cache.get_files(self.pdf_hash, key)
+        manifest = None
+        if files is not None and PAGES_MANIFEST in files:
+            try:
+                manifest = json.loads(files.pop(PAGES_MANIFEST))
+                self.page_images = [
+                    PageImage(files[image["name"]], **image) for image in manifest["images"]
+                ]
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Imágenes en caché de '{self.pdf_hash[:12]}' inválidas, se vuelven a codificar: {e}")
+                manifest = None
+
+        if manifest is not None:
+            self.n_pages = manifest["n_pages"]
+            self.encoding_report = manifest["encoding_report"]
+            print(f"Reutilizadas de la caché las imágenes de {self.n_pages} páginas.")
+            self._write_page_images(output_dir)
+            return True
+
+        render()
+        if self.n_pages:
+            manifest = {
+                "n_pages": self.n_pages,
+                "encoding_report": self.encoding_report,
+                "images": [
+                    {"name": image.name, "mime_type": image.mime_type, "page": image.page,
+                     "width": image.width, "height": image.height}
+                    for image in self.page_images
+                ],
+            }
+            files = {image.name: image.data for image in self.page_images}
+            files[PAGES_MANIFEST] = json.dumps(manifest).encode("utf-8")
+            self.artifact_cache.put_files(self.pdf_hash, key, files)
+        self._write_page_images(output_dir)
+        return False
+
+    def filter_pages(self, page_filter=None, keep_pages=None, drop_pages=None):
+        """Decide qué páginas se descartan antes de codificarlas y devuelve sus números"""
+        document = self.open_document()
+        try:
+            self.page_decisions = (page_filter or PageFilter()).decide(document, keep_pages, drop_pages)
+        finally:
+            document.close()
+        return skipped_pages(self.page_decisions)
+
     def to_chunks(self):
         if not self.raw_text:
             print(
@@ -165,6 +294,10 @@ class DocManagament:
 
         print("Realizando chunking semántico del texto...")
         try:
+            # langchain y torch solo se cargan si se pide el chunking
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            from langchain_experimental.text_splitter import SemanticChunker
+
             model_name = "NeuML/bioclinical-modernbert-base-embeddings"
             encode_kwargs = {"normalize_embeddings": True}
 
@@ -172,7 +305,6 @@ class DocManagament:
                 model_name=model_name, encode_kwargs=encode_kwargs
             )
 
-            # pyrefly: ignore  # unknown-name
             text_splitter = SemanticChunker(hf_embeddings)
             docs_chunks = text_splitter.create_documents([self.raw_text])
 
@@ -1,24 +1,179 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
 import torch
 from qdrant_client import QdrantClient
 # pyrefly: ignore  # import-error
-from transformers import AutoTokenizer, AutoModel
-from typing import List, Optional, Optional
+from transformers import AutoConfig, AutoTokenizer, AutoModel
 from qdrant_client.models import Distance, VectorParams, PointStruct, UpdateStatus
 
+from ps3_worker.constants import ARTIFACT_CACHE_ENABLED, EMBEDDINGS_MODEL_NAME, EMBEDDINGS_MMAP
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
 def mean_pooling(model_output, attention_mask):
     embeddings = model_output[0]
     mask = attention_mask.unsqueeze(-1).expand(embeddings.size()).float()
 
     return torch.sum(embeddings * mask, 1) / torch.clamp(mask.sum(1), min=1e-9)
 
+def resolve_model_dir(model_name: str) -> str:
+    """Directorio local del modelo: el propio `model_name` o su snapshot en la caché de Hugging Face"""
+    if os.path.isdir(model_name):
+        return model_name
+    from huggingface_hub import snapshot_download
+    return snapshot_download(model_name, allow_patterns=["*.json", "*.safetensors", "*.txt", "*.model"])
+
+def read_safetensors_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """Cabecera JSON de un archivo safetensors y posición en la que empiezan los datos"""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+def load_safetensors_mmap(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Tensores de un archivo safetensors como vistas de un mmap privado del
+    archivo (sin copiarlos a memoria del proceso). Las páginas vienen de la
+    caché de páginas del sistema, compartida por todos los procesos del nodo
+    que cargan el mismo archivo mientras nadie escriba en ellas.
+    """
+    header, data_start = read_safetensors_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        if (data_start + begin) % itemsize:
+            raise ValueError(f"Tensor {name} no alineado en {path}")
+        tensor = torch.empty(0, dtype=dtype)
+        tensor.set_(storage, (data_start + begin) // itemsize, tuple(info["shape"]))
+        tensors[name] = tensor
+    return tensors
+
+def _weight_files(model_dir: str) -> List[str]:
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            files = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(model_dir, name) for name in files]
+    path = os.path.join(model_dir, "model.safetensors")
+    return [path] if os.path.exists(path) else []
+
+def load_model_mmap(model_dir: str):
+    """
+    Construye el modelo sin inicializar sus pesos y le asigna (`assign=True`)
+    los tensores mapeados del safetensors. Devuelve None si los pesos no están
+    en safetensors o no encajan con el modelo, para cargarlo de la forma normal.
+    """
+    from transformers.modeling_utils import no_init_weights
+
+    files = _weight_files(model_dir)
+    if not files:
+        return None
+    config = AutoConfig.from_pretrained(model_dir)
+    with no_init_weights():
+        model = AutoModel.from_config(config)
+
+    state: Dict[str, torch.Tensor] = {}
+    for path in files:
+        state.update(load_safetensors_mmap(path))
+    expected = model.state_dict()
+    prefix = f"{model.base_model_prefix}."
+    if not any(key in expected for key in state):
+        state = {key[len(prefix):]: tensor for key, tensor in state.items() if key.startswith(prefix)}
+    state = {key: tensor for key, tensor in state.items() if key in expected}
+
+    parameters = {name for name, _ in model.named_parameters()}
+    missing = parameters - state.keys()
+    if missing:
+        logger.warning(f"Pesos sin cargar por mmap en {model_dir} ({len(missing)}, p. ej. {sorted(missing)[0]})")
+        return None
+    # Solo se copian los tensores cuyo tipo no coincide con el del modelo
+    state = {
+        key: tensor if tensor.dtype == expected[key].dtype else tensor.to(expected[key].dtype)
+        for key, tensor in state.items()
+    }
+    model.load_state_dict(state, strict=False, assign=True)
+    model.tie_weights()
+    return model.eval()
+
+def load_embedding_model(model_name: str = EMBEDDINGS_MODEL_NAME, mmap: bool = EMBEDDINGS_MMAP):
+    """Tokenizer, modelo y dimensión de los vectores (de la configuración, sin pasada de prueba)"""
+    started = time.perf_counter()
+    model_dir = resolve_model_dir(model_name)
+    config = AutoConfig.from_pretrained(model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = load_model_mmap(model_dir) if mmap else None
+    mapped = model is not None
+    if model is None:
+        model = AutoModel.from_pretrained(model_dir).eval()
+    logger.info(
+        f"Modelo de embeddings {model_name} cargado en {time.perf_counter() - started:.1f}s "
+        f"({'pesos mapeados' if mapped else 'pesos copiados'} en memoria)"
+    )
+    return tokenizer, model, config.hidden_size
+
+_models: Dict[Tuple[str, bool], Tuple[Any, Any, int]] = {}
+_models_lock = threading.Lock()
+
+def get_embedding_model(model_name: str = EMBEDDINGS_MODEL_NAME, mmap: bool = EMBEDDINGS_MMAP):
+    """Modelo compartido por todos los EmbeddingStore del proceso, cargado en el primer uso"""
+    with _models_lock:
+        key = (model_name, mmap)
+        if key not in _models:
+            _models[key] = load_embedding_model(model_name, mmap)
+        return _models[key]
+
+def warmup_in_background(model_name: str = EMBEDDINGS_MODEL_NAME, mmap: bool = EMBEDDINGS_MMAP) -> threading.Thread:
+    """
+    Carga el modelo y hace una pasada de prueba en un hilo, fuera del camino
+    de la primera petición (que espera al lock si aún no ha terminado).
+    """
+    def warmup():
+        try:
+            tokenizer, model, _ = get_embedding_model(model_name, mmap)
+            inputs = tokenizer("Warm-up sentence.", return_tensors='pt')
+            with torch.no_grad():
+                model(**inputs)
+        except Exception as e:
+            logger.warning(f"Falló el precalentamiento del modelo de embeddings {model_name}: {e}")
+
+    thread = threading.Thread(target=warmup, name="embeddings-warmup", daemon=True)
+    thread.start()
+    return thread
+
 class EmbeddingStore:
     def __init__(
         self,
-        model_name: str = "NeuML/bioclinical-modernbert-base-embeddings",
+        model_name: str = EMBEDDINGS_MODEL_NAME,
         qdrant_host: Optional[str] = "localhost",
         qdrant_port: Optional[int] = 6333,
         collection_name: str = "document_embeddings",
-        distance_metric: Distance = Distance.COSINE
+        distance_metric: Distance = Distance.COSINE,
+        mmap: bool = EMBEDDINGS_MMAP
     ):
         print(f"Inicializando EmbeddingStore con modelo: {model_name}")
         self.model_name = model_name
@@ -26,26 +181,12 @@ class EmbeddingStore:
         self.distance_metric = distance_metric
 
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModel.from_pretrained(model_name)
-            print("Modelo de embeddings cargado exitosamente.")
+            self.tokenizer, self.model, self.vector_dimension = get_embedding_model(model_name, mmap)
+            print(f"Modelo de embeddings cargado exitosamente. Dimensión del vector: {self.vector_dimension}")
         except Exception as e:
             print(f"Error al cargar el modelo '{model_name}': {e}")
             raise
 
-        try:
-            test_inputs = self.tokenizer("Test sentence for dimension.", return_tensors='pt')
-            with torch.no_grad():
-                test_output = self.model(**test_inputs)
-
-            test_embedding = mean_pooling(test_output, test_inputs['attention_mask'])
-            self.vector_dimension = test_embedding.shape[1]
-
-            print(f"Dimensión del vector determinada: {self.vector_dimension}")
-        except Exception as e:
-             print(f"Error al determinar la dimensión del vector: {e}")
-             raise
-
         print("Conectando a Qdrant...")
         try:
             self.client = QdrantClient(":memory:")
@@ -64,11 +205,27 @@ class EmbeddingStore:
             print(f"Error al crear/recrear la colección '{self.collection_name}': {e}")
             raise
 
-    def generate_embeddings(self, sentences: List[str]) -> torch.Tensor:
+    def generate_embeddings(self, sentences: List[str], content_hash: Optional[str] = None) -> torch.Tensor:
+        """
+        Embeddings de los fragmentos. Con `content_hash` (sha256 del PDF del que
+        salen) se guardan en la caché de artefactos y se reutilizan en las
+        siguientes tareas del mismo PDF.
+        """
         if not sentences:
             print("Lista de frases/fragmentos vacía. No se generarán embeddings.")
             return torch.empty(0, self.vector_dimension)
 
+        cache, key = None, None
+        if content_hash and ARTIFACT_CACHE_ENABLED:
+            from ps3_worker.services.artifact_cache import artifact_key, get_artifact_cache
+
+            cache = get_artifact_cache()
+            sentences_hash = hashlib.sha256("\x00".join(sentences).encode("utf-8")).hexdigest()
+            key = artifact_key("embeddings", model=self.model_name, sentences=sentences_hash) + ".pt"
+            data = cache.get_bytes(content_hash, key)
+            if data is not None:
+                return torch.load(io.BytesIO(data), weights_only=True)
+
         inputs = self.tokenizer(
             sentences,
             padding=True,
@@ -86,18 +243,28 @@ class EmbeddingStore:
         embeddings = mean_pooling(output, inputs['attention_mask'])
         embeddings = embeddings.cpu()
 
+        if cache is not None:
+            buffer = io.BytesIO()
+            torch.save(embeddings, buffer)
+            cache.put_bytes(content_hash, key, buffer.getvalue())
+
         print(f"Embeddings generados para {len(sentences)} fragmentos.")
         return embeddings
 
 
-    def store_embeddings(self, sentences: List[str], ids: Optional[List[int]] = None) -> UpdateStatus:
+    def store_embeddings(
+        self,
+        sentences: List[str],
+        ids: Optional[List[int]] = None,
+        content_hash: Optional[str] = None
+    ) -> UpdateStatus:
         if not sentences:
             print("Lista de frases/fragmentos vacía. No se almacenarán puntos en Qdrant.")
             return UpdateStatus.COMPLETED
 
         print(f"Generando y almacenando embeddings para {len(sentences)} fragmentos...")
 
-        embeddings_tensor = self.generate_embeddings(sentences)
+        embeddings_tensor = self.generate_embeddings(sentences, content_hash)
 
         points_to_upsert = []
         embeddings_list = embeddings_tensor.tolist()
@@ -0,0 +1,192 @@
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from ps3_worker.constants import (
+    AMQP_HOST, AMQP_PORT, AMQP_USERNAME, AMQP_PASSWORD, AMQP_VIRTUAL_HOST,
+    SSE_EVENTS_EXCHANGE, SSE_PUBLISH_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Eventos tras los que la tarea no emitirá más progreso
+TERMINAL_EVENTS = {"completion", "error"}
+
+
+class EventTransport:
+    """Transporte de eventos de progreso entre el worker y el proceso que sirve SSE"""
+
+    def publish_batch(self, task_id: str, events: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def keep_alive(self) -> None:
+        """Atiende la conexión entre lotes (heartbeats); se llama desde el hilo publicador"""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryEventTransport(EventTransport):
+    """Transporte local, para desarrollo y pruebas sin broker"""
+
+    def __init__(self, max_events: int = 10000):
+        self.published: deque = deque(maxlen=max_events)
+        self.subscribers: List[Callable[[str, List[Dict[str, Any]]], None]] = []
+
+    def subscribe(self, callback: Callable[[str, List[Dict[str, Any]]], None]) -> None:
+        self.subscribers.append(callback)
+
+    def publish_batch(self, task_id: str, events: List[Dict[str, Any]]) -> None:
+        self.published.extend(events)
+        for callback in self.subscribers:
+            callback(task_id, events)
+
+
+class AMQPEventTransport(EventTransport):
+    """
+    Publica los eventos en un exchange `topic` con routing key `task.{task_id}`.
+
+    Cada mensaje lleva todos los eventos acumulados de una tarea; la API se
+    suscribe con `task.{task_id}` para una tarea o `task.#` para todas.
+
+    La BlockingConnection solo responde a los heartbeats del broker cuando se
+    atiende, así que `keep_alive` la procesa entre lotes y, si aun así el broker
+    la cerró, `publish_batch` reconecta y reintenta el lote una vez.
+    """
+
+    def __init__(self, exchange: str = SSE_EVENTS_EXCHANGE):
+        self.exchange = exchange
+        self._connection = None
+        self._channel = None
+
+    def _get_channel(self):
+        import pika
+
+        if self._channel is None or self._channel.is_closed:
+            self._connection = pika.BlockingConnection(pika.ConnectionParameters(
+                host=AMQP_HOST,
+                port=AMQP_PORT,
+                virtual_host=AMQP_VIRTUAL_HOST,
+                credentials=pika.PlainCredentials(AMQP_USERNAME, AMQP_PASSWORD)
+            ))
+            self._channel = self._connection.channel()
+            self._channel.exchange_declare(exchange=self.exchange, exchange_type="topic", durable=True)
+        return self._channel
+
+    def _reset(self) -> None:
+        """Descarta la conexión rota para que `_get_channel` abra otra"""
+        connection, self._connection, self._channel = self._connection, None, None
+        try:
+            if connection is not None and connection.is_open:
+                connection.close()
+        except Exception:
+            pass
+
+    def publish_batch(self, task_id: str, events: List[Dict[str, Any]]) -> None:
+        import pika
+        from pika.exceptions import AMQPChannelError, AMQPConnectionError
+
+        body = json.dumps({"task_id": task_id, "events": events})
+        properties = pika.BasicProperties(content_type="application/json")
+        try:
+            self._get_channel().basic_publish(
+                exchange=self.exchange, routing_key=f"task.{task_id}", body=body, properties=properties
+            )
+        except (AMQPConnectionError, AMQPChannelError) as e:
+            logger.warning(f"Conexión AMQP de eventos perdida ({type(e).__name__}), se reconecta: {e}")
+            self._reset()
+            self._get_channel().basic_publish(
+                exchange=self.exchange, routing_key=f"task.{task_id}", body=body, properties=properties
+            )
+
+    def keep_alive(self) -> None:
+        from pika.exceptions import AMQPChannelError, AMQPConnectionError
+
+        if self._connection is None:
+            return
+        try:
+            self._connection.process_data_events(0)
+        except (AMQPConnectionError, AMQPChannelError) as e:
+            logger.warning(f"Conexión AMQP de eventos cerrada por el broker: {e}")
+            self._reset()
+
+    def close(self) -> None:
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception as e:
+            logger.error(f"Error cerrando transporte AMQP de eventos: {e}")
+
+
+class EventPublisher:
+    """
+    Acumula eventos por tarea y los publica en lotes desde un hilo propio.
+
+    Los eventos de progreso consecutivos de una tarea se fusionan (solo viaja el
+    último) y los eventos terminales fuerzan la publicación inmediata del lote.
+    """
+
+    def __init__(self, transport: EventTransport, flush_interval: float = SSE_PUBLISH_INTERVAL):
+        self.transport = transport
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sse-event-publisher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            try:
+                self.transport.keep_alive()
+            except Exception as e:
+                logger.error(f"Error atendiendo el transporte de eventos: {e}")
+
+    def publish(self, task_id: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            events = self._pending.setdefault(task_id, [])
+            if event["event"] == "progress" and events and events[-1]["event"] == "progress":
+                events[-1] = event
+            else:
+                events.append(event)
+        self._ensure_thread()
+        if event["event"] in TERMINAL_EVENTS:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for task_id, events in pending.items():
+            try:
+                self.transport.publish_batch(task_id, events)
+            except Exception as e:
+                logger.error(f"Error publicando {len(events)} eventos de la tarea {task_id}: {e}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+        self.transport.close()
+
+
+def build_event_publisher(transport_name: str) -> Optional[EventPublisher]:
+    """Crea el publicador configurado en SSE_TRANSPORT (None si no hay transporte)"""
+    if transport_name == "amqp":
+        return EventPublisher(AMQPEventTransport())
+    if transport_name == "memory":
+        return EventPublisher(InMemoryEventTransport())
+    return None
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from ps3_worker.constants import (
+    FAKE_LLM_FIXTURES_DIR, FAKE_LLM_LATENCY_MS, FAKE_LLM_JITTER_MS,
+    FAKE_LLM_ERROR_RATE, FAKE_LLM_ERROR_STATUS, FAKE_LLM_SEED
+)
+from ps3_worker.services.page_image import ImageInput, load_page_images
+from ps3_worker.services.vllm_client import BaseChatClient
+
+logger = logging.getLogger(__name__)
+
+# Tokens aproximados por imagen para estimar el consumo simulado
+FAKE_TOKENS_PER_IMAGE = 258
+# Fracción de la latencia que pasa hasta el primer fragmento en modo streaming
+FAKE_FIRST_CHUNK_FRACTION = 0.2
+FAKE_STREAM_CHUNKS = 32
+
+
+class FakeLLMError(Exception):
+    """Error inyectado por el proveedor simulado, con el código HTTP que devolvería la API"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def synthesize_from_schema(schema: Dict[str, Any], rng: random.Random, array_items: int = 3) -> Any:
+    """Genera un valor válido para un JSON schema de pydantic (objetos, listas, enums y tipos básicos)"""
+    definitions = schema.get("$defs", {})
+
+    def build(node: Dict[str, Any], depth: int = 0) -> Any:
+        if "$ref" in node:
+            return build(definitions[node["$ref"].rsplit("/", 1)[-1]], depth)
+        if "const" in node:
+            return node["const"]
+        if "enum" in node:
+            return rng.choice(node["enum"])
+        if "default" in node and node["default"] is not None and rng.random() < 0.5:
+            return node["default"]
+        for key in ("anyOf", "oneOf", "allOf"):
+            if key in node:
+                options = [option for option in node[key] if option.get("type") != "null"] or node[key]
+                return build(options[0], depth)
+
+        node_type = node.get("type")
+        if isinstance(node_type, list):
+            node_type = next((t for t in node_type if t != "null"), "null")
+
+        if node_type == "object" or "properties" in node:
+            return {name: build(prop, depth + 1) for name, prop in node.get("properties", {}).items()}
+        if node_type == "array":
+            items = node.get("items", {})
+            count = max(node.get("minItems", 0), array_items if depth < 4 else 0)
+            return [build(items, depth + 1) for _ in range(count)]
+        if node_type == "integer":
+            return rng.randint(int(node.get("minimum", 1)), int(node.get("maximum", 100)))
+        if node_type == "number":
+            return round(rng.uniform(float(node.get("minimum", 0.0)), float(node.get("maximum", 1.0))), 4)
+        if node_type == "boolean":
+            return rng.random() < 0.5
+        if node_type == "null":
+            return None
+        return f"synthetic-{rng.randrange(10 ** 6):06d}"
+
+    return build(schema)
+
+
+class FakeChatClient(BaseChatClient):
+    """
+    Proveedor simulado y determinista para pruebas y benchmarks sin coste de API.
+
+    Devuelve respuestas de `{fixtures_dir}/{Schema}.json` (un objeto o una lista
+    de objetos; se elige uno por hash del prompt) o, si no hay fixture, sintetiza
+    un payload válido a partir del JSON schema del modelo. La latencia, el jitter
+    y la tasa de errores son configurables; los errores llevan `status_code`.
+    `latency_fn` sustituye a la latencia uniforme por una distribución propia
+    (recibe el generador aleatorio y devuelve milisegundos).
+    """
+
+    def __init__(
+        self,
+        model_name: str = "fake",
+        fixtures_dir: str = FAKE_LLM_FIXTURES_DIR,
+        latency_ms: float = FAKE_LLM_LATENCY_MS,
+        jitter_ms: float = FAKE_LLM_JITTER_MS,
+        error_rate: float = FAKE_LLM_ERROR_RATE,
+        error_status: int = FAKE_LLM_ERROR_STATUS,
+        seed: int = FAKE_LLM_SEED,
+        array_items: int = 3,
+        read_images: bool = True,
+        latency_fn: Optional[Callable[[random.Random], float]] = None
+    ):
+        self.model_name = model_name
+        self.fixtures_dir = fixtures_dir
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.array_items = array_items
+        self.latency_fn = latency_fn
+        # Leer y codificar las imágenes como los clientes reales, para medir ese coste
+        self.read_images = read_images
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._fixtures: Dict[str, List[Any]] = {}
+        self.calls = 0
+
+    def _load_fixtures(self, schema_name: str) -> List[Any]:
+        if schema_name not in self._fixtures:
+            payloads: List[Any] = []
+            path = os.path.join(self.fixtures_dir, f"{schema_name}.json") if self.fixtures_dir else ""
+            if path and os.path.exists(path):
+                with open(path) as f:
+                    loaded = json.load(f)
+                payloads = loaded if isinstance(loaded, list) else [loaded]
+            self._fixtures[schema_name] = payloads
+        return self._fixtures[schema_name]
+
+    def _encode_images(self, image_paths: Optional[List[ImageInput]]) -> int:
+        if not self.read_images:
+            return 0
+        return sum(len(image.base64) for image in load_page_images(image_paths))
+
+    def _start_call(self, image_paths: Optional[List[str]]) -> Tuple[float, bool]:
+        """Cuenta la llamada y decide su latencia (segundos) y si falla"""
+        with self._lock:
+            self.calls += 1
+            if self.latency_fn is not None:
+                delay_ms = max(self.latency_fn(self._rng), 0.0)
+            else:
+                delay_ms = max(self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms), 0.0)
+            failed = bool(self.error_rate) and self._rng.random() < self.error_rate
+        self._encode_images(image_paths)
+        return delay_ms / 1000, failed
+
+    def _respond(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]],
+        model: Optional[Type[BaseModel]],
+        failed: bool
+    ) -> str:
+        if failed:
+            raise FakeLLMError(f"Error simulado ({self.error_status})", status_code=self.error_status)
+
+        prompt_hash = zlib.crc32(prompt_text.encode("utf-8"))
+        if model is None:
+            response = f"respuesta simulada {prompt_hash:08x}"
+        else:
+            fixtures = self._load_fixtures(model.__name__)
+            if fixtures:
+                payload = fixtures[prompt_hash % len(fixtures)]
+            else:
+                payload = synthesize_from_schema(
+                    model.model_json_schema(), random.Random(prompt_hash), self.array_items
+                )
+            response = json.dumps(payload)
+
+        self._set_usage(
+            len(prompt_text) // 4 + FAKE_TOKENS_PER_IMAGE * len(image_paths or []),
+            len(response) // 4
+        )
+        return response
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        delay_s, failed = self._start_call(image_paths)
+        if delay_s:
+            time.sleep(delay_s)
+        return self._respond(prompt_text, image_paths, model, failed)
+
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        """La misma respuesta en fragmentos, con la latencia repartida entre ellos"""
+        delay_s, failed = self._start_call(image_paths)
+        if delay_s:
+            time.sleep(delay_s * FAKE_FIRST_CHUNK_FRACTION)
+        response = self._respond(prompt_text, image_paths, model, failed)
+
+        chunk_size = max(len(response) // FAKE_STREAM_CHUNKS, 1)
+        chunks = [response[i:i + chunk_size] for i in range(0, len(response), chunk_size)]
+        chunk_delay_s = delay_s * (1 - FAKE_FIRST_CHUNK_FRACTION) / max(len(chunks), 1)
+        for chunk in chunks:
+            if chunk_delay_s:
+                time.sleep(chunk_delay_s)
+            yield chunk
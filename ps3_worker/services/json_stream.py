@@ -0,0 +1,91 @@
+import json
+from typing import Any, List, Optional
+
+
+class IncrementalArrayParser:
+    """
+    Parser incremental de la lista `{"<key>": [ {...}, {...} ]}` de una respuesta JSON.
+
+    `feed` recibe fragmentos de texto tal como llegan del stream y devuelve los
+    elementos de la lista que se han completado desde la llamada anterior. Ignora
+    el texto previo al primer `{` o `[` (p. ej. un bloque ```json). Con
+    `key=None` se extraen los elementos de una lista raíz.
+    """
+
+    def __init__(self, key: Optional[str] = "data"):
+        self.key = key
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._started = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        if self.done or not chunk:
+            return []
+        self._text += chunk
+        items: List[Any] = []
+        text = self._text
+        i = self._pos
+        while i < len(text) and not self.done:
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._array_depth is None:
+                        self._last_string = text[self._string_start + 1:i]
+            elif not self._started:
+                if char in "{[":
+                    self._started = True
+                    continue
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ":" and self._depth == 1:
+                self._current_key = self._last_string
+            elif char in "{[":
+                self._depth += 1
+                if self._array_depth is None and char == "[" and self._is_target_array():
+                    self._array_depth = self._depth
+                elif self._array_depth is not None and self._depth == self._array_depth + 1 and self._item_start is None:
+                    self._item_start = i
+            elif char in "}]":
+                if self._array_depth is not None and self._depth == self._array_depth + 1 and self._item_start is not None:
+                    items.append(json.loads(text[self._item_start:i + 1]))
+                    self._item_start = None
+                self._depth -= 1
+                if self._array_depth is not None and self._depth < self._array_depth:
+                    self.done = True
+                elif self._depth == 0:
+                    self.done = True
+            elif char == "," and self._depth == 1:
+                self._current_key = None
+            i += 1
+
+        # Conservar solo el texto necesario para el elemento en curso
+        keep_from = self._item_start if self._item_start is not None else i
+        if self._in_string and self._item_start is None:
+            keep_from = min(keep_from, self._string_start)
+        self._text = text[keep_from:]
+        self._pos = i - keep_from
+        if self._item_start is not None:
+            self._item_start -= keep_from
+        if self._in_string:
+            self._string_start -= keep_from
+        return items
+
+    def _is_target_array(self) -> bool:
+        if self.key is None:
+            return self._depth == 1
+        return self._depth == 2 and self._current_key == self.key
@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz
+from PIL import Image
+
+from ps3_worker.constants import LAYOUT_MAX_TILES
+from ps3_worker.services.page_encoder import TABLE_MIN_RULES, estimate_tokens_by_provider, has_color, is_rule
+
+logger = logging.getLogger(__name__)
+
+# Cambiar la versión invalida las regiones guardadas en caché
+LAYOUT_VERSION = 1
+LAYOUT_INDEX = "regions.json"
+
+CAPTION_PATTERN = re.compile(r"^\s*(supplementa(?:l|ry)\s+)?(fig(?:ure)?|table)\s*\.?\s*(S?\d+[A-Za-z]?)", re.IGNORECASE)
+# Distancia máxima (puntos) entre un pie y su tabla o figura
+CAPTION_MAX_GAP_PT = 48
+# Separación máxima entre trazos de una misma figura y entre líneas de una tabla sin reglas
+CLUSTER_GAP_PT = 12
+TABLE_LINE_GAP_PT = 14
+# Área mínima de una región sin pie (fracción de la página)
+MIN_REGION_COVERAGE = 0.02
+CROP_DPI = 200
+CROP_MAX_WIDTH = 1600
+CROP_QUALITY = 80
+REGION_TEXT_CHARS = 2000
+
+# Términos de los conteos del odds path
+ODDS_PATH_KEYWORDS = ("control", "pathogenic", "benign", "abnormal", "normal", "functional", "assay", "variants")
+
+
+def _area(rect: fitz.Rect) -> float:
+    return max(rect.width, 0) * max(rect.height, 0)
+
+
+def _text_blocks(page: fitz.Page) -> List[Tuple[fitz.Rect, str]]:
+    blocks = []
+    for block in page.get_text("dict")["blocks"]:
+        if block.get("type") != 0:
+            continue
+        text = " ".join(
+            "".join(span["text"] for span in line["spans"]) for line in block["lines"]
+        ).strip()
+        if text:
+            blocks.append((fitz.Rect(block["bbox"]), text))
+    return blocks
+
+
+def _cluster(rects: List[fitz.Rect], gap: float) -> List[fitz.Rect]:
+    """Une los rectángulos que se solapan o están a menos de `gap` puntos"""
+    clusters: List[fitz.Rect] = []
+    for rect in sorted(rects, key=lambda r: (r.y0, r.x0)):
+        current = fitz.Rect(rect)
+        merged = True
+        while merged:
+            merged = False
+            for other in clusters:
+                if (current + (-gap, -gap, gap, gap)).intersects(other):
+                    current |= other
+                    clusters.remove(other)
+                    merged = True
+                    break
+        clusters.append(current)
+    return clusters
+
+
+def _horizontal_overlap(a: fitz.Rect, b: fitz.Rect) -> float:
+    return max(0.0, min(a.x1, b.x1) - max(a.x0, b.x0))
+
+
+def _vertical_gap(a: fitz.Rect, b: fitz.Rect) -> float:
+    if a.y1 <= b.y0:
+        return b.y0 - a.y1
+    if b.y1 <= a.y0:
+        return a.y0 - b.y1
+    return 0.0
+
+
+def _grow_down(bbox: fitz.Rect, clusters: List[fitz.Rect], text_rects: List[fitz.Rect]) -> Tuple[fitz.Rect, set]:
+    """Extiende `bbox` hacia abajo con los trazos y bloques de texto a menos de TABLE_LINE_GAP_PT"""
+    absorbed = set()
+    grown = True
+    while grown:
+        grown = False
+        for index, rect in enumerate(clusters + text_rects):
+            if index in absorbed or bbox.contains(rect) or rect.y0 < bbox.y0:
+                continue
+            if _horizontal_overlap(rect, bbox) > 0 and rect.y0 - bbox.y1 <= TABLE_LINE_GAP_PT:
+                bbox |= rect
+                absorbed.add(index)
+                grown = True
+    return bbox, {index for index in absorbed if index < len(clusters)}
+
+
+def find_regions(page: fitz.Page) -> List[Dict[str, Any]]:
+    """
+    Regiones de tablas y figuras de una página: agrupaciones de imágenes y
+    trazos vectoriales, emparejadas con su pie ("Figure 2", "Table S1"...). Un
+    pie de tabla sin trazos cercanos (tabla sin reglas) se extiende hacia abajo
+    sobre los bloques de texto contiguos.
+    """
+    page_rect = page.rect
+    page_area = _area(page_rect) or 1.0
+    blocks = _text_blocks(page)
+    drawings = [
+        drawing for drawing in page.get_drawings()
+        if _area(fitz.Rect(drawing["rect"]) & page_rect) < 0.9 * page_area
+    ]
+    graphics = [fitz.Rect(info["bbox"]) & page_rect for info in page.get_image_info()]
+    # Las reglas de las tablas tienen alto (o ancho) 0: se ensanchan para no descartarlas
+    graphics += [(fitz.Rect(drawing["rect"]) + (-1, -1, 1, 1)) & page_rect for drawing in drawings]
+    clusters = _cluster([rect for rect in graphics if not rect.is_empty], CLUSTER_GAP_PT)
+
+    def rules_in(rect: fitz.Rect) -> int:
+        return sum(
+            is_rule(item) for drawing in drawings if fitz.Rect(drawing["rect"]).intersects(rect)
+            for item in drawing["items"]
+        )
+
+    regions = []
+    used = set()
+    for caption_rect, caption in blocks:
+        match = CAPTION_PATTERN.match(caption)
+        if not match:
+            continue
+        kind = "table" if match.group(2).lower() == "table" else "figure"
+        candidates = [
+            (index, cluster) for index, cluster in enumerate(clusters)
+            if index not in used
+            and _horizontal_overlap(cluster, caption_rect) > 0
+            and _vertical_gap(cluster, caption_rect) <= CAPTION_MAX_GAP_PT
+        ]
+        if candidates:
+            index, cluster = min(candidates, key=lambda item: _vertical_gap(item[1], caption_rect))
+            used.add(index)
+            bbox = cluster | caption_rect
+        elif kind == "table":
+            bbox = fitz.Rect(caption_rect)
+        else:
+            continue
+        if kind == "table":
+            # Filas y reglas contiguas por debajo del pie
+            bbox, absorbed = _grow_down(bbox, clusters, [rect for rect, _ in blocks])
+            used.update(absorbed)
+        regions.append({
+            "kind": kind,
+            "label": f"{kind.capitalize()} {match.group(3)}",
+            "caption": caption[:500],
+            "bbox": bbox,
+        })
+
+    for index, cluster in enumerate(clusters):
+        if index in used or _area(cluster) < MIN_REGION_COVERAGE * page_area:
+            continue
+        kind = "table" if rules_in(cluster) >= TABLE_MIN_RULES else "figure"
+        regions.append({"kind": kind, "label": f"{kind.capitalize()} (sin pie)", "caption": "", "bbox": cluster})
+
+    for region in regions:
+        bbox = region["bbox"]
+        region["text"] = " ".join(
+            text for rect, text in blocks if bbox.contains(rect) and text != region["caption"]
+        )[:REGION_TEXT_CHARS]
+    return regions
+
+
+def _render(page: fitz.Page, bbox: fitz.Rect, path: str) -> Tuple[int, int]:
+    zoom = min(CROP_DPI / 72, CROP_MAX_WIDTH / max(bbox.width, 1))
+    grayscale = not has_color(page, bbox)
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom), clip=bbox, colorspace=fitz.csGRAY if grayscale else fitz.csRGB
+    )
+    image = Image.frombytes("L" if grayscale else "RGB", (pix.width, pix.height), pix.samples)
+    image.save(path, format="JPEG", quality=CROP_QUALITY, optimize=True)
+    return pix.width, pix.height
+
+
+class DocumentLayout:
+    """Regiones de tablas y figuras de un documento, con su recorte en JPEG"""
+
+    def __init__(self, regions: List[Dict[str, Any]]):
+        self.regions = regions
+
+    def __len__(self) -> int:
+        return len(self.regions)
+
+    def select(self, gene: str, variant: str, max_tiles: int = LAYOUT_MAX_TILES) -> List[Dict[str, Any]]:
+        """
+        Regiones más relevantes para una variante: las que la mencionan (o
+        mencionan el gen) en el pie o en su texto, y después las tablas y las
+        que hablan de controles y variantes patogénicas/benignas.
+        """
+        variant_terms = {term.lower() for term in (variant, re.sub(r"^[cpg]\.", "", variant or "")) if term}
+        gene_term = (gene or "").lower()
+
+        def score(region: Dict[str, Any]) -> float:
+            text = f"{region['caption']} {region['text']}".lower()
+            value = 3.0 * any(term in text for term in variant_terms)
+            value += 1.0 * bool(gene_term and gene_term in text)
+            value += 0.5 * sum(keyword in text for keyword in ODDS_PATH_KEYWORDS)
+            value += 1.0 * (region["kind"] == "table")
+            return value
+
+        ranked = sorted(self.regions, key=score, reverse=True)[:max_tiles]
+        return sorted(ranked, key=lambda region: (region["page"], region["index"]))
+
+
+def load_layout(output_dir: str) -> Optional[DocumentLayout]:
+    """Regiones guardadas por `analyze_layout` en `output_dir`, o None si no están o son de otra versión"""
+    index_path = os.path.join(output_dir, LAYOUT_INDEX)
+    try:
+        with open(index_path) as f:
+            cached = json.load(f)
+        if cached.get("version") != LAYOUT_VERSION:
+            return None
+        regions = [{**region, "path": os.path.join(output_dir, region["file"])} for region in cached["regions"]]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Índice de regiones inválido en {index_path}: {e}")
+        return None
+    if not all(os.path.exists(region["path"]) for region in regions):
+        return None
+    return DocumentLayout(regions)
+
+
+def analyze_layout(document: fitz.Document, output_dir: str) -> DocumentLayout:
+    """
+    Extrae y recorta las tablas y figuras del documento en `output_dir`, junto
+    con un índice (`regions.json`, con rutas relativas) que `load_layout` lee
+    desde cualquier copia del directorio.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    regions = []
+    for page_number, page in enumerate(document, start=1):
+        for index, region in enumerate(find_regions(page)):
+            filename = f"region_{page_number}_{index}.jpg"
+            width, height = _render(page, region["bbox"], os.path.join(output_dir, filename))
+            regions.append({
+                **region,
+                "page": page_number,
+                "index": index,
+                "bbox": [round(value, 1) for value in region["bbox"]],
+                "file": filename,
+                "width": width,
+                "height": height,
+                "tokens": estimate_tokens_by_provider(width, height),
+            })
+
+    with open(os.path.join(output_dir, LAYOUT_INDEX), "w") as f:
+        json.dump({"version": LAYOUT_VERSION, "regions": regions}, f)
+    logger.info(f"Regiones extraídas: {len(regions)}")
+    return DocumentLayout([{**region, "path": os.path.join(output_dir, region["file"])} for region in regions])
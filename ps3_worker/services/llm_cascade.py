@@ -0,0 +1,259 @@
+import json
+import logging
+import random
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from ps3_worker.constants import (
+    LLM_CASCADE_SCHEMAS, LLM_CASCADE_MAX_MISSING, LLM_CASCADE_MAX_NOT_SPECIFIED, LLM_CASCADE_AUDIT_RATE,
+    MAX_VARIANTS_PER_DOCUMENT
+)
+from ps3_worker.services.metrics import LLM_CASCADE, LLM_CASCADE_AGREEMENT
+from ps3_worker.services.tracing import tracer
+from ps3_worker.services.vllm_client import BaseChatClient, validate_response
+
+logger = logging.getLogger(__name__)
+
+# Campos que usa OddsPathCalculator
+ODDS_PATH_FIELDS = ("pathogenicVariants", "totalVariants", "pathogenicAbnormalVariants")
+
+# Un validador devuelve el motivo por el que la respuesta no es aceptable, o None
+Validator = Callable[[BaseModel], Optional[str]]
+
+
+def _extracted_record(response: BaseModel) -> BaseModel:
+    """Registro extraído: el modelo anidado en `data` (ResearchData) o la propia respuesta"""
+    nested = getattr(response, "data", None)
+    return nested if isinstance(nested, BaseModel) else response
+
+
+def _field_values(response: BaseModel) -> Dict[str, Any]:
+    """Valor de cada campo del registro ({value, explanation} -> value)"""
+    record = _extracted_record(response)
+    values = {}
+    for name in type(record).model_fields:
+        field = getattr(record, name, None)
+        values[name] = getattr(field, "value", field) if isinstance(field, BaseModel) else field
+    return values
+
+
+def _is_missing(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _is_not_specified(value: Any) -> bool:
+    return isinstance(value, str) and "not specified" in value.lower()
+
+
+def check_completeness(response: BaseModel, max_missing: float = LLM_CASCADE_MAX_MISSING) -> Optional[str]:
+    values = _field_values(response)
+    if not values:
+        return None
+    missing = sum(_is_missing(value) for value in values.values())
+    return "incomplete" if missing / len(values) > max_missing else None
+
+
+def check_not_specified(response: BaseModel, max_ratio: float = LLM_CASCADE_MAX_NOT_SPECIFIED) -> Optional[str]:
+    values = _field_values(response)
+    if not values:
+        return None
+    not_specified = sum(_is_not_specified(value) for value in values.values())
+    return "not_specified" if not_specified / len(values) > max_ratio else None
+
+
+def check_odds_path_counts(response: BaseModel) -> Optional[str]:
+    """Conteos utilizables por OddsPathCalculator: todos o ninguno, enteros y coherentes entre sí"""
+    values = _field_values(response)
+    counts = [values.get(name) for name in ODDS_PATH_FIELDS]
+    if all(_is_missing(count) for count in counts):
+        return None
+    try:
+        pathogenic, total, abnormal = (int(count) for count in counts)
+    except (TypeError, ValueError):
+        return "counts_partial"
+    benign = total - pathogenic
+    if min(pathogenic, total, abnormal) < 0 or pathogenic > total or abnormal > benign:
+        return "counts_inconsistent"
+    return None
+
+
+def check_variant_list(response: BaseModel) -> Optional[str]:
+    variants = getattr(response, "data", None)
+    if not isinstance(variants, list) or not variants:
+        return "no_variants"
+    if len(variants) > MAX_VARIANTS_PER_DOCUMENT:
+        return "too_many_variants"
+    if any(_is_missing(getattr(variant, "gene", None)) or _is_missing(getattr(variant, "variant", None))
+           for variant in variants):
+        return "incomplete"
+    return None
+
+
+# Validadores por esquema; el resto de esquemas solo comprueban que la respuesta cumple el esquema
+DEFAULT_VALIDATORS: Dict[str, List[Validator]] = {
+    "FunctionalVariants": [check_variant_list],
+    "ResearchData": [check_completeness, check_not_specified, check_odds_path_counts],
+}
+
+
+def _leaves(value: Any, path: str = "") -> Iterator[Tuple[str, Any]]:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key != "explanation":
+                yield from _leaves(item, f"{path}.{key}")
+    elif isinstance(value, list):
+        yield path, frozenset(json.dumps(item, sort_keys=True, default=str).lower() for item in value)
+    elif isinstance(value, str):
+        yield path, " ".join(value.lower().split())
+    else:
+        yield path, value
+
+
+def agreement(first: BaseModel, second: BaseModel) -> float:
+    """Fracción de campos con el mismo valor (sin explicaciones); en listas, índice de Jaccard"""
+    left, right = dict(_leaves(first.model_dump())), dict(_leaves(second.model_dump()))
+    keys = left.keys() | right.keys()
+    if not keys:
+        return 1.0
+    score = 0.0
+    for key in keys:
+        a, b = left.get(key), right.get(key)
+        if isinstance(a, frozenset) and isinstance(b, frozenset):
+            score += len(a & b) / len(a | b) if a | b else 1.0
+        else:
+            score += float(a == b)
+    return score / len(keys)
+
+
+class CascadeChatClient(BaseChatClient):
+    """
+    Pregunta primero al modelo barato y solo escala al principal cuando la
+    respuesta no pasa los validadores del esquema (o el modelo barato falla).
+
+    Cuando se escala, y en una fracción `audit_rate` de las respuestas
+    aceptadas, se mide el acuerdo entre ambos modelos. Las decisiones quedan en
+    el span de la llamada (`cascade`, `cascade_reason`, `cascade_agreement`) y
+    en las métricas `ps3_llm_cascade_*`.
+    """
+
+    def __init__(
+        self,
+        cheap: BaseChatClient,
+        expensive: BaseChatClient,
+        validators: Optional[Dict[str, List[Validator]]] = None,
+        schemas: Optional[List[str]] = None,
+        audit_rate: float = LLM_CASCADE_AUDIT_RATE,
+        seed: Optional[int] = None
+    ):
+        self.cheap = cheap
+        self.expensive = expensive
+        self.model_name = expensive.model_name
+        self.validators = DEFAULT_VALIDATORS if validators is None else validators
+        self.schemas = set(schemas if schemas is not None else filter(None, LLM_CASCADE_SCHEMAS.split(",")))
+        self.audit_rate = audit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def _call(self, client: BaseChatClient, prompt_text, image_paths, model) -> Tuple[Any, Dict[str, int]]:
+        client.last_usage = {}
+        try:
+            response = client.send_message_once(prompt_text, image_paths, model)
+            return (validate_response(model, response) if model else response), dict(client.last_usage)
+        except Exception:
+            # Los tokens consumidos cuentan aunque la respuesta no sirva
+            self._add_usage(client.last_usage)
+            raise
+
+    def _add_usage(self, usage: Dict[str, int]):
+        totals = dict(self.last_usage)
+        for key, value in (usage or {}).items():
+            totals[key] = totals.get(key, 0) + value
+        self.last_usage = totals
+
+    def _validate(self, schema: str, response: BaseModel) -> Optional[str]:
+        for validator in self.validators.get(schema, []):
+            reason = validator(response)
+            if reason:
+                return reason
+        return None
+
+    def _record(self, schema: str, outcome: str, reason: str, agreement_score: Optional[float]):
+        LLM_CASCADE.inc(schema=schema, outcome=outcome, reason=reason)
+        if agreement_score is not None:
+            LLM_CASCADE_AGREEMENT.observe(agreement_score, schema=schema)
+        with self._lock:
+            stats = self.stats.setdefault(schema, {"calls": 0, "escalated": 0, "reasons": {}, "agreement": []})
+            stats["calls"] += 1
+            if outcome == "escalated":
+                stats["escalated"] += 1
+                stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+            if agreement_score is not None:
+                stats["agreement"].append(agreement_score)
+
+        span = tracer.current_span()
+        if span is not None:
+            span.set_attributes(cascade=outcome, cascade_reason=reason)
+            if agreement_score is not None:
+                span.set_attribute("cascade_agreement", round(agreement_score, 3))
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Tasa de escalado, motivos y acuerdo medio por esquema"""
+        with self._lock:
+            return {
+                schema: {
+                    "calls": stats["calls"],
+                    "escalated": stats["escalated"],
+                    "escalation_rate": round(stats["escalated"] / stats["calls"], 3) if stats["calls"] else 0.0,
+                    "reasons": dict(stats["reasons"]),
+                    "agreement": round(sum(stats["agreement"]) / len(stats["agreement"]), 3)
+                    if stats["agreement"] else None,
+                }
+                for schema, stats in sorted(self.stats.items())
+            }
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        schema = model.__name__ if model else "text"
+        self.last_usage = {}
+        if model is None or schema not in self.schemas:
+            response, self.last_usage = self._call(self.expensive, prompt_text, image_paths, model)
+            return response
+
+        cheap_response = None
+        try:
+            cheap_response, usage = self._call(self.cheap, prompt_text, image_paths, model)
+            self._add_usage(usage)
+            reason = self._validate(schema, cheap_response)
+        except Exception as e:
+            logger.warning(f"Cascada: el modelo barato falló en {schema}, se escala: {e}")
+            reason = "error"
+
+        with self._lock:
+            audit = reason is None and self.audit_rate > 0 and self._rng.random() < self.audit_rate
+        if reason is None and not audit:
+            self._record(schema, "accepted", "none", None)
+            return cheap_response
+
+        if audit:
+            try:
+                response, usage = self._call(self.expensive, prompt_text, image_paths, model)
+            except Exception as e:
+                logger.warning(f"Cascada: falló la auditoría de {schema}: {e}")
+                self._record(schema, "accepted", "none", None)
+                return cheap_response
+            self._add_usage(usage)
+            self._record(schema, "audited", "none", agreement(cheap_response, response))
+            return cheap_response
+
+        response, usage = self._call(self.expensive, prompt_text, image_paths, model)
+        self._add_usage(usage)
+        score = agreement(cheap_response, response) if cheap_response is not None else None
+        self._record(schema, "escalated", reason, score)
+        return response
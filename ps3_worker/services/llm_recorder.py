@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+
+from ps3_worker.constants import LLM_ARCHIVE_PATH
+from ps3_worker.services.page_image import load_page_images
+from ps3_worker.services.vllm_client import BaseChatClient
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayMissError(Exception):
+    """La petición no está en el archivo de respuestas grabadas"""
+
+    # Repetir la petición no cambia el resultado
+    retryable = False
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def describe_request(
+    provider: str,
+    model_name: str,
+    prompt_text: str,
+    image_paths: Optional[List[str]],
+    model: Optional[Type[BaseModel]]
+) -> Dict[str, Any]:
+    """Descripción de una petición y su huella (fingerprint) estable"""
+    image_hashes = [image.sha256 for image in load_page_images(image_paths)]
+
+    schema = json.dumps(model.model_json_schema(), sort_keys=True) if model else ""
+    request = {
+        "provider": provider,
+        "model": model_name,
+        "schema": model.__name__ if model else None,
+        "schema_sha256": _sha256(schema.encode()) if model else None,
+        "prompt_sha256": _sha256(prompt_text.encode("utf-8")),
+        "image_sha256": image_hashes,
+    }
+    request["fingerprint"] = _sha256(json.dumps(request, sort_keys=True).encode())
+    return request
+
+
+class LLMArchive:
+    """
+    Archivo compacto de peticiones y respuestas (JSONL comprimido con gzip).
+
+    Cada escritura añade un miembro gzip al final del archivo, así que grabar
+    nunca reescribe lo anterior. Una misma huella puede tener varias respuestas;
+    en replay se sirven en el orden en que se grabaron.
+    """
+
+    def __init__(self, path: str = LLM_ARCHIVE_PATH):
+        self.path = path
+        self._responses: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._responses.setdefault(record["fingerprint"], []).append(record)
+        logger.info(f"Archivo de respuestas cargado: {self.path} ({len(self._responses)} peticiones)")
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def append(self, record: Dict[str, Any]):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._responses.setdefault(record["fingerprint"], []).append(record)
+
+    def lookup(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        fingerprint = request["fingerprint"]
+        with self._lock:
+            records = self._responses.get(fingerprint)
+            if not records:
+                miss = self.misses.setdefault(fingerprint, {**request, "count": 0})
+                miss["count"] += 1
+                return None
+            index = self._served.get(fingerprint, 0)
+            self._served[fingerprint] = index + 1
+            self.hits += 1
+            return records[index % len(records)]
+
+    def report(self) -> Dict[str, Any]:
+        """Aciertos y fallos del replay (los fallos agrupados por huella)"""
+        return {
+            "archive": self.path,
+            "requests": len(self._responses),
+            "hits": self.hits,
+            "misses": sum(miss["count"] for miss in self.misses.values()),
+            "missed_requests": [
+                {key: miss[key] for key in ("fingerprint", "schema", "prompt_sha256", "count")}
+                for miss in self.misses.values()
+            ],
+        }
+
+
+_archives: Dict[str, LLMArchive] = {}
+
+
+def get_archive(path: str = LLM_ARCHIVE_PATH) -> LLMArchive:
+    """Archivo compartido por todos los clientes del proceso"""
+    if path not in _archives:
+        _archives[path] = LLMArchive(path)
+    return _archives[path]
+
+
+def _raw_response(response: Any) -> str:
+    if hasattr(response, "model_dump_json"):
+        return response.model_dump_json()
+    return response if isinstance(response, str) else str(response)
+
+
+class RecordingChatClient(BaseChatClient):
+    """
+    Envuelve un cliente real y graba cada petición con su respuesta.
+
+    Con `replay_first` se sirve primero lo grabado y solo se llama al proveedor
+    en los fallos de replay.
+    """
+
+    def __init__(self, client: BaseChatClient, provider: str, archive: LLMArchive, replay_first: bool = False):
+        self.client = client
+        self.provider = provider
+        self.model_name = client.model_name
+        self.archive = archive
+        self.replay_first = replay_first
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        request = describe_request(self.provider, self.model_name, prompt_text, image_paths, model)
+        if self.replay_first:
+            record = self.archive.lookup(request)
+            if record is not None:
+                self.last_usage = dict(record.get("usage") or {})
+                return record["response"]
+
+        self.client.last_usage = {}
+        started = time.perf_counter()
+        response = self.client.send_message_once(prompt_text, image_paths, model)
+        self.last_usage = dict(self.client.last_usage)
+
+        self.archive.append({
+            **request,
+            "response": _raw_response(response),
+            "usage": self.last_usage,
+            "latency_s": round(time.perf_counter() - started, 4),
+            "recorded_at": datetime.now().isoformat(),
+        })
+        return response
+
+
+class ReplayChatClient(BaseChatClient):
+    """Sirve respuestas grabadas por huella de la petición, sin llamar al proveedor"""
+
+    def __init__(self, provider: str, model_name: str, archive: LLMArchive, simulate_latency: bool = False):
+        self.provider = provider
+        self.model_name = model_name
+        self.archive = archive
+        self.simulate_latency = simulate_latency
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        request = describe_request(self.provider, self.model_name, prompt_text, image_paths, model)
+        record = self.archive.lookup(request)
+        if record is None:
+            logger.warning(
+                f"Replay sin respuesta grabada: {request['schema']} {request['fingerprint'][:12]} "
+                f"({len(request['image_sha256'])} imágenes)"
+            )
+            raise ReplayMissError(f"Petición no grabada: {request['fingerprint']}")
+
+        if self.simulate_latency and record.get("latency_s"):
+            time.sleep(record["latency_s"])
+        self.last_usage = dict(record.get("usage") or {})
+        return record["response"]
@@ -0,0 +1,313 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from ps3_worker.constants import (
+    LLM_ROUTES, LLM_HEDGE_ENABLED, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_DELAY_S, LLM_HEDGE_DEFAULT_DELAY_S,
+    LLM_LATENCY_WINDOW, LLM_LATENCY_MIN_SAMPLES, LLM_PROVIDER_MAX_FAILURES, LLM_PROVIDER_COOLDOWN_S
+)
+from ps3_worker.services.metrics import LLM_ROUTED
+from ps3_worker.services.tracing import tracer
+from ps3_worker.services.vllm_client import BaseChatClient, LLMProvider, create_provider_client, validate_response
+
+logger = logging.getLogger(__name__)
+
+# Hilos compartidos por todos los routers para lanzar los intentos en paralelo
+ROUTER_MAX_WORKERS = 32
+
+
+class LatencyTracker:
+    """
+    Latencias recientes (ventana deslizante por proveedor y esquema) y salud de
+    cada proveedor. Un proveedor con `max_failures` fallos seguidos deja de
+    recibir tráfico durante `cooldown_s` segundos, salvo que no quede otro.
+    """
+
+    def __init__(
+        self,
+        window: int = LLM_LATENCY_WINDOW,
+        min_samples: int = LLM_LATENCY_MIN_SAMPLES,
+        max_failures: int = LLM_PROVIDER_MAX_FAILURES,
+        cooldown_s: float = LLM_PROVIDER_COOLDOWN_S
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.cooldown_s = cooldown_s
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+        self._failures: Dict[str, int] = {}
+        self._unhealthy_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record_success(self, provider: str, schema: str, latency_s: float):
+        with self._lock:
+            self._latencies.setdefault((provider, schema), deque(maxlen=self.window)).append(latency_s)
+            self._failures[provider] = 0
+            self._unhealthy_until.pop(provider, None)
+
+    def record_failure(self, provider: str):
+        with self._lock:
+            failures = self._failures.get(provider, 0) + 1
+            self._failures[provider] = failures
+            if failures >= self.max_failures:
+                if provider not in self._unhealthy_until:
+                    logger.warning(f"Proveedor {provider} sin tráfico durante {self.cooldown_s}s tras {failures} fallos seguidos")
+                self._unhealthy_until[provider] = time.monotonic() + self.cooldown_s
+
+    def is_healthy(self, provider: str) -> bool:
+        with self._lock:
+            return self._unhealthy_until.get(provider, 0.0) <= time.monotonic()
+
+    def quantile(self, provider: str, schema: str, q: float) -> Optional[float]:
+        """Cuantil `q` de la latencia reciente, o None si aún no hay muestras suficientes"""
+        with self._lock:
+            samples = sorted(self._latencies.get((provider, schema), ()))
+        if len(samples) < max(self.min_samples, 1):
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Resumen por proveedor y esquema (muestras, p50 y p95)"""
+        with self._lock:
+            latencies = {key: sorted(values) for key, values in self._latencies.items()}
+            failures = dict(self._failures)
+        return {
+            f"{provider}/{schema}": {
+                "samples": len(values),
+                "p50_s": round(values[len(values) // 2], 4),
+                "p95_s": round(values[min(int(0.95 * len(values)), len(values) - 1)], 4),
+                "consecutive_failures": failures.get(provider, 0),
+            }
+            for (provider, schema), values in sorted(latencies.items())
+            if values
+        }
+
+
+class Route:
+    """Proveedor del router con su peso en el reparto del tráfico"""
+
+    def __init__(self, name: str, client: BaseChatClient, weight: float = 1.0):
+        self.name = name
+        self.client = client
+        self.weight = weight
+
+
+def parse_routes(spec: str) -> List[Tuple[LLMProvider, str, float]]:
+    """
+    Interpreta "proveedor:modelo:peso" separados por comas. El peso es opcional
+    y el modelo puede contener ":" (p. ej. "ollama:gemma:7b:1").
+    """
+    routes = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        provider, _, rest = entry.partition(":")
+        model_name, weight = rest, 1.0
+        head, _, tail = rest.rpartition(":")
+        if head:
+            try:
+                model_name, weight = head, float(tail)
+            except ValueError:
+                pass
+        routes.append((LLMProvider(provider), model_name, weight))
+    return routes
+
+
+# Estadísticas compartidas por todos los routers del proceso
+latency_tracker = LatencyTracker()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ROUTER_MAX_WORKERS, thread_name_prefix="llm-router")
+        return _executor
+
+
+class RoutingChatClient(BaseChatClient):
+    """
+    Reparte las peticiones entre varios proveedores según su peso.
+
+    - Failover: si el proveedor falla (o su respuesta no cumple el esquema) se
+      pasa al siguiente.
+    - Hedging: si el primario no ha respondido en el cuantil `hedge_quantile` de
+      su latencia reciente, se lanza la misma petición a otro proveedor y se
+      usa la primera respuesta válida. La otra sigue en su hilo y se descarta.
+    """
+
+    def __init__(
+        self,
+        routes: List[Route],
+        tracker: Optional[LatencyTracker] = None,
+        hedge: bool = LLM_HEDGE_ENABLED,
+        hedge_quantile: float = LLM_HEDGE_QUANTILE,
+        hedge_min_delay_s: float = LLM_HEDGE_MIN_DELAY_S,
+        hedge_default_delay_s: float = LLM_HEDGE_DEFAULT_DELAY_S,
+        seed: Optional[int] = None
+    ):
+        if not routes:
+            raise ValueError("El router necesita al menos un proveedor")
+        self.routes = routes
+        self.model_name = "router"
+        self.tracker = tracker or latency_tracker
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay_s = hedge_min_delay_s
+        self.hedge_default_delay_s = hedge_default_delay_s
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, spec: str = LLM_ROUTES, **kwargs) -> "RoutingChatClient":
+        routes = [
+            Route(f"{provider.value}/{model_name}", create_provider_client(provider, model_name), weight)
+            for provider, model_name, weight in parse_routes(spec)
+        ]
+        return cls(routes, **kwargs)
+
+    def _candidates(self) -> List[Route]:
+        """Primario elegido por peso entre los sanos; después el resto por peso"""
+        healthy = [route for route in self.routes if route.weight > 0 and self.tracker.is_healthy(route.name)]
+        pool = healthy or [route for route in self.routes if route.weight > 0] or self.routes
+        with self._rng_lock:
+            primary = self._rng.choices(pool, weights=[max(route.weight, 1e-9) for route in pool])[0]
+        others = sorted(
+            (route for route in self.routes if route is not primary),
+            key=lambda route: (route not in healthy, -route.weight)
+        )
+        return [primary] + others
+
+    def _hedge_delay(self, route: Route, schema: str) -> float:
+        latency = self.tracker.quantile(route.name, schema, self.hedge_quantile)
+        if latency is None:
+            return self.hedge_default_delay_s
+        return max(latency, self.hedge_min_delay_s)
+
+    def _attempt(
+        self,
+        route: Route,
+        role: str,
+        prompt_text: str,
+        image_paths: Optional[List[str]],
+        model: Optional[Type[BaseModel]]
+    ) -> Tuple[Any, Dict[str, int]]:
+        schema = model.__name__ if model else "text"
+        with tracer.span(f"route.{route.name}", role=role):
+            started = time.perf_counter()
+            route.client.last_usage = {}
+            try:
+                response = route.client.send_message_once(prompt_text, image_paths, model)
+                if model:
+                    response = validate_response(model, response)
+            except Exception:
+                self.tracker.record_failure(route.name)
+                raise
+            self.tracker.record_success(route.name, schema, time.perf_counter() - started)
+            return response, dict(route.client.last_usage)
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        schema = model.__name__ if model else "text"
+        candidates = self._candidates()
+        pending: Dict[Future, Tuple[Route, str]] = {}
+        launched = 0
+        hedge_at: Optional[float] = None
+        last_error: Optional[Exception] = None
+
+        def launch(role: str):
+            nonlocal launched, hedge_at
+            route = candidates[launched]
+            launched += 1
+            # Cada intento necesita su propia copia del contexto (trazas de la tarea)
+            context = contextvars.copy_context()
+            future = _get_executor().submit(
+                context.run, self._attempt, route, role, prompt_text, image_paths, model
+            )
+            pending[future] = (route, role)
+            if self.hedge and role != "hedge" and hedge_at is None and launched < len(candidates):
+                hedge_at = time.monotonic() + self._hedge_delay(route, schema)
+
+        launch("primary")
+        while pending:
+            timeout = None if hedge_at is None else max(hedge_at - time.monotonic(), 0.0)
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_at = None
+                if launched < len(candidates):
+                    launch("hedge")
+                continue
+
+            for future in done:
+                route, role = pending.pop(future)
+                try:
+                    response, usage = future.result()
+                except Exception as e:
+                    last_error = e
+                    LLM_ROUTED.inc(provider=route.name, role=role, outcome="error")
+                    logger.warning(f"Router: {route.name} ({role}) falló: {e}")
+                    continue
+
+                LLM_ROUTED.inc(provider=route.name, role=role, outcome="won")
+                for loser, (loser_route, loser_role) in pending.items():
+                    loser.add_done_callback(
+                        lambda f, name=loser_route.name, loser_role=loser_role: LLM_ROUTED.inc(
+                            provider=name, role=loser_role, outcome="error" if f.exception() else "lost"
+                        )
+                    )
+                self.last_usage = usage
+                return response
+
+            if not pending and launched < len(candidates):
+                hedge_at = None
+                launch("failover")
+
+        raise last_error
+
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[str]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        """Streaming sin hedging: solo se cambia de proveedor si falla antes del primer fragmento"""
+        schema = model.__name__ if model else "text"
+        last_error: Optional[Exception] = None
+        for index, route in enumerate(self._candidates()):
+            role = "primary" if index == 0 else "failover"
+            route.client.last_usage = {}
+            started = time.perf_counter()
+            stream = route.client.stream_message_once(prompt_text, image_paths, model)
+            emitted = False
+            try:
+                for chunk in stream:
+                    emitted = True
+                    yield chunk
+            except Exception as e:
+                self.tracker.record_failure(route.name)
+                LLM_ROUTED.inc(provider=route.name, role=role, outcome="error")
+                if emitted:
+                    raise
+                logger.warning(f"Router: stream de {route.name} falló antes del primer fragmento: {e}")
+                last_error = e
+                continue
+            finally:
+                stream.close()
+                self.last_usage = dict(route.client.last_usage)
+
+            self.tracker.record_success(route.name, schema, time.perf_counter() - started)
+            LLM_ROUTED.inc(provider=route.name, role=role, outcome="won")
+            return
+        raise last_error
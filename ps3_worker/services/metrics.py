@@ -0,0 +1,403 @@
+import atexit
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ps3_worker.constants import (
+    METRICS_HOST, METRICS_PORT, METRICS_MULTIPROC_DIR, METRICS_SNAPSHOT_INTERVAL
+)
+from ps3_worker.services.tracing import Span, tracer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Iterable[str], labelvalues: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Métrica con etiquetas. Cada combinación de etiquetas es una entrada del diccionario
+    `_values`; las actualizaciones toman un lock propio de la métrica, sin contención
+    entre métricas distintas.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), aggregate: str = "sum"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Cómo se combinan los valores de varios procesos: "sum" o "pid" (una serie por proceso)
+        self.aggregate = aggregate
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return [(key, self._copy(value)) for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # NaN no cumple ninguna comparación: se cuenta en el bucket +Inf
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets) - 1)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteos por bucket (no acumulados), suma]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _copy(self, value):
+        return [list(value[0]), value[1]]
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas del proceso.
+
+    Con `METRICS_MULTIPROC_DIR` cada proceso vuelca periódicamente una instantánea
+    JSON (`<pid>.json`) en ese directorio y el endpoint suma las de todos los procesos,
+    así que basta con que uno de ellos sirva el puerto.
+    """
+
+    def __init__(self, multiproc_dir: str = METRICS_MULTIPROC_DIR,
+                 snapshot_interval: float = METRICS_SNAPSHOT_INTERVAL):
+        self.multiproc_dir = multiproc_dir
+        self.snapshot_interval = snapshot_interval
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), aggregate: str = "sum") -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, aggregate))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado serializable de todas las métricas del proceso"""
+        PROCESS_RSS.set(current_rss_bytes())
+        return {
+            "pid": os.getpid(),
+            "metrics": {
+                metric.name: {
+                    "type": metric.type,
+                    "help": metric.documentation,
+                    "labelnames": list(metric.labelnames),
+                    "aggregate": metric.aggregate,
+                    "buckets": [bound for bound in metric.buckets if bound != float("inf")]
+                    if isinstance(metric, Histogram) else None,
+                    "samples": [[list(key), value] for key, value in metric.samples()],
+                }
+                for metric in list(self._metrics.values())
+            }
+        }
+
+    def write_snapshot(self):
+        """Vuelca la instantánea del proceso en el directorio compartido (escritura atómica)"""
+        if not self.multiproc_dir:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _run_snapshots(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error(f"Error escribiendo la instantánea de métricas: {e}")
+
+    def start_snapshots(self):
+        """Arranca el volcado periódico si hay directorio compartido"""
+        if not self.multiproc_dir or (self._snapshot_thread and self._snapshot_thread.is_alive()):
+            return
+        self._stop.clear()
+        self._snapshot_thread = threading.Thread(target=self._run_snapshots, name="metrics-snapshots", daemon=True)
+        self._snapshot_thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.write_snapshot()
+        except Exception as e:
+            logger.error(f"Error escribiendo la instantánea final de métricas: {e}")
+
+    def _snapshots(self) -> List[Dict[str, Any]]:
+        if not self.multiproc_dir:
+            return [self.snapshot()]
+
+        snapshots = {os.getpid(): self.snapshot()}
+        try:
+            names = os.listdir(self.multiproc_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.setdefault(snapshot.get("pid"), snapshot)
+        return list(snapshots.values())
+
+    def render(self) -> str:
+        """Métricas de todos los procesos en formato de texto de Prometheus"""
+        merged: Dict[str, Dict[str, Any]] = {}
+        for snapshot in self._snapshots():
+            pid = snapshot.get("pid")
+            alive = _pid_alive(pid)
+            for name, metric in snapshot["metrics"].items():
+                # Los gauges de procesos terminados ya no describen el estado actual
+                if metric["type"] == "gauge" and not alive:
+                    continue
+                entry = merged.setdefault(name, {**metric, "values": {}})
+                for labelvalues, value in metric["samples"]:
+                    if metric["aggregate"] == "pid":
+                        labelvalues = labelvalues + [str(pid)]
+                    key = tuple(labelvalues)
+                    entry["values"][key] = _merge_value(entry["values"].get(key), value, metric["type"])
+
+        lines: List[str] = []
+        for name in sorted(merged):
+            metric = merged[name]
+            labelnames = list(metric["labelnames"]) + (["pid"] if metric["aggregate"] == "pid" else [])
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labelvalues, value in sorted(metric["values"].items()):
+                if metric["type"] == "histogram":
+                    lines.extend(_render_histogram(name, labelnames, labelvalues, metric["buckets"], value))
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge_value(current, value, metric_type: str):
+    if current is None:
+        return value
+    if metric_type == "histogram":
+        return [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1]]
+    return current + value
+
+
+def _render_histogram(name, labelnames, labelvalues, buckets, value) -> List[str]:
+    counts, total = value
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(buckets) + [float("inf")], counts):
+        cumulative += count
+        le = f'le="{_format_value(bound)}"'
+        lines.append(f"{name}_bucket{_format_labels(labelnames, labelvalues, le)} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labelnames, labelvalues)} {_format_value(total)}")
+    lines.append(f"{name}_count{_format_labels(labelnames, labelvalues)} {cumulative}")
+    return lines
+
+
+def _pid_alive(pid) -> bool:
+    if not isinstance(pid, int):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def current_rss_bytes() -> int:
+    """Memoria residente actual del proceso (máxima histórica si no hay /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+# Registro global y métricas del worker
+registry = MetricsRegistry()
+
+TASKS_IN_FLIGHT = registry.gauge("ps3_tasks_in_flight", "Tareas en procesamiento")
+TASKS_TOTAL = registry.counter("ps3_tasks_total", "Tareas terminadas por estado", ("status",))
+QUEUE_WAIT = registry.histogram(
+    "ps3_queue_wait_seconds", "Tiempo en cola desde la publicación del mensaje", ("retry",)
+)
+STAGE_DURATION = registry.histogram("ps3_stage_duration_seconds", "Duración de cada etapa", ("stage",))
+LLM_REQUESTS = registry.counter(
+    "ps3_llm_requests_total", "Peticiones a modelos de lenguaje por resultado", ("provider", "model", "outcome")
+)
+LLM_ERRORS = registry.counter(
+    "ps3_llm_errors_total", "Errores de modelos de lenguaje por código de estado", ("provider", "status_code")
+)
+LLM_IMAGES = registry.histogram(
+    "ps3_llm_images_per_call", "Imágenes enviadas por llamada", ("provider",),
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64)
+)
+LLM_ROUTED = registry.counter(
+    "ps3_llm_routed_attempts_total", "Intentos del router por proveedor, papel (primary, failover, hedge) y resultado",
+    ("provider", "role", "outcome")
+)
+LLM_CASCADE = registry.counter(
+    "ps3_llm_cascade_total", "Respuestas del modelo barato aceptadas o escaladas, por motivo",
+    ("schema", "outcome", "reason")
+)
+LLM_CASCADE_AGREEMENT = registry.histogram(
+    "ps3_llm_cascade_agreement", "Acuerdo entre el modelo barato y el principal (fracción de campos iguales)",
+    ("schema",), buckets=(0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+)
+LLM_TOKENS = registry.counter("ps3_llm_tokens_total", "Tokens consumidos", ("provider", "model", "kind"))
+CACHE_REQUESTS = registry.counter("ps3_cache_requests_total", "Consultas a cachés por resultado", ("cache", "result"))
+ARTIFACT_CACHE_EVICTED = registry.counter(
+    "ps3_artifact_cache_evicted_total", "Documentos desalojados de la caché de artefactos por tamaño"
+)
+PAGES_FILTERED = registry.counter(
+    "ps3_pages_filtered_total", "Páginas descartadas antes de las llamadas LLM por motivo", ("reason",)
+)
+VARIANTS_PER_DOCUMENT = registry.histogram(
+    "ps3_variants_per_document", "Variantes extraídas por PDF", buckets=(0, 1, 2, 5, 10, 20, 50)
+)
+VARIANTS_DEDUPLICATED = registry.counter(
+    "ps3_variants_deduplicated_total", "Variantes repetidas con otra grafía que no se extraen de nuevo"
+)
+PROCESS_RSS = registry.gauge(
+    "ps3_process_resident_memory_bytes", "Memoria residente del proceso", aggregate="pid"
+)
+
+
+def _observe_span(span: Span):
+    """Listener del tracer: histogramas por etapa y consumo de las llamadas LLM"""
+    if span.name == "task":
+        return
+    STAGE_DURATION.observe(span.duration_s, stage=span.name)
+    if not span.name.startswith("llm."):
+        return
+    provider = span.attributes.get("provider")
+    model = span.attributes.get("model")
+    LLM_IMAGES.observe(span.attributes.get("images") or 0, provider=provider)
+    for kind in ("input", "output", "cached"):
+        tokens = span.attributes.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.inc(tokens, provider=provider, model=model, kind=kind)
+
+
+tracer.span_listeners.append(_observe_span)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Sirve `/metrics` en un hilo propio. Si el puerto ya está ocupado por otro proceso
+    del worker, este solo vuelca su instantánea y el otro la publica.
+    """
+    registry.start_snapshots()
+    if port <= 0:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.info(f"Puerto de métricas {port} no disponible ({e}); se publicará desde otro proceso")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+    return server
@@ -1,23 +1,76 @@
 import logging
-import tempfile
 import os
-from typing import Optional, Any
+from typing import Optional, Union
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from ps3_worker.constants import (
     MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_SECURE,
-    MINIO_BUCKET_PDFS, MINIO_BUCKET_PARQUETS
+    MINIO_BUCKET_PDFS, MINIO_BUCKET_PARQUETS, MINIO_MULTIPART_PART_SIZE
 )
 from ps3_shared.lib.minio import MinioManager
+from minio.commonconfig import CopySource
 
 logger = logging.getLogger(__name__)
 
+# Tamaño mínimo de parte que acepta S3 en las subidas multipart
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+
+class MinioObjectsMixin:
+    """
+    Operaciones en memoria sobre el cliente de minio-py que el MinioManager de
+    ps3_shared no expone. MinioService solo accede a MinIO a través del manager.
+    """
+
+    def get_object_bytes(self, bucket: str, object_name: str) -> bytes:
+        """Leer un objeto completo en memoria"""
+        response = self.client.get_object(bucket, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def put_object_bytes(
+        self,
+        bucket: str,
+        object_name: str,
+        data: Union[bytes, memoryview, pa.Buffer],
+        content_type: str = "application/octet-stream",
+        part_size: int = MINIO_MULTIPART_PART_SIZE
+    ) -> int:
+        """
+        Subir un buffer en memoria con longitud conocida; devuelve los bytes subidos.
+
+        Por encima de `part_size` el cliente usa subida multipart.
+        """
+        reader = pa.BufferReader(data)
+        self.client.put_object(
+            bucket,
+            object_name,
+            reader,
+            length=reader.size(),
+            content_type=content_type,
+            part_size=max(part_size, MIN_MULTIPART_PART_SIZE)
+        )
+        return reader.size()
+
+    def copy_object(self, bucket: str, object_name: str, source_bucket: str, source_object_name: str) -> None:
+        """Copiar un objeto en el servidor, sin descargarlo"""
+        self.client.copy_object(bucket, object_name, CopySource(source_bucket, source_object_name))
+
+
+class WorkerMinioManager(MinioObjectsMixin, MinioManager):
+    """MinioManager de ps3_shared con las operaciones en memoria del worker"""
+
 
 class MinioService:
     """Servicio para manejar las operaciones de MinIO en el worker"""
     
-    def __init__(self):
-        self.minio_manager = MinioManager(
+    def __init__(self, minio_manager: Optional[MinioObjectsMixin] = None):
+        self.minio_manager = minio_manager or WorkerMinioManager(
             MINIO_ENDPOINT, 
             MINIO_ACCESS_KEY, 
             MINIO_SECRET_KEY, 
@@ -56,37 +109,83 @@ class MinioService:
             logger.error(f"Error al descargar PDF: {e}")
             return False
     
+    def download_pdf_bytes(self, task_id: str, filename: str) -> bytes:
+        """
+        Descargar un PDF de MinIO directamente a memoria, sin pasar por disco.
+
+        Los errores se propagan para que `classify_failure` distinga un objeto
+        inexistente (NoSuchKey, permanente) de un fallo de red (transitorio).
+        """
+        # Estructura: {task_id}/pdfs/{filename}
+        minio_object_name = f"{task_id}/pdfs/{filename}"
+
+        try:
+            data = self.minio_manager.get_object_bytes(MINIO_BUCKET_PDFS, minio_object_name)
+        except Exception as e:
+            logger.error(f"Error al descargar PDF {minio_object_name}: {e}")
+            raise
+
+        logger.info(f"PDF descargado en memoria: {minio_object_name} ({len(data)} bytes)")
+        return data
+    
+    def upload_bytes(
+        self,
+        bucket: str,
+        object_name: str,
+        data: Union[bytes, memoryview, pa.Buffer],
+        content_type: str = "application/octet-stream"
+    ) -> None:
+        """
+        Subir un buffer en memoria con longitud conocida.
+        
+        Por encima de MINIO_MULTIPART_PART_SIZE el cliente usa subida multipart.
+        """
+        self.minio_manager.put_object_bytes(bucket, object_name, data, content_type=content_type)
+    
     def upload_parquet(self, task_id: str, filename: str, df: pd.DataFrame, parquet_type: str = "data") -> Optional[str]:
-        """Subir un archivo parquet a MinIO"""
+        """Subir un DataFrame a MinIO como parquet serializado en memoria"""
         try:
-            # Crear archivo temporal
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".parquet") as temp_file:
-                temp_file_path = temp_file.name
-            
-            # Guardar DataFrame como parquet
-            df.to_parquet(temp_file_path, index=False)
+            # Serializar el DataFrame en un buffer de Arrow (sin archivo temporal)
+            sink = pa.BufferOutputStream()
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), sink)
+            buffer = sink.getvalue()
             
             # Generar nombre único para el archivo en MinIO
             # Estructura: {task_id}/parquets/{parquet_type}_{filename}
             minio_object_name = f"{task_id}/parquets/{parquet_type}_{filename}"
             
-            # Subir archivo a MinIO
-            self.minio_manager.upload_file(
+            # Subir buffer a MinIO
+            self.upload_bytes(
                 MINIO_BUCKET_PARQUETS,
                 minio_object_name,
-                temp_file_path
+                buffer,
+                content_type="application/vnd.apache.parquet"
             )
             
-            # Limpiar archivo temporal
-            os.unlink(temp_file_path)
-            
-            logger.info(f"Parquet subido exitosamente: {minio_object_name}")
+            logger.info(f"Parquet subido exitosamente: {minio_object_name} ({buffer.size} bytes)")
             return minio_object_name
             
         except Exception as e:
             logger.error(f"Error al subir parquet: {e}")
             return None
     
+    def copy_parquet(self, source_object_name: str, task_id: str) -> Optional[str]:
+        """Copiar un parquet existente a la carpeta de otra tarea sin descargarlo (copia en servidor)"""
+        try:
+            # Estructura: {task_id}/parquets/{nombre_original}
+            minio_object_name = f"{task_id}/parquets/{os.path.basename(source_object_name)}"
+            
+            self.minio_manager.copy_object(
+                MINIO_BUCKET_PARQUETS, minio_object_name, MINIO_BUCKET_PARQUETS, source_object_name
+            )
+            
+            logger.info(f"Parquet copiado: {source_object_name} -> {minio_object_name}")
+            return minio_object_name
+            
+        except Exception as e:
+            logger.error(f"Error al copiar parquet {source_object_name}: {e}")
+            return None
+    
     def close(self):
         """Cerrar conexión a MinIO"""
         try:
@@ -1,7 +1,11 @@
 import logging
-from datetime import datetime
-from typing import Optional
-from ps3_worker.constants import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_TASKS
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from ps3_worker.constants import (
+    MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_TASKS, MONGO_COLLECTION_PDF_INDEX
+)
 from ps3_shared.lib.mongo import MongoManager
 
 logger = logging.getLogger(__name__)
@@ -10,9 +14,11 @@ logger = logging.getLogger(__name__)
 class MongoService:
     """Servicio para manejar las operaciones de MongoDB en el worker"""
     
-    def __init__(self):
-        self.mongo_manager = MongoManager(MONGO_URI, MONGO_DB_NAME)
+    def __init__(self, mongo_manager: Optional[MongoManager] = None):
+        self.mongo_manager = mongo_manager or MongoManager(MONGO_URI, MONGO_DB_NAME)
         self.collection = MONGO_COLLECTION_TASKS
+        self.pdf_index_collection = MONGO_COLLECTION_PDF_INDEX
+        self._pdf_index_ready = False
     
     def get_task_by_id(self, task_id: str) -> Optional[dict]:
         """Obtener una tarea por su ID"""
@@ -75,6 +81,138 @@ class MongoService:
             logger.error(f"Error al actualizar rutas de tarea {task_id}: {e}")
             return False
     
+    def bulk_update_tasks(self, updates: Dict[str, dict]) -> int:
+        """Aplicar en una sola llamada un `$set` por tarea ({task_id: campos})"""
+        if not updates:
+            return 0
+        operations = [
+            UpdateOne({"id": task_id}, {"$set": fields})
+            for task_id, fields in updates.items()
+        ]
+        result = self.mongo_manager.db[self.collection].bulk_write(operations, ordered=False)
+        logger.debug(f"Actualizadas {result.modified_count} tareas en bloque")
+        return result.modified_count
+    
+    def _pdf_index(self):
+        """Colección del índice de PDFs por hash de contenido"""
+        collection = self.mongo_manager.db[self.pdf_index_collection]
+        if not self._pdf_index_ready:
+            collection.create_index("content_hash", unique=True)
+            self._pdf_index_ready = True
+        return collection
+    
+    def get_pdf_index_entry(self, content_hash: str) -> Optional[dict]:
+        """Obtener la entrada del índice de PDFs para un hash"""
+        return self._pdf_index().find_one({"content_hash": content_hash})
+    
+    def acquire_pdf_lease(self, content_hash: str, task_id: str, lease_seconds: int) -> bool:
+        """
+        Intentar adquirir el lease de procesamiento de un PDF.
+        
+        Solo tiene éxito si no existe entrada, si el lease anterior caducó, si la
+        entrada falló de forma transitoria o si el lease ya pertenece a la misma
+        tarea (redelivery). Un fallo permanente no se vuelve a procesar.
+        La unicidad de `content_hash` garantiza que dos workers no lo obtengan a la vez.
+        """
+        now = datetime.now()
+        try:
+            self._pdf_index().find_one_and_update(
+                {
+                    "content_hash": content_hash,
+                    "status": {"$ne": "completed"},
+                    "$or": [
+                        {"lease_expires_at": {"$lt": now}},
+                        {"lease_owner": task_id},
+                        {"status": "failed", "permanent": {"$ne": True}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "status": "processing",
+                        "lease_owner": task_id,
+                        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        "updated_at": now,
+                    },
+                    "$setOnInsert": {"content_hash": content_hash, "created_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+    
+    def renew_pdf_lease(self, content_hash: str, task_id: str, lease_seconds: int) -> bool:
+        """Prolongar el lease de un PDF mientras la tarea que lo tiene sigue procesándolo"""
+        now = datetime.now()
+        result = self._pdf_index().update_one(
+            {"content_hash": content_hash, "lease_owner": task_id, "status": "processing"},
+            {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}}
+        )
+        return result.matched_count > 0
+    
+    def complete_pdf_index_entry(
+        self,
+        content_hash: str,
+        task_id: str,
+        parquet_paths: List[str],
+        dataset_ref: Optional[dict] = None
+    ) -> bool:
+        """Marcar un PDF como procesado y guardar los parquets y la referencia al dataset resultantes"""
+        now = datetime.now()
+        result = self._pdf_index().update_one(
+            {"content_hash": content_hash},
+            {
+                "$set": {
+                    "status": "completed",
+                    "task_id": task_id,
+                    "parquet_paths": parquet_paths,
+                    "dataset_ref": dataset_ref,
+                    "completed_at": now,
+                    "updated_at": now,
+                },
+                "$unset": {
+                    "lease_owner": "", "lease_expires_at": "",
+                    "permanent": "", "failure_reason": "", "failure_message": "", "failed_task_id": "",
+                },
+            }
+        )
+        return result.modified_count > 0
+    
+    def release_pdf_lease(
+        self,
+        content_hash: str,
+        task_id: str,
+        failure_reason: Optional[str] = None,
+        failure_message: Optional[str] = None
+    ) -> bool:
+        """
+        Liberar el lease de un PDF tras un fallo.
+
+        Sin `failure_reason` (fallo transitorio) otro worker puede volver a procesarlo;
+        con él se guarda el fallo permanente para que los duplicados fallen igual.
+        """
+        update: Dict[str, Any] = {"status": "failed", "updated_at": datetime.now()}
+        if failure_reason:
+            update.update(
+                permanent=True,
+                failure_reason=failure_reason,
+                failure_message=failure_message,
+                failed_task_id=task_id
+            )
+        try:
+            result = self._pdf_index().update_one(
+                {"content_hash": content_hash, "lease_owner": task_id, "status": "processing"},
+                {
+                    "$set": update,
+                    "$unset": {"lease_owner": "", "lease_expires_at": ""},
+                }
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Error al liberar lease del PDF {content_hash}: {e}")
+            return False
+    
     def close(self):
         """Cerrar conexión a MongoDB"""
         self.mongo_manager.close() 
\ No newline at end of file
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Dict, Iterator, Optional
+
+from ollama import AsyncClient
+
+from ps3_worker.constants import (
+    OLLAMA_HOST, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, OLLAMA_NUM_THREAD, OLLAMA_NUM_PARALLEL, OLLAMA_REQUEST_TIMEOUT_S
+)
+
+logger = logging.getLogger(__name__)
+
+_END_OF_STREAM = object()
+
+
+def parse_keep_alive(value: str) -> Any:
+    """"30m", "1h" o "-1" (modelo cargado indefinidamente); los números se envían como segundos"""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def default_options(num_ctx: int = OLLAMA_NUM_CTX, num_thread: int = OLLAMA_NUM_THREAD) -> Dict[str, Any]:
+    """Opciones del modelo; 0 deja el valor del servidor"""
+    options = {}
+    if num_ctx:
+        options["num_ctx"] = num_ctx
+    if num_thread:
+        options["num_thread"] = num_thread
+    return options
+
+
+class OllamaRuntime:
+    """
+    Cliente asíncrono de Ollama compartido por todos los `OllamaChatClient` del
+    proceso. Corre en su propio event loop (un hilo), de modo que las llamadas
+    síncronas desde los hilos del pipeline se multiplexan sobre una sola
+    conexión HTTP y como mucho `num_parallel` peticiones llegan a la vez al
+    servidor (el `OLLAMA_NUM_PARALLEL` del servidor); el resto esperan aquí en
+    lugar de en la cola del servidor.
+    """
+
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        num_parallel: int = OLLAMA_NUM_PARALLEL,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        options: Optional[Dict[str, Any]] = None,
+        timeout_s: float = OLLAMA_REQUEST_TIMEOUT_S
+    ):
+        self.host = host
+        self.num_parallel = max(num_parallel, 1)
+        self.keep_alive = parse_keep_alive(keep_alive)
+        self.options = default_options() if options is None else options
+        self.timeout_s = timeout_s
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ollama-runtime", daemon=True)
+        self._thread.start()
+        self._client, self._slots = self.run(self._create_client())
+
+    async def _create_client(self):
+        # El cliente HTTP asíncrono y el semáforo quedan ligados al loop del runtime
+        return AsyncClient(host=self.host, timeout=self.timeout_s or None), asyncio.Semaphore(self.num_parallel)
+
+    def run(self, coroutine: Awaitable) -> Any:
+        """Ejecuta una corrutina en el loop del runtime y espera su resultado"""
+        future: Future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _request(self, model: str, messages, format, options) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "messages": messages,
+            "format": format,
+            "options": {**self.options, **(options or {})},
+            "keep_alive": self.keep_alive,
+        }
+
+    async def _chat(self, request: Dict[str, Any]) -> Any:
+        async with self._slots:
+            return await self._client.chat(**request)
+
+    def chat(self, model: str, messages, format=None, options: Optional[Dict[str, Any]] = None) -> Any:
+        return self.run(self._chat(self._request(model, messages, format, options)))
+
+    def stream_chat(self, model: str, messages, format=None, options: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+        """
+        Fragmentos de la respuesta en streaming. La petición ocupa un hueco de
+        `num_parallel` hasta que termina; cerrar el generador la cancela.
+        """
+        request = self._request(model, messages, format, options)
+        stream = None
+        acquired = False
+
+        async def start():
+            nonlocal stream, acquired
+            await self._slots.acquire()
+            acquired = True
+            stream = await self._client.chat(**request, stream=True)
+
+        async def next_chunk():
+            return await anext(stream, _END_OF_STREAM)
+
+        async def finish():
+            try:
+                if stream is not None:
+                    await stream.aclose()
+            finally:
+                if acquired:
+                    self._slots.release()
+
+        try:
+            self.run(start())
+            while True:
+                chunk = self.run(next_chunk())
+                if chunk is _END_OF_STREAM:
+                    return
+                yield chunk
+        finally:
+            self.run(finish())
+
+    def prewarm(self, model: str) -> float:
+        """
+        Carga el modelo en memoria (petición vacía con `keep_alive`) para que la
+        primera tarea no pague la carga. Devuelve los segundos que tardó.
+        """
+        started = time.perf_counter()
+        self.run(self._client.generate(model=model, prompt="", keep_alive=self.keep_alive, options=self.options))
+        elapsed = time.perf_counter() - started
+        logger.info(f"Modelo {model} cargado en Ollama ({self.host}) en {elapsed:.1f}s, keep_alive={self.keep_alive}")
+        return elapsed
+
+    def close(self):
+        """Cierra el cliente HTTP y detiene el loop del runtime"""
+        try:
+            self.run(self._client.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+_runtime: Optional[OllamaRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_ollama_runtime() -> OllamaRuntime:
+    """Runtime compartido del proceso, creado en el primer uso"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = OllamaRuntime()
+        return _runtime
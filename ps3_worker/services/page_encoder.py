@@ -0,0 +1,302 @@
+import logging
+import math
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import fitz
+from PIL import Image, ImageChops
+
+from ps3_worker.constants import IMAGE_PIXEL_BUDGET, IMAGE_TOKEN_BUDGET, LLM_PROVIDER
+from ps3_worker.services.page_image import PageImage
+
+logger = logging.getLogger(__name__)
+
+# Cambiar la versión invalida las páginas codificadas guardadas en la caché de artefactos
+ENCODER_VERSION = 1
+
+# Resolución y compresión por tipo de página ("blank" no se codifica)
+PAGE_POLICIES: Dict[str, Dict[str, float]] = {
+    "text": {"dpi": 110, "max_width": 1200, "quality": 65},
+    "table": {"dpi": 170, "max_width": 1800, "quality": 80},
+    "figure": {"dpi": 150, "max_width": 1600, "quality": 80},
+}
+# Resolución mínima al ajustar el presupuesto del documento
+MIN_DPI = 72
+
+# Señales de clasificación
+BLANK_MAX_CHARS = 20
+FIGURE_MIN_COVERAGE = 0.12
+TABLE_MIN_RULES = 6
+CONTENT_MARGIN_PT = 8
+# Diferencia máxima entre canales (0-255) para considerar una página sin color
+COLOR_THRESHOLD = 24
+
+TOKEN_PROVIDERS = ("openai", "claude", "gemini", "ollama")
+
+
+def estimate_image_tokens(provider: str, width: int, height: int) -> int:
+    """Tokens aproximados que factura cada proveedor por una imagen de `width`x`height`"""
+    if width <= 0 or height <= 0:
+        return 0
+    if provider == "openai":
+        # detail=high: encajar en 2048x2048, lado corto a 768 y teselas de 512
+        scale = min(1.0, 2048 / max(width, height))
+        w, h = width * scale, height * scale
+        scale = min(1.0, 768 / min(w, h))
+        w, h = w * scale, h * scale
+        return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+    if provider == "claude":
+        # Lado largo hasta 1568 px y ~1,15 Mpx; (ancho * alto) / 750 tokens
+        scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+        return math.ceil(width * scale * height * scale / 750)
+    if provider == "gemini":
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    if provider == "ollama":
+        # Modelos de visión locales con número fijo de tokens por imagen (Gemma 3)
+        return 256
+    return 258
+
+
+def estimate_tokens_by_provider(width: int, height: int) -> Dict[str, int]:
+    return {provider: estimate_image_tokens(provider, width, height) for provider in TOKEN_PROVIDERS}
+
+
+def _area(rect: fitz.Rect) -> float:
+    return max(rect.width, 0) * max(rect.height, 0)
+
+
+def is_rule(item: Tuple) -> bool:
+    """Línea horizontal o vertical (o rectángulo muy fino) de una tabla"""
+    if item[0] == "l":
+        start, end = item[1], item[2]
+        return abs(start.x - end.x) < 1 or abs(start.y - end.y) < 1
+    if item[0] == "re":
+        rect = item[1]
+        return min(rect.width, rect.height) < 2 and max(rect.width, rect.height) > 20
+    return False
+
+
+def classify_page(page: fitz.Page) -> Dict[str, Any]:
+    """
+    Clasifica la página (text, table, figure o blank) con señales baratas de
+    PyMuPDF y calcula el rectángulo que contiene todo su contenido.
+    """
+    page_rect = page.rect
+    page_area = _area(page_rect) or 1.0
+
+    text_blocks = [block for block in page.get_text("blocks") if block[6] == 0 and block[4].strip()]
+    chars = sum(len(block[4].strip()) for block in text_blocks)
+    text_rects = [fitz.Rect(block[:4]) for block in text_blocks]
+    image_rects = [fitz.Rect(info["bbox"]) & page_rect for info in page.get_image_info()]
+    drawings = page.get_drawings()
+    drawing_rects = [fitz.Rect(drawing["rect"]) & page_rect for drawing in drawings]
+
+    rules = sum(is_rule(item) for drawing in drawings for item in drawing["items"])
+    filled_area = sum(
+        _area(rect) for drawing, rect in zip(drawings, drawing_rects)
+        if drawing.get("fill") is not None and min(rect.width, rect.height) >= 2
+    )
+    graphic_coverage = (sum(_area(rect) for rect in image_rects) + filled_area) / page_area
+
+    if chars < BLANK_MAX_CHARS and not image_rects and not drawings:
+        kind = "blank"
+    elif graphic_coverage >= FIGURE_MIN_COVERAGE:
+        kind = "figure"
+    elif rules >= TABLE_MIN_RULES:
+        kind = "table"
+    else:
+        kind = "text"
+
+    content = fitz.Rect()
+    for rect in text_rects + image_rects + drawing_rects:
+        if not rect.is_empty:
+            content |= rect
+    if content.is_empty:
+        content = fitz.Rect(page_rect)
+    else:
+        content = (content + (-CONTENT_MARGIN_PT, -CONTENT_MARGIN_PT, CONTENT_MARGIN_PT, CONTENT_MARGIN_PT)) & page_rect
+
+    return {
+        "kind": kind,
+        "chars": chars,
+        "text_coverage": round(sum(_area(rect) for rect in text_rects) / page_area, 3),
+        "graphic_coverage": round(graphic_coverage, 3),
+        "images": len(image_rects),
+        "rules": rules,
+        "clip": content,
+    }
+
+
+def has_color(page: fitz.Page, clip: fitz.Rect) -> bool:
+    """Renderiza una miniatura y comprueba si los canales RGB difieren"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(0.15, 0.15), clip=clip, colorspace=fitz.csRGB)
+    if not pix.width or not pix.height:
+        return False
+    red, green, blue = Image.frombytes("RGB", (pix.width, pix.height), pix.samples).split()
+    return max(
+        ImageChops.difference(red, green).getextrema()[1],
+        ImageChops.difference(green, blue).getextrema()[1]
+    ) > COLOR_THRESHOLD
+
+
+def image_report(images: List[PageImage]) -> Dict[str, Any]:
+    """Píxeles, bytes y tokens estimados por proveedor de un conjunto de imágenes"""
+    pages = []
+    for image in images:
+        pages.append({
+            "name": image.name,
+            "width": image.width,
+            "height": image.height,
+            "bytes": len(image),
+            "tokens": estimate_tokens_by_provider(image.width, image.height),
+        })
+    return _totals(pages)
+
+
+def _totals(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    kinds: Dict[str, int] = {}
+    for page in pages:
+        if "kind" in page:
+            kinds[page["kind"]] = kinds.get(page["kind"], 0) + 1
+    return {
+        "pages": pages,
+        "kinds": kinds,
+        "images": sum(1 for page in pages if page.get("width")),
+        "pixels": sum(page.get("width", 0) * page.get("height", 0) for page in pages),
+        "bytes": sum(page.get("bytes", 0) for page in pages),
+        "tokens": {
+            provider: sum(page.get("tokens", {}).get(provider, 0) for page in pages)
+            for provider in TOKEN_PROVIDERS
+        },
+    }
+
+
+class PageEncoder:
+    """
+    Codifica cada página según su contenido en lugar de con resolución fija:
+
+    - Clasifica la página (texto, tabla, figura o en blanco) y aplica la
+      resolución y calidad JPEG de `PAGE_POLICIES`. Las páginas en blanco no
+      se codifican.
+    - Recorta al rectángulo con contenido (sin márgenes vacíos).
+    - Usa escala de grises si la página no tiene color.
+    - Reduce la resolución de todas las páginas por igual si el documento
+      supera `pixel_budget` píxeles o `token_budget` tokens estimados para
+      `provider` (0 desactiva cada límite), sin bajar de `MIN_DPI`.
+    """
+
+    def __init__(
+        self,
+        pixel_budget: int = IMAGE_PIXEL_BUDGET,
+        token_budget: int = IMAGE_TOKEN_BUDGET,
+        provider: str = LLM_PROVIDER,
+        policies: Optional[Dict[str, Dict[str, float]]] = None
+    ):
+        self.pixel_budget = pixel_budget
+        self.token_budget = token_budget
+        self.provider = provider
+        self.policies = policies or PAGE_POLICIES
+
+    def _plan(self, profiles: List[Dict[str, Any]]) -> List[float]:
+        """Zoom de cada página (0 si no se codifica) dentro del presupuesto del documento"""
+        zooms = []
+        for profile in profiles:
+            policy = self.policies.get(profile["kind"])
+            if policy is None:
+                zooms.append(0.0)
+                continue
+            clip = profile["clip"]
+            zooms.append(min(policy["dpi"] / 72, policy["max_width"] / max(clip.width, 1)))
+
+        def size(index: int, zoom: float) -> Tuple[int, int]:
+            clip = profiles[index]["clip"]
+            return max(int(clip.width * zoom), 1), max(int(clip.height * zoom), 1)
+
+        min_zoom = MIN_DPI / 72
+        pixels = sum(math.prod(size(i, zoom)) for i, zoom in enumerate(zooms) if zoom)
+        if self.pixel_budget and pixels > self.pixel_budget:
+            factor = math.sqrt(self.pixel_budget / pixels)
+            zooms = [max(zoom * factor, min(zoom, min_zoom)) if zoom else 0.0 for zoom in zooms]
+
+        if self.token_budget:
+            for _ in range(20):
+                tokens = sum(
+                    estimate_image_tokens(self.provider, *size(i, zoom)) for i, zoom in enumerate(zooms) if zoom
+                )
+                if tokens <= self.token_budget or all(zoom <= min_zoom for zoom in zooms if zoom):
+                    break
+                zooms = [max(zoom * 0.85, min(zoom, min_zoom)) if zoom else 0.0 for zoom in zooms]
+        return zooms
+
+    def encode(
+        self,
+        document: fitz.Document,
+        output_dir: Optional[str] = None,
+        skip_pages: Optional[Set[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Codifica en memoria cada página con contenido (`image` de su entrada en
+        el informe, un `PageImage` llamado `page_{n}.jpg`) y devuelve el informe
+        de la codificación. Con `output_dir` las imágenes se escriben además en
+        disco. Las páginas de `skip_pages` (numeradas desde 1) no se codifican
+        ni cuentan en el presupuesto.
+        """
+        pages = list(document)
+        skip_pages = skip_pages or set()
+        profiles = [
+            {"kind": "filtered", "text_coverage": 0.0, "graphic_coverage": 0.0, "clip": page.rect}
+            if i + 1 in skip_pages else classify_page(page)
+            for i, page in enumerate(pages)
+        ]
+        zooms = self._plan(profiles)
+
+        report_pages = []
+        for i, (page, profile, zoom) in enumerate(zip(pages, profiles, zooms)):
+            entry = {
+                "page": i + 1,
+                "kind": profile["kind"],
+                "text_coverage": profile["text_coverage"],
+                "graphic_coverage": profile["graphic_coverage"],
+            }
+            if not zoom:
+                report_pages.append(entry)
+                continue
+
+            clip = profile["clip"]
+            grayscale = not has_color(page, clip)
+            pix = page.get_pixmap(
+                matrix=fitz.Matrix(zoom, zoom),
+                clip=clip,
+                colorspace=fitz.csGRAY if grayscale else fitz.csRGB
+            )
+            image = Image.frombytes("L" if grayscale else "RGB", (pix.width, pix.height), pix.samples)
+            page_image = PageImage.from_pil(
+                image,
+                name=f"page_{i + 1}.jpg",
+                page=i + 1,
+                quality=int(self.policies[profile["kind"]]["quality"]),
+                optimize=True,
+                progressive=True
+            )
+            if output_dir:
+                entry["path"] = page_image.save(output_dir)
+            entry.update({
+                "image": page_image,
+                "name": page_image.name,
+                "width": pix.width,
+                "height": pix.height,
+                "dpi": round(zoom * 72),
+                "grayscale": grayscale,
+                "cropped": clip != page.rect,
+                "bytes": len(page_image),
+                "tokens": estimate_tokens_by_provider(pix.width, pix.height),
+            })
+            report_pages.append(entry)
+
+        report = _totals(report_pages)
+        logger.info(
+            f"Páginas codificadas: {report['images']}/{len(pages)} {report['kinds']}, "
+            f"{report['pixels'] / 1e6:.1f} Mpx, ~{report['tokens'].get(self.provider, 0)} tokens ({self.provider})"
+        )
+        return report
@@ -0,0 +1,241 @@
+import hashlib
+import logging
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import fitz
+from PIL import Image
+
+from ps3_worker.constants import PAGE_FILTER_RULES, PAGE_FILTER_MAX_DISTANCE
+from ps3_worker.services.layout import CAPTION_PATTERN
+from ps3_worker.services.metrics import PAGES_FILTERED
+
+logger = logging.getLogger(__name__)
+
+FILTER_RULES = ("blank", "duplicate", "references", "acknowledgements")
+
+# Huella perceptual (dHash) de HASH_SIZE x HASH_SIZE bits sobre una miniatura de THUMBNAIL_WIDTH px
+HASH_SIZE = 16
+THUMBNAIL_WIDTH = 96
+# Contraste máximo (0-255) de la miniatura de una página en blanco
+BLANK_MAX_CONTRAST = 12
+BLANK_TEXT_PATTERN = re.compile(r"^\s*(this page (is )?intentionally left blank\.?)?\s*$", re.IGNORECASE)
+# Texto mínimo para comparar páginas por su capa de texto y similitud de palabras de un casi duplicado
+DUPLICATE_MIN_CHARS = 200
+DUPLICATE_MIN_SIMILARITY = 0.9
+
+_HEADING_PREFIX = r"^[ \t]*(?:[0-9IVX]+\.?[ \t]+)?"
+REFERENCES_HEADING = re.compile(
+    _HEADING_PREFIX + r"(references(?: and notes)?|bibliography|literature cited|works cited|cited literature)[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+BOILERPLATE_HEADING = re.compile(
+    _HEADING_PREFIX + r"(acknowledge?ments?|funding(?: information| sources)?|conflicts? of interests?|"
+    r"competing interests?|declaration of competing interests?|author contributions?|"
+    r"data availability(?: statement)?|ethics statement|disclosures?)[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+# Secciones con contenido tras la bibliografía (material suplementario, apéndices...)
+CONTENT_HEADING = re.compile(
+    _HEADING_PREFIX + r"(abstract|introduction|(?:materials and )?methods|results|discussion|conclusions?|"
+    r"appendix\b.*|supplementa(?:l|ry)\b.*)[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+# Indicios de una entrada bibliográfica: numeración, año, "et al.", DOI, volumen(número):páginas
+CITATION_CUE = re.compile(
+    r"^\s*\[?\d{1,3}[\].]\s|\b(19|20)\d{2}[a-z]?\b|\bet al\b|\bdoi\b|\d+\s*\(\d+\)\s*:?\s*\d+|\d+\s*:\s*\d+\s*[-–]\s*\d+",
+    re.IGNORECASE
+)
+# Posición máxima (fracción del texto) del encabezado para considerar que la sección ocupa la página
+SECTION_MAX_OFFSET = 0.2
+REFERENCES_MIN_DENSITY = 0.5
+
+
+def dhash(page: fitz.Page, hash_size: int = HASH_SIZE) -> Dict[str, Any]:
+    """Huella dHash de la página (gradientes horizontales de una miniatura en grises) y su contraste"""
+    zoom = THUMBNAIL_WIDTH / max(page.rect.width, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    thumbnail = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    low, high = thumbnail.getextrema()
+    pixels = list(thumbnail.resize((hash_size + 1, hash_size), Image.Resampling.BOX).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return {"hash": value, "contrast": high - low}
+
+
+def hamming(first: int, second: int) -> int:
+    return bin(first ^ second).count("1")
+
+
+def normalize_text(text: str) -> str:
+    """Texto en minúsculas y sin espacios repetidos ni líneas que solo contienen el número de página"""
+    lines = (line.strip() for line in text.lower().splitlines())
+    return " ".join(" ".join(line.split()) for line in lines if line and not line.isdigit())
+
+
+def _similarity(first: Set[str], second: Set[str]) -> float:
+    union = first | second
+    return len(first & second) / len(union) if union else 1.0
+
+
+def citation_density(text: str) -> float:
+    """Fracción de las líneas con texto que tienen algún indicio de entrada bibliográfica"""
+    lines = [line for line in text.splitlines() if len(line.strip()) > 3]
+    if not lines:
+        return 0.0
+    return sum(bool(CITATION_CUE.search(line)) for line in lines) / len(lines)
+
+
+def detect_section(text: str, in_references: bool) -> Optional[str]:
+    """
+    "references" o "acknowledgements" si la página pertenece por completo a la
+    bibliografía o a las secciones finales (agradecimientos, financiación,
+    conflictos de interés...), o None si tiene contenido del artículo. Una
+    página sin encabezado continúa la bibliografía de la anterior si mantiene
+    la densidad de citas y no empieza otra sección ni tiene tablas o figuras.
+    """
+    stripped = text.strip()
+    if not stripped:
+        return None
+    if CONTENT_HEADING.search(stripped) or any(CAPTION_PATTERN.match(line) for line in stripped.splitlines()):
+        return None
+
+    headings = [(match.start(), "references") for match in REFERENCES_HEADING.finditer(stripped)]
+    headings += [(match.start(), "acknowledgements") for match in BOILERPLATE_HEADING.finditer(stripped)]
+    if headings:
+        start, section = min(headings)
+        if start > SECTION_MAX_OFFSET * len(stripped):
+            return None
+        references = [position for position, kind in headings if kind == "references"]
+        if references and citation_density(stripped[min(references):]) < REFERENCES_MIN_DENSITY:
+            return None
+        return section
+    if in_references and citation_density(stripped) >= REFERENCES_MIN_DENSITY:
+        return "references"
+    return None
+
+
+class PageFilter:
+    """
+    Decide qué páginas no se envían al modelo antes de codificarlas:
+
+    - blank: sin texto y con una miniatura casi uniforme, o con solo "This
+      page intentionally left blank".
+    - duplicate: misma capa de texto que una página anterior, o huella dHash a
+      menos de `max_distance` bits con texto casi igual (o sin texto).
+    - references / acknowledgements: páginas ocupadas por la bibliografía o por
+      las secciones finales del artículo.
+
+    `rules` limita las reglas activas y las decisiones se pueden forzar por
+    página con `keep_pages` y `drop_pages` (numeradas desde 1). Si todas las
+    páginas quedasen descartadas se conservan todas.
+    """
+
+    def __init__(self, rules: Optional[Iterable[str]] = None, max_distance: int = PAGE_FILTER_MAX_DISTANCE):
+        if rules is None:
+            rules = (rule.strip() for rule in PAGE_FILTER_RULES.split(","))
+        self.rules = {rule for rule in rules if rule}
+        unknown = self.rules - set(FILTER_RULES)
+        if unknown:
+            raise ValueError(f"Reglas de filtrado de páginas desconocidas: {sorted(unknown)}")
+        self.max_distance = max_distance
+
+    def _profile(self, page: fitz.Page) -> Dict[str, Any]:
+        text = page.get_text()
+        normalized = normalize_text(text)
+        fingerprint = dhash(page)
+        return {
+            "text": text,
+            "chars": len(normalized),
+            "words": set(normalized.split()),
+            "text_hash": hashlib.sha1(normalized.encode("utf-8")).hexdigest(),
+            "dhash": fingerprint["hash"],
+            "contrast": fingerprint["contrast"],
+        }
+
+    def _duplicate_of(self, profile: Dict[str, Any], kept: List[Dict[str, Any]]) -> Optional[int]:
+        for other in kept:
+            if profile["chars"] >= DUPLICATE_MIN_CHARS and profile["text_hash"] == other["text_hash"]:
+                return other["page"]
+            if hamming(profile["dhash"], other["dhash"]) > self.max_distance:
+                continue
+            if max(profile["chars"], other["chars"]) < DUPLICATE_MIN_CHARS:
+                return other["page"]
+            if _similarity(profile["words"], other["words"]) >= DUPLICATE_MIN_SIMILARITY:
+                return other["page"]
+        return None
+
+    def decide(
+        self,
+        document: fitz.Document,
+        keep_pages: Optional[Iterable[int]] = None,
+        drop_pages: Optional[Iterable[int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Decisión por página: {page, keep, reason, chars, dhash, duplicate_of}"""
+        keep_pages, drop_pages = set(keep_pages or ()), set(drop_pages or ())
+        started = time.perf_counter()
+        decisions: List[Dict[str, Any]] = []
+        kept: List[Dict[str, Any]] = []
+        in_references = False
+
+        for number, page in enumerate(document, start=1):
+            profile = self._profile(page)
+            decision = {
+                "page": number,
+                "keep": True,
+                "reason": "content",
+                "chars": profile["chars"],
+                "dhash": f"{profile['dhash']:0{HASH_SIZE * HASH_SIZE // 4}x}",
+            }
+            section = detect_section(profile["text"], in_references)
+            # Los agradecimientos suelen preceder a la bibliografía en la misma página
+            in_references = section == "references" or (
+                section is not None and REFERENCES_HEADING.search(profile["text"]) is not None
+            )
+            duplicate_of = self._duplicate_of(profile, kept)
+
+            blank = BLANK_TEXT_PATTERN.match(profile["text"]) and (
+                profile["chars"] > 0 or profile["contrast"] <= BLANK_MAX_CONTRAST
+            )
+            if "blank" in self.rules and blank:
+                decision.update(keep=False, reason="blank")
+            elif "duplicate" in self.rules and duplicate_of is not None:
+                decision.update(keep=False, reason="duplicate", duplicate_of=duplicate_of)
+            elif section is not None and section in self.rules:
+                decision.update(keep=False, reason=section)
+
+            if number in keep_pages:
+                decision.update(keep=True, reason="override")
+            elif number in drop_pages:
+                decision.update(keep=False, reason="override")
+            if decision["keep"]:
+                kept.append({**profile, "page": number})
+            decisions.append(decision)
+
+        if decisions and not any(decision["keep"] for decision in decisions):
+            logger.warning("El filtro descartaría todas las páginas; se conservan todas")
+            for decision in decisions:
+                decision.update(keep=True, reason="fallback")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for decision in decisions:
+            if decision["keep"]:
+                logger.debug(f"Página {decision['page']}: se conserva ({decision['reason']})")
+            else:
+                PAGES_FILTERED.inc(reason=decision["reason"])
+                detail = f" de la página {decision['duplicate_of']}" if "duplicate_of" in decision else ""
+                logger.info(f"Página {decision['page']}: descartada ({decision['reason']}{detail})")
+        dropped = sum(not decision["keep"] for decision in decisions)
+        logger.info(
+            f"Filtro de páginas: {dropped}/{len(decisions)} descartadas en {elapsed_ms:.0f} ms "
+            f"({elapsed_ms / max(len(decisions), 1):.1f} ms/página)"
+        )
+        return decisions
+
+
+def skipped_pages(decisions: List[Dict[str, Any]]) -> Set[int]:
+    return {decision["page"] for decision in decisions if not decision["keep"]}
@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from typing import Any, Iterable, List, Optional, Union
+
+
+def get_image_mime_type(file_path: str) -> str:
+    """Detecta el tipo MIME de una imagen basado en su extensión y contenido."""
+    # Intentar detectar por extensión
+    mime_type, _ = mimetypes.guess_type(file_path)
+    
+    if mime_type and mime_type.startswith('image/'):
+        return mime_type
+    
+    # Fallback a tipos comunes basado en extensión
+    ext = file_path.lower().split('.')[-1] if '.' in file_path else ''
+    mime_map = {
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'png': 'image/png',
+        'gif': 'image/gif',
+        'bmp': 'image/bmp',
+        'webp': 'image/webp',
+        'tiff': 'image/tiff',
+        'svg': 'image/svg+xml'
+    }
+    
+    return mime_map.get(ext, 'image/png')  # Fallback a PNG si no se puede determinar
+
+
+class PageImage:
+    """
+    Imagen codificada (JPEG) de una página o recorte, en memoria. La genera el
+    rasterizador y la consumen los clientes LLM sin pasar por disco: los bytes
+    se comparten entre todas las llamadas del documento y el base64 y la data
+    URL se calculan una sola vez, en la primera llamada que los necesita.
+    """
+
+    __slots__ = ("data", "mime_type", "name", "page", "width", "height", "_base64", "_sha256", "_lock")
+
+    def __init__(
+        self,
+        data: Union[bytes, bytearray, memoryview],
+        mime_type: str = "image/jpeg",
+        name: str = "",
+        page: Optional[int] = None,
+        width: int = 0,
+        height: int = 0
+    ):
+        # bytes es inmutable: las llamadas concurrentes pueden compartirlo sin copias
+        self.data = data if isinstance(data, bytes) else bytes(data)
+        self.mime_type = mime_type
+        self.name = name
+        self.page = page
+        self.width = width
+        self.height = height
+        self._base64: Optional[str] = None
+        self._sha256: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pil(cls, image: Any, name: str = "", page: Optional[int] = None, **save_kwargs) -> "PageImage":
+        """Codifica una imagen de PIL en JPEG directamente en memoria"""
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", **save_kwargs)
+        return cls(buffer.getvalue(), name=name, page=page, width=image.width, height=image.height)
+
+    @classmethod
+    def from_path(cls, path: str, page: Optional[int] = None) -> "PageImage":
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls(data, mime_type=get_image_mime_type(path), name=os.path.basename(path), page=page)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"PageImage({self.name or 'sin nombre'}, {self.width}x{self.height}, {len(self.data)} bytes)"
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            with self._lock:
+                if self._base64 is None:
+                    self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    def save(self, directory: str) -> str:
+        """Escribe la imagen en `directory` (depuración, caché) y devuelve su ruta"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name or f"{self.sha256[:16]}.jpg")
+        with open(path, "wb") as f:
+            f.write(self.data)
+        return path
+
+
+ImageInput = Union[str, PageImage]
+
+
+def load_page_images(images: Optional[Iterable[ImageInput]]) -> List[PageImage]:
+    """
+    Imágenes de una llamada como `PageImage`: las que ya lo son se usan tal
+    cual y las rutas se leen de disco (las que no existen se ignoran).
+    """
+    loaded = []
+    for image in images or []:
+        if isinstance(image, PageImage):
+            loaded.append(image)
+        elif os.path.exists(image):
+            loaded.append(PageImage.from_path(image))
+    return loaded
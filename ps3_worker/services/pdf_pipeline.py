@@ -1,132 +1,250 @@
+import asyncio
 import logging
 import os
 import tempfile
 import shutil
-from typing import Tuple, Optional
+import threading
+from typing import Any, Dict, List, Tuple, Optional, Union
 import pandas as pd
+from pydantic import BaseModel
 
+from ps3_worker.constants import (
+    ARTIFACT_CACHE_ENABLED, IMAGE_ENCODER, LAYOUT_MODE, LAYOUT_MAX_TEXT_CHARS, LLM_PROVIDER, LLM_MODEL_NAME, LLM_STREAMING, LLM_VARIANT_CONCURRENCY, MAX_VARIANTS_PER_DOCUMENT,
+    PAGE_FILTER_ENABLED, PAGE_IMAGES_DEBUG_DIR
+)
+from ps3_worker.services.artifact_cache import ArtifactCache, artifact_key, get_artifact_cache
 from ps3_worker.services.doc_managament import DocManagament
+from ps3_worker.services.layout import LAYOUT_VERSION, DocumentLayout, analyze_layout, load_layout
 from ps3_worker.services.odds_path_calculator import OddsPathCalculator
+from ps3_worker.services.page_encoder import ENCODER_VERSION, PageEncoder
+from ps3_worker.services.page_filter import PageFilter
+from ps3_worker.services.page_image import ImageInput
+from ps3_worker.services.variant_normalizer import VariantIndex
 from ps3_worker.services.vllm_client import LLMProvider, VLLMChatClient
 from ps3_worker.prompts.extract_variants_prompt import variants_prompt
 from ps3_worker.prompts.first_extraction_prompt import first_extraction_prompt
-from ps3_shared.entities.gene_variant import FunctionalVariants
+from ps3_worker.prompts.region_context_prompt import region_context_prompt
+from ps3_shared.entities.gene_variant import FunctionalVariants, GeneVariant
 from ps3_shared.entities.research_data import ResearchData
+from ps3_worker.errors import PermanentTaskError, TransientTaskError
+from ps3_worker.services.metrics import VARIANTS_DEDUPLICATED, VARIANTS_PER_DOCUMENT
 from ps3_worker.services.sse_service import sse_service
+from ps3_worker.services.task_state_writer import task_state_writer
+from ps3_worker.services.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# Marca de fin de la lista de variantes en la cola del productor
+_END_OF_VARIANTS = object()
+# Espera máxima al hilo productor tras una parada anticipada; una llamada sin
+# streaming no se puede interrumpir y termina en segundo plano
+PRODUCER_STOP_TIMEOUT_S = 5.0
+
+
+def _split_field(field: Any) -> Tuple[Any, Any]:
+    """Valor y explicación de un campo extraído ({value, explanation})"""
+    if isinstance(field, BaseModel):
+        value = getattr(field, "value", None)
+        explanation = getattr(field, "explanation", None)
+    elif isinstance(field, dict):
+        value, explanation = field.get("value"), field.get("explanation")
+    else:
+        return field, None
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    return value, explanation
+
+
+def build_result_frames(records: List[BaseModel]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Construye por columnas, en una sola pasada y sin `model_dump`, el DataFrame
+    de valores y el de explicaciones de los registros extraídos.
+    """
+    if not records:
+        return pd.DataFrame(), pd.DataFrame()
+
+    field_names = list(type(records[0]).model_fields)
+    values: Dict[str, List[Any]] = {name: [] for name in field_names}
+    explanations: Dict[str, List[Any]] = {name: [] for name in field_names}
+    for record in records:
+        for name in field_names:
+            value, explanation = _split_field(getattr(record, name, None))
+            values[name].append(value)
+            explanations[name].append(explanation)
+
+    return pd.DataFrame(values, columns=field_names), pd.DataFrame(explanations, columns=field_names)
+
 
 class PDFPipeline:
     """Pipeline para procesar PDFs y extraer datos"""
     
-    def __init__(self):
-        self.vllm_client = VLLMChatClient(
-            provider=LLMProvider.openai, 
-            model_name='gpt-5'
+    def __init__(
+        self,
+        vllm_client: Optional[VLLMChatClient] = None,
+        image_encoder: str = IMAGE_ENCODER,
+        layout_mode: str = LAYOUT_MODE,
+        page_filter: Optional[PageFilter] = None,
+        artifact_cache: Optional[ArtifactCache] = None,
+        cache_artifacts: bool = ARTIFACT_CACHE_ENABLED,
+        variant_concurrency: int = LLM_VARIANT_CONCURRENCY
+    ):
+        self.vllm_client = vllm_client or VLLMChatClient(
+            provider=LLMProvider(LLM_PROVIDER), 
+            model_name=LLM_MODEL_NAME
         )
+        self.image_encoder = image_encoder
+        self.layout_mode = layout_mode
+        self.page_filter = page_filter or (PageFilter() if PAGE_FILTER_ENABLED else None)
+        # Imágenes, texto y regiones de cada PDF reutilizables entre tareas y reintentos
+        self.artifact_cache = (artifact_cache or get_artifact_cache()) if cache_artifacts else None
+        # Extracciones por variante simultáneas de cada documento
+        self.variant_concurrency = max(1, variant_concurrency)
     
-    async def extract_data_from_pdf(self, pdf_path: str, output_path: str, task_id: str = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    async def extract_data_from_pdf(
+        self,
+        pdf_source: Union[str, bytes],
+        output_path: str,
+        task_id: str = None,
+        filename: Optional[str] = None,
+        keep_pages: Optional[List[int]] = None,
+        drop_pages: Optional[List[int]] = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """
         Extrae datos de un PDF y retorna dos DataFrames:
         1. DataFrame con los datos de odds path calculados
         2. DataFrame con las explicaciones
+        
+        `pdf_source` puede ser la ruta del PDF o su contenido en memoria; en el
+        segundo caso `filename` se usa para obtener el DOI. `keep_pages` y
+        `drop_pages` fuerzan la decisión del filtro de páginas.
         """
+        pdf_path = filename or (pdf_source if isinstance(pdf_source, str) else "documento.pdf")
         try:
             logger.info(f"Iniciando procesamiento de PDF: {pdf_path}")
             
             if task_id:
-                await sse_service.send_progress_event(task_id, "init", 0, "Iniciando procesamiento del PDF")
+                await self._report_progress(task_id, "init", 0, "Iniciando procesamiento del PDF")
             
             # Convertir PDF a imágenes
             if task_id:
-                await sse_service.send_progress_event(task_id, "conversion", 10, "Convirtiendo PDF a imágenes")
+                await self._report_progress(task_id, "conversion", 10, "Convirtiendo PDF a imágenes")
             
-            conversor_pdf = DocManagament(pdf_path)
-            conversor_pdf.to_jpgs(output_dir=output_path)
+            with tracer.span("rasterize", encoder=self.image_encoder) as span:
+                conversor_pdf = DocManagament(pdf_source, artifact_cache=self.artifact_cache)
+                skip_pages = set()
+                if self.page_filter is not None or keep_pages or drop_pages:
+                    with tracer.span("page_filter") as filter_span:
+                        skip_pages = conversor_pdf.filter_pages(
+                            self.page_filter or PageFilter(rules=()), keep_pages, drop_pages
+                        )
+                        if filter_span is not None:
+                            self._record_page_decisions(filter_span, conversor_pdf.page_decisions)
+                # Las páginas se quedan en memoria; solo se escriben en disco para depurar
+                debug_dir = (
+                    os.path.join(PAGE_IMAGES_DEBUG_DIR, conversor_pdf.pdf_hash) if PAGE_IMAGES_DEBUG_DIR else None
+                )
+                if self.image_encoder == "adaptive":
+                    encoder = PageEncoder(provider=self.vllm_client.provider.value)
+                    pages_key = artifact_key(
+                        "pages-adaptive", version=ENCODER_VERSION, provider=encoder.provider,
+                        pixel_budget=encoder.pixel_budget, token_budget=encoder.token_budget,
+                        policies=encoder.policies, skip_pages=sorted(skip_pages)
+                    )
+                    cached = conversor_pdf.load_or_render_pages(
+                        pages_key,
+                        lambda: conversor_pdf.to_adaptive_jpgs(encoder=encoder, skip_pages=skip_pages),
+                        output_dir=debug_dir
+                    )
+                else:
+                    cached = conversor_pdf.load_or_render_pages(
+                        artifact_key("pages-fixed", version=ENCODER_VERSION, skip_pages=sorted(skip_pages)),
+                        lambda: conversor_pdf.to_jpgs(skip_pages=skip_pages),
+                        output_dir=debug_dir
+                    )
+                if span is not None:
+                    span.set_attributes(
+                        pages=conversor_pdf.n_pages or 0,
+                        cached=cached,
+                        image_bytes=sum(len(image) for image in conversor_pdf.page_images)
+                    )
+                    report = conversor_pdf.encoding_report
+                    if report:
+                        span.set_attributes(
+                            images=report["images"],
+                            megapixels=round(report["pixels"] / 1e6, 2),
+                            image_tokens=report["tokens"].get(self.vllm_client.provider.value),
+                            **{f"pages_{kind}": count for kind, count in report["kinds"].items()}
+                        )
             
-            if task_id:
-                await sse_service.send_progress_event(task_id, "conversion", 20, f"PDF convertido a {conversor_pdf.n_pages} imágenes")
+            if not conversor_pdf.n_pages:
+                raise PermanentTaskError(f"No se pudo convertir el PDF a imágenes: {pdf_path}", reason="invalid_pdf")
             
-            final_data = []
+            if task_id:
+                await self._report_progress(task_id, "conversion", 20, f"PDF convertido a {conversor_pdf.n_pages} imágenes")
             
             # Extraer DOI del nombre del archivo
             doi = pdf_path.split('/')[-1].replace("-", "/", 1).replace(".pdf", "")
+            # Las páginas en blanco y las descartadas por el filtro no se codifican
+            page_images = conversor_pdf.page_images
             
-            if task_id:
-                await sse_service.send_progress_event(task_id, "extraction", 30, "Extrayendo variantes funcionales")
-            
-            # Extraer variantes funcionales
-            variants_extraction = self.vllm_client.send_message(
-                prompt_text=variants_prompt,
-                image_paths=[f'{output_path}/page_{i}.jpg' for i in range(1, conversor_pdf.n_pages)],
-                model=FunctionalVariants,
-                retries=2
-            )
-            
-            if len(variants_extraction.data) == 0 or len(variants_extraction.data) > 20:
-                logger.warning(f"PDF {pdf_path}: No se encontraron variantes o demasiadas variantes")
-                if task_id:
-                    await sse_service.send_error_event(task_id, "No se encontraron variantes", f"Se encontraron {len(variants_extraction.data)} variantes")
-                return pd.DataFrame(), pd.DataFrame()
+            # Tablas y figuras recortadas para las llamadas por variante
+            layout = None
+            if self.layout_mode == "regions":
+                with tracer.span("layout") as span:
+                    def build_layout(directory: str) -> bool:
+                        document = conversor_pdf.open_document()
+                        try:
+                            analyze_layout(document, directory)
+                        finally:
+                            document.close()
+                        return True
+
+                    layout_dir = os.path.join(output_path, "layout")
+                    cached = False
+                    if self.artifact_cache is not None:
+                        cached = self.artifact_cache.materialize(
+                            conversor_pdf.pdf_hash, f"layout-v{LAYOUT_VERSION}", layout_dir, build_layout
+                        )
+                    else:
+                        build_layout(layout_dir)
+                    layout = load_layout(layout_dir) or DocumentLayout([])
+                    if span is not None:
+                        span.set_attributes(regions=len(layout), cached=cached)
             
             if task_id:
-                await sse_service.send_progress_event(task_id, "extraction", 40, f"Variantes extraídas: {len(variants_extraction.data)}")
+                await self._report_progress(task_id, "extraction", 30, "Extrayendo variantes funcionales")
             
-            # Procesar cada variante
-            total_variants = len(variants_extraction.data)
-            for i, variant in enumerate(variants_extraction.data):
-                if task_id:
-                    progress = 40 + int((i / total_variants) * 40)
-                    await sse_service.send_progress_event(task_id, "processing", progress, f"Procesando variante {i+1}/{total_variants}")
-                
-                first_extraction = self.vllm_client.send_message(
-                    prompt_text=first_extraction_prompt.format(**variant.model_dump()),
-                    image_paths=[f'{output_path}/page_{i}.jpg' for i in range(1, conversor_pdf.n_pages)],
-                    model=ResearchData,
-                    retries=2
-                )
-                
-                final_data.append(first_extraction.data)
+            # Extraer las variantes funcionales y los datos de cada variante
+            final_data, variant_aliases = await self._extract_records(
+                page_images, task_id, pdf_path, layout=layout, document_text=conversor_pdf.raw_text or ""
+            )
+            total_variants = len(final_data)
             
             if task_id:
-                await sse_service.send_progress_event(task_id, "calculation", 80, "Calculando odds path")
+                await self._report_progress(task_id, "calculation", 80, "Calculando odds path")
             
-            # Crear DataFrame con los valores extraídos
-            valid_values = []
-            for doc in final_data:
-                values = {
-                    key: value['value'] for key, value in doc.model_dump().items()
-                }
-                valid_values.append(values)
-            
-            df_extraction = pd.DataFrame(valid_values)
+            # Crear los DataFrames de valores y explicaciones en una sola pasada
+            df_extraction, df_explanations = build_result_frames(final_data)
             df_extraction['doi'] = doi
+            # Grafías con las que el artículo menciona cada variante extraída
+            df_extraction['variant_aliases'] = variant_aliases
             
             # Calcular odds path
-            calculator = OddsPathCalculator(df_extraction)
-            df_odds_path = calculator.calculate()
+            with tracer.span("odds_path", rows=len(df_extraction)):
+                calculator = OddsPathCalculator(df_extraction)
+                df_odds_path = calculator.calculate()
             
             if task_id:
-                await sse_service.send_progress_event(task_id, "finalization", 90, "Generando explicaciones")
-            
-            # Crear DataFrame con las explicaciones
-            explanation_values = []
-            for doc in final_data:
-                explanations = {
-                    key: value['explanation'] for key, value in doc.model_dump().items()
-                }
-                explanation_values.append(explanations)
+                await self._report_progress(task_id, "finalization", 90, "Generando explicaciones")
             
-            df_explanations = pd.DataFrame(explanation_values)
             df_explanations['doi'] = doi
             
             if task_id:
-                await sse_service.send_progress_event(task_id, "completed", 100, "Procesamiento completado exitosamente")
+                await self._report_progress(task_id, "completed", 100, "Procesamiento completado exitosamente")
                 await sse_service.send_completion_event(task_id, {
                     "odds_path_records": len(df_odds_path),
                     "explanations_records": len(df_explanations),
-                    "total_variants": len(variants_extraction.data)
+                    "total_variants": total_variants
                 })
             
             logger.info(f"PDF {pdf_path} procesado exitosamente. Datos extraídos: {len(df_extraction)} registros")
@@ -135,7 +253,7 @@ class PDFPipeline:
             
         except Exception as e:
             logger.error(f"Error procesando {pdf_path}: {e}")
-            return pd.DataFrame(), pd.DataFrame()
+            raise
         finally:
             # Limpiar directorio temporal
             try:
@@ -145,6 +263,226 @@ class PDFPipeline:
             except Exception as e:
                 logger.error(f"Error al limpiar directorio temporal {output_path}: {e}")
     
+    def _variant_request(
+        self,
+        variant: GeneVariant,
+        page_images: List[ImageInput],
+        layout: Optional[DocumentLayout],
+        document_text: str
+    ) -> Tuple[str, List[ImageInput]]:
+        """Prompt e imágenes de la extracción de una variante"""
+        prompt_text = first_extraction_prompt.format(**variant.model_dump())
+        if not layout:
+            return prompt_text, page_images
+        
+        # Con regiones: el texto del artículo y solo los recortes relevantes para la variante
+        regions = layout.select(variant.gene, variant.variant)
+        descriptions = "\n".join(
+            f"{i}. {region['label']} (page {region['page']}): {region['caption'] or region['kind']}"
+            for i, region in enumerate(regions, start=1)
+        )
+        prompt_text += region_context_prompt.format(
+            regions=descriptions, text=document_text[:LAYOUT_MAX_TEXT_CHARS]
+        )
+        return prompt_text, [region["path"] for region in regions]
+    
+    async def _extract_records(
+        self,
+        page_images: List[ImageInput],
+        task_id: Optional[str],
+        pdf_path: str,
+        layout: Optional[DocumentLayout] = None,
+        document_text: str = ""
+    ) -> Tuple[List[Any], List[List[str]]]:
+        """
+        Extrae las variantes funcionales y, para cada una, sus datos (en el orden
+        de las variantes) y las grafías con que aparece. Las páginas llegan
+        codificadas en memoria y se comparten entre todas las llamadas. Con
+        `layout`, las llamadas por variante reciben el texto del artículo y los
+        recortes de tablas y figuras en lugar de las páginas.
+
+        Las variantes repetidas con otra grafía (R123C y p.Arg123Cys, HERG y
+        KCNH2...) se agrupan con `VariantIndex` al llegar y solo se extrae la
+        primera; el límite MAX_VARIANTS_PER_DOCUMENT cuenta variantes únicas.
+
+        Con LLM_STREAMING las variantes se leen del stream del modelo y la
+        extracción de cada una empieza en cuanto llega, con hasta
+        `variant_concurrency` extracciones a la vez. Si el modelo emite más de
+        MAX_VARIANTS_PER_DOCUMENT variantes se cancela el stream sin esperar al
+        resto de la respuesta.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.variant_concurrency)
+        stop = threading.Event()
+        tasks: List[asyncio.Task] = []
+        groups: List[int] = []
+        index = VariantIndex()
+        # `total` solo se conoce al llegar el fin de la lista de variantes
+        state = {"completed": 0, "progress": 40, "total": 0}
+
+        def publish(item: Any):
+            # Tras una parada el consumidor ya no lee la cola y el bucle puede estar cerrado
+            if stop.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                stop.set()
+
+        def produce():
+            received = 0
+            # El consumidor activa `stop` al superar el límite de variantes únicas o al terminar
+            try:
+                if LLM_STREAMING:
+                    try:
+                        stream = self.vllm_client.stream_items(
+                            prompt_text=variants_prompt,
+                            image_paths=page_images,
+                            model=FunctionalVariants
+                        )
+                        try:
+                            for item in stream:
+                                publish(GeneVariant.model_validate(item))
+                                received += 1
+                                if stop.is_set():
+                                    break
+                        finally:
+                            stream.close()
+                        publish(_END_OF_VARIANTS)
+                        return
+                    except Exception as e:
+                        if received:
+                            publish(TransientTaskError(
+                                f"El stream de variantes se interrumpió tras {received} variantes: {e}",
+                                reason="llm_unavailable"
+                            ))
+                            return
+                        logger.warning(f"PDF {pdf_path}: fallo en el stream de variantes, se repite sin streaming: {e}")
+
+                if stop.is_set():
+                    return
+                variants_extraction = self.vllm_client.send_message(
+                    prompt_text=variants_prompt,
+                    image_paths=page_images,
+                    model=FunctionalVariants,
+                    retries=2
+                )
+                for variant in variants_extraction.data:
+                    publish(variant)
+                publish(_END_OF_VARIANTS)
+            except Exception as e:
+                publish(e)
+
+        async def extract(variant: GeneVariant) -> Any:
+            prompt_text, variant_images = self._variant_request(variant, page_images, layout, document_text)
+            async with semaphore:
+                first_extraction = await asyncio.to_thread(
+                    self.vllm_client.send_message,
+                    prompt_text=prompt_text,
+                    image_paths=variant_images,
+                    model=ResearchData,
+                    retries=2
+                )
+
+            state["completed"] += 1
+            # Mientras llegan variantes el total aún crece: el progreso se publica cuando se conoce
+            if task_id and state["total"]:
+                advance_progress()
+                await self._report_progress(
+                    task_id, "processing", state["progress"],
+                    f"Variante procesada {state['completed']}/{state['total']}"
+                )
+            return first_extraction.data
+
+        def advance_progress():
+            state["progress"] = max(state["progress"], 40 + int(state["completed"] / state["total"] * 40))
+
+        # asyncio.to_thread copia el contexto, así que las trazas del productor cuelgan de la tarea
+        producer = asyncio.ensure_future(asyncio.to_thread(produce))
+        variants = 0
+        duplicates = 0
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END_OF_VARIANTS:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                group, is_new = index.add(item.gene, item.variant)
+                if not is_new:
+                    duplicates += 1
+                    logger.info(f"PDF {pdf_path}: {item.gene} {item.variant} repetida, se reutiliza su extracción")
+                    continue
+                variants += 1
+                if variants > MAX_VARIANTS_PER_DOCUMENT:
+                    stop.set()
+                    break
+                groups.append(group)
+                tasks.append(asyncio.create_task(extract(item)))
+            
+            VARIANTS_PER_DOCUMENT.observe(variants)
+            if duplicates:
+                VARIANTS_DEDUPLICATED.inc(duplicates)
+            if variants == 0 or variants > MAX_VARIANTS_PER_DOCUMENT:
+                found = f"más de {MAX_VARIANTS_PER_DOCUMENT}" if variants else "0"
+                logger.warning(f"PDF {pdf_path}: No se encontraron variantes o demasiadas variantes")
+                if task_id:
+                    await sse_service.send_error_event(task_id, "No se encontraron variantes", f"Se encontraron {found} variantes")
+                raise PermanentTaskError(f"Número de variantes no válido: {found}", reason="variant_count")
+            
+            state["total"] = variants
+            if task_id:
+                advance_progress()
+                await self._report_progress(
+                    task_id, "extraction", state["progress"], f"Variantes extraídas: {variants}"
+                )
+            
+            results = await asyncio.gather(*tasks)
+            records, aliases = [], []
+            for group, record in zip(groups, results):
+                # Una grafía posterior (c.367C>T (p.Arg123Cys)) puede unir dos variantes ya extraídas
+                if index.find(group) != group:
+                    VARIANTS_DEDUPLICATED.inc()
+                    logger.info(f"PDF {pdf_path}: se descarta la extracción repetida de {index.aliases(group)}")
+                    continue
+                records.append(record)
+                aliases.append(index.aliases(group))
+            return records, aliases
+        finally:
+            # Parar el stream y descartar las extracciones pendientes si algo falla
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            try:
+                await asyncio.wait_for(asyncio.shield(producer), PRODUCER_STOP_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                logger.warning(f"PDF {pdf_path}: el productor de variantes sigue en curso tras la parada")
+                # Recoger su resultado cuando termine para que no quede una excepción sin leer
+                producer.add_done_callback(lambda future: future.cancelled() or future.exception())
+            except Exception:
+                # Los fallos del productor ya llegaron por la cola
+                pass
+    
+    @staticmethod
+    def _record_page_decisions(span, decisions: List[Dict[str, Any]]):
+        """Páginas descartadas por motivo y detalle compacto ("3:duplicate,12:references") en el span"""
+        dropped = [decision for decision in decisions if not decision["keep"]]
+        reasons: Dict[str, int] = {}
+        for decision in dropped:
+            reasons[decision["reason"]] = reasons.get(decision["reason"], 0) + 1
+        span.set_attributes(
+            pages=len(decisions),
+            dropped=len(dropped),
+            dropped_pages=",".join(f"{decision['page']}:{decision['reason']}" for decision in dropped),
+            **{f"dropped_{reason}": count for reason, count in reasons.items()}
+        )
+
+    async def _report_progress(self, task_id: str, stage: str, progress: int, message: str):
+        """Notificar el progreso por SSE y encolarlo para MongoDB"""
+        await sse_service.send_progress_event(task_id, stage, progress, message)
+        task_state_writer.progress(task_id, stage, progress, message)
+    
     def close(self):
         """Cerrar conexiones"""
         try:
@@ -0,0 +1,325 @@
+import json
+import logging
+import re
+import typing
+import uuid
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from ps3_shared.entities.research_data import ResearchData
+from ps3_worker.constants import (
+    MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_SECURE,
+    MINIO_BUCKET_PARQUETS, PARQUET_DATASET_PREFIX, PARQUET_DATASET_COMPACT_MIN_FILES,
+    PARQUET_DATASET_ROW_GROUP_SIZE
+)
+from ps3_worker.services.variant_normalizer import normalize_gene
+
+logger = logging.getLogger(__name__)
+
+# Columnas de partición (estilo Hive: gene_partition=MYH7/ingest_date=2024-01-01/)
+PARTITION_SCHEMA = pa.schema([
+    ("gene_partition", pa.string()),
+    ("ingest_date", pa.string()),
+])
+
+ODDS_PATH_COLUMNS = [
+    ("odds_path", pa.float64()),
+    ("category", pa.string()),
+]
+
+METADATA_COLUMNS = [
+    ("task_id", pa.string()),
+    # Identificador de cada escritura: distingue las filas de un reintento de las del intento anterior
+    ("write_id", pa.string()),
+    ("content_hash", pa.string()),
+    ("source_doi", pa.string()),
+    ("variant_aliases", pa.string()),
+]
+
+
+def _value_arrow_type(field_info) -> pa.DataType:
+    """Tipo Arrow del `value` de un campo del registro (string si no se puede inferir)"""
+    value_field = getattr(field_info.annotation, "model_fields", {}).get("value")
+    if value_field is None:
+        return pa.string()
+
+    annotation = value_field.annotation
+    candidates = typing.get_args(annotation) or (annotation,)
+    candidates = [candidate for candidate in candidates if candidate is not type(None)]
+    if candidates == [bool]:
+        return pa.bool_()
+    if candidates == [int]:
+        return pa.int64()
+    if candidates and all(candidate in (int, float) for candidate in candidates):
+        return pa.float64()
+    return pa.string()
+
+
+def research_record_fields() -> Dict[str, Any]:
+    """Campos de cada registro extraído: el modelo anidado en `ResearchData.data`"""
+    data_field = ResearchData.model_fields.get("data")
+    record_fields = getattr(data_field.annotation, "model_fields", None) if data_field else None
+    return record_fields or ResearchData.model_fields
+
+
+RECORD_FIELDS = research_record_fields()
+
+
+def build_research_schema() -> pa.Schema:
+    """
+    Esquema estable del dataset: un valor y una explicación por cada campo del
+    registro de ResearchData, los resultados del odds path y metadatos de la tarea.
+    """
+    value_fields = []
+    explanation_fields = []
+    for name, field_info in RECORD_FIELDS.items():
+        value_fields.append(pa.field(name, _value_arrow_type(field_info)))
+        explanation_fields.append(pa.field(f"{name}_explanation", pa.string()))
+
+    return pa.schema(
+        value_fields
+        + [pa.field(name, arrow_type) for name, arrow_type in ODDS_PATH_COLUMNS]
+        + explanation_fields
+        + [pa.field(name, arrow_type) for name, arrow_type in METADATA_COLUMNS]
+        + list(PARTITION_SCHEMA)
+    )
+
+
+RESEARCH_SCHEMA = build_research_schema()
+
+# Esquema de cada archivo: las columnas de partición solo viven en la ruta
+FILE_SCHEMA = pa.schema([field for field in RESEARCH_SCHEMA if field.name not in PARTITION_SCHEMA.names])
+
+
+def _to_str(value: Any) -> Optional[str]:
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "yes", "sí", "si"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "no"):
+        return False
+    return None
+
+
+def _coerce(series: pd.Series, arrow_type: pa.DataType) -> pd.Series:
+    """Convierte una columna al tipo del esquema; los valores no convertibles pasan a nulo"""
+    if pa.types.is_integer(arrow_type):
+        return pd.to_numeric(series, errors="coerce").round().astype("Int64")
+    if pa.types.is_floating(arrow_type):
+        return pd.to_numeric(series, errors="coerce").astype("float64")
+    if pa.types.is_boolean(arrow_type):
+        return series.map(_to_bool).astype("boolean")
+    return series.map(_to_str).astype(object)
+
+
+def gene_partition_value(gene: Any) -> str:
+    """Normaliza el símbolo del gen para usarlo como nombre de partición"""
+    text = re.sub(r"[^A-Za-z0-9_.-]", "_", normalize_gene(str(gene or "")))
+    return text or "UNKNOWN"
+
+
+class ResearchDatasetWriter:
+    """
+    Escribe los resultados de todas las tareas en un único dataset parquet
+    particionado por gen y fecha de ingesta, con estadísticas por row group.
+
+    Las consultas por gen podan particiones en lugar de recorrer todos los archivos:
+
+        dataset = ResearchDatasetWriter().dataset()
+        dataset.to_table(filter=ds.field("gene_partition") == "MYH7")
+    """
+
+    def __init__(self, filesystem: Optional[pafs.FileSystem] = None, root: Optional[str] = None):
+        self.filesystem = filesystem or pafs.S3FileSystem(
+            access_key=MINIO_ACCESS_KEY,
+            secret_key=MINIO_SECRET_KEY,
+            endpoint_override=MINIO_ENDPOINT,
+            scheme="https" if MINIO_SECURE else "http"
+        )
+        self.root = root or f"{MINIO_BUCKET_PARQUETS}/{PARQUET_DATASET_PREFIX}"
+        self.partitioning = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+        self.file_format = ds.ParquetFileFormat()
+
+    def build_table(
+        self,
+        df_odds_path: pd.DataFrame,
+        df_explanations: pd.DataFrame,
+        task_id: str,
+        content_hash: Optional[str] = None,
+        ingest_date: Optional[date] = None,
+        write_id: Optional[str] = None
+    ) -> pa.Table:
+        """Combina los DataFrames de valores y explicaciones en una tabla con el esquema estable"""
+        n_rows = max(len(df_odds_path), len(df_explanations))
+        columns: Dict[str, pd.Series] = {}
+
+        for field in RESEARCH_SCHEMA:
+            name = field.name
+            if name.endswith("_explanation") and name[:-len("_explanation")] in RECORD_FIELDS:
+                source = df_explanations.get(name[:-len("_explanation")])
+            else:
+                source = df_odds_path.get(name)
+
+            if source is None:
+                source = pd.Series([None] * n_rows)
+            columns[name] = _coerce(source.reset_index(drop=True), field.type)
+
+        frame = pd.DataFrame(columns)
+        frame["task_id"] = task_id
+        frame["write_id"] = write_id
+        frame["content_hash"] = content_hash
+        frame["source_doi"] = df_odds_path["doi"].reset_index(drop=True).map(_to_str) if "doi" in df_odds_path else None
+        frame["gene_partition"] = frame["gene"].map(gene_partition_value) if "gene" in frame else "UNKNOWN"
+        frame["ingest_date"] = (ingest_date or date.today()).isoformat()
+
+        return pa.Table.from_pandas(frame, schema=RESEARCH_SCHEMA, preserve_index=False)
+
+    def append(self, table: pa.Table, task_id: str) -> List[str]:
+        """Añade la tabla al dataset como archivos nuevos; devuelve las rutas escritas"""
+        written_paths: List[str] = []
+        ds.write_dataset(
+            table,
+            self.root,
+            format=self.file_format,
+            partitioning=self.partitioning,
+            filesystem=self.filesystem,
+            basename_template=f"part-{task_id}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=self.file_format.make_write_options(compression="zstd", write_statistics=True),
+            max_rows_per_group=PARQUET_DATASET_ROW_GROUP_SIZE,
+            file_visitor=lambda written_file: written_paths.append(written_file.path)
+        )
+        logger.info(f"Resultados de la tarea {task_id} añadidos al dataset: {written_paths}")
+        return written_paths
+
+    def write_task_results(
+        self,
+        df_odds_path: pd.DataFrame,
+        df_explanations: pd.DataFrame,
+        task_id: str,
+        content_hash: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Construye la tabla de una tarea, la añade al dataset y devuelve su referencia.
+
+        Si la tarea se reintenta después de escribir (fallo al marcarla completada),
+        las filas del intento anterior pueden seguir en el dataset: en otra fecha de
+        ingesta, en otros genes o ya compactadas. Cada escritura lleva su `write_id`
+        y la referencia filtra por él, así que solo selecciona las filas de la última.
+        """
+        write_id = uuid.uuid4().hex
+        table = self.build_table(df_odds_path, df_explanations, task_id, content_hash, write_id=write_id)
+        self.append(table, task_id)
+        return self.task_reference(task_id, write_id)
+
+    def task_reference(self, task_id: str, write_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Referencia a las filas de una tarea: la raíz del dataset y un filtro por
+        `task_id` (y `write_id`). A diferencia de las rutas de los archivos, sigue
+        siendo válida después de compactar la partición.
+        """
+        # Raíz relativa al bucket, igual que las rutas de los parquets por tarea
+        bucket_prefix = f"{MINIO_BUCKET_PARQUETS}/"
+        root = self.root[len(bucket_prefix):] if self.root.startswith(bucket_prefix) else self.root
+        row_filter = {"task_id": task_id}
+        if write_id:
+            row_filter["write_id"] = write_id
+        return {"root": root, "filter": row_filter}
+
+    def read_reference(self, reference: Dict[str, Any]) -> pa.Table:
+        """Filas de este dataset que selecciona una referencia de `task_reference`"""
+        expression = None
+        for column, value in reference["filter"].items():
+            condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+        return self.dataset().to_table(filter=expression)
+
+    def dataset(self) -> ds.Dataset:
+        """Dataset completo para consultas con poda de particiones"""
+        return ds.dataset(
+            self.root,
+            schema=RESEARCH_SCHEMA,
+            format=self.file_format,
+            partitioning=self.partitioning,
+            filesystem=self.filesystem
+        )
+
+    def _partition_dirs(self) -> List[str]:
+        """Directorios hoja (gene_partition=X/ingest_date=Y) del dataset"""
+        selector = pafs.FileSelector(self.root, recursive=True, allow_not_found=True)
+        return sorted({
+            info.path.rsplit("/", 1)[0]
+            for info in self.filesystem.get_file_info(selector)
+            if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+        })
+
+    def compact_partition(self, partition_dir: str, min_files: int = PARQUET_DATASET_COMPACT_MIN_FILES) -> Optional[str]:
+        """
+        Reescribe los archivos pequeños de una partición en uno solo con row groups
+        grandes. El archivo nuevo se escribe antes de borrar los originales: un lector
+        concurrente no ve la partición vacía, pero entre la escritura y los borrados
+        puede leer filas duplicadas. Las tareas guardan una referencia por `task_id`
+        (`task_reference`) y no las rutas de los archivos, así que siguen siendo válidas.
+        """
+        selector = pafs.FileSelector(partition_dir, allow_not_found=True)
+        files = sorted(
+            info.path for info in self.filesystem.get_file_info(selector)
+            if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+        )
+        if len(files) < min_files:
+            return None
+
+        table = ds.dataset(
+            files,
+            schema=FILE_SCHEMA,
+            format=self.file_format,
+            filesystem=self.filesystem
+        ).to_table()
+
+        compacted_path = f"{partition_dir}/compacted-{uuid.uuid4().hex}.parquet"
+        with self.filesystem.open_output_stream(compacted_path) as sink:
+            pq.write_table(
+                table,
+                sink,
+                row_group_size=PARQUET_DATASET_ROW_GROUP_SIZE,
+                compression="zstd",
+                write_statistics=True
+            )
+
+        for path in files:
+            self.filesystem.delete_file(path)
+
+        logger.info(f"Partición compactada: {len(files)} archivos -> {compacted_path}")
+        return compacted_path
+
+    def compact(self, min_files: int = PARQUET_DATASET_COMPACT_MIN_FILES) -> List[str]:
+        """Compacta todas las particiones con al menos `min_files` archivos"""
+        compacted = []
+        for partition_dir in self._partition_dirs():
+            try:
+                compacted_path = self.compact_partition(partition_dir, min_files)
+                if compacted_path:
+                    compacted.append(compacted_path)
+            except Exception as e:
+                logger.error(f"Error al compactar la partición {partition_dir}: {e}")
+        return compacted
+
+
+if __name__ == "__main__":
+    # Compactación periódica (cron o job de mantenimiento), fuera del camino de los workers
+    logging.basicConfig(level=logging.INFO)
+    ResearchDatasetWriter().compact()
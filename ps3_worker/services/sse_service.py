@@ -1,55 +1,187 @@
+import atexit
 import logging
 import json
 import asyncio
-from typing import Dict, Any, Optional
+import itertools
+import time
+from collections import deque
+from typing import Deque, Dict, Any, List, Optional, Set
 from datetime import datetime
 
+from ps3_worker.constants import (
+    SSE_TRANSPORT, SSE_HISTORY_MAXLEN, SSE_HISTORY_TTL, SSE_IDLE_TTL, SSE_QUEUE_MAXSIZE
+)
+from ps3_worker.services.event_transport import TERMINAL_EVENTS, EventPublisher, build_event_publisher
+
 logger = logging.getLogger(__name__)
 
 
+class EventQueue:
+    """
+    Cola acotada de eventos para un suscriptor SSE.
+
+    `put_nowait` nunca bloquea al productor: un `progress` que llega justo detrás
+    de otro `progress` pendiente lo sustituye, y si la cola está llena se descarta
+    el evento no terminal más antiguo. Los eventos terminales nunca se descartan.
+    """
+
+    def __init__(self, maxsize: int = SSE_QUEUE_MAXSIZE):
+        self.maxsize = maxsize
+        # Cada elemento es una caja [evento] para poder sustituir el progreso pendiente en O(1)
+        self._events: Deque[List[Dict[str, Any]]] = deque()
+        self._progress_box: Optional[List[Dict[str, Any]]] = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def qsize(self) -> int:
+        return len(self._events)
+
+    def empty(self) -> bool:
+        return not self._events
+
+    def put_nowait(self, event: Dict[str, Any]):
+        if event["event"] == "progress" and self._events and self._events[-1] is self._progress_box:
+            self._progress_box[0] = event
+            self.coalesced += 1
+            return
+
+        if len(self._events) >= self.maxsize:
+            self._drop_oldest()
+
+        box = [event]
+        self._events.append(box)
+        if event["event"] == "progress":
+            self._progress_box = box
+        self._ready.set()
+
+    def _drop_oldest(self):
+        for index, box in enumerate(self._events):
+            if box[0]["event"] not in TERMINAL_EVENTS:
+                del self._events[index]
+                if box is self._progress_box:
+                    self._progress_box = None
+                self.dropped += 1
+                return
+        # Solo quedan eventos terminales: se permite superar maxsize
+
+    def get_nowait(self) -> Dict[str, Any]:
+        if not self._events:
+            raise asyncio.QueueEmpty()
+        box = self._events.popleft()
+        if box is self._progress_box:
+            self._progress_box = None
+        return box[0]
+
+    async def get(self) -> Dict[str, Any]:
+        while not self._events:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.get_nowait()
+
+
 class SSEService:
     """Servicio para manejar Server-Sent Events en el worker"""
     
-    def __init__(self):
-        self.active_connections: Dict[str, asyncio.Queue] = {}
-        self.event_history: Dict[str, list] = {}
+    def __init__(
+        self,
+        publisher: Optional[EventPublisher] = None,
+        history_maxlen: int = SSE_HISTORY_MAXLEN,
+        history_ttl: float = SSE_HISTORY_TTL,
+        idle_ttl: float = SSE_IDLE_TTL
+    ):
+        self.active_connections: Dict[str, Set[EventQueue]] = {}
+        self.event_history: Dict[str, Deque[Dict[str, Any]]] = {}
+        self.publisher = publisher
+        self.history_maxlen = history_maxlen
+        self.history_ttl = history_ttl
+        self.idle_ttl = idle_ttl
+        self._last_activity: Dict[str, float] = {}
+        self._finished_at: Dict[str, float] = {}
+        self._sequence = itertools.count(1)
+        self._next_eviction = 0.0
     
-    async def register_connection(self, task_id: str) -> asyncio.Queue:
-        """Registrar una nueva conexión SSE para una tarea"""
-        if task_id not in self.active_connections:
-            self.active_connections[task_id] = asyncio.Queue()
-            self.event_history[task_id] = []
-            logger.info(f"Nueva conexión SSE registrada para tarea: {task_id}")
+    async def register_connection(
+        self,
+        task_id: str,
+        maxsize: int = SSE_QUEUE_MAXSIZE,
+        replay_history: bool = False
+    ) -> EventQueue:
+        """Registrar una nueva conexión SSE para una tarea (admite varios suscriptores por tarea)"""
+        queue = EventQueue(maxsize)
+        if replay_history:
+            for event in self.event_history.get(task_id, ()):
+                queue.put_nowait(event)
+        self.active_connections.setdefault(task_id, set()).add(queue)
+        logger.info(f"Nueva conexión SSE registrada para tarea: {task_id}")
         
-        return self.active_connections[task_id]
+        return queue
     
-    async def unregister_connection(self, task_id: str):
-        """Desregistrar una conexión SSE"""
-        if task_id in self.active_connections:
+    async def unregister_connection(self, task_id: str, queue: Optional[EventQueue] = None):
+        """Desregistrar una conexión SSE (o todas las de la tarea si no se indica la cola)"""
+        queues = self.active_connections.get(task_id)
+        if queues is None:
+            return
+        if queue is not None:
+            queues.discard(queue)
+        if queue is None or not queues:
             del self.active_connections[task_id]
-            logger.info(f"Conexión SSE desregistrada para tarea: {task_id}")
+        logger.info(f"Conexión SSE desregistrada para tarea: {task_id}")
+    
+    def _record_history(self, task_id: str, event: Dict[str, Any]):
+        """Guardar el evento en el historial acotado de la tarea"""
+        history = self.event_history.get(task_id)
+        if history is None:
+            history = self.event_history[task_id] = deque(maxlen=self.history_maxlen)
+        history.append(event)
+        
+        now = time.monotonic()
+        self._last_activity[task_id] = now
+        if event["event"] in TERMINAL_EVENTS:
+            self._finished_at[task_id] = now
+        
+        if now >= self._next_eviction:
+            self._evict_expired(now)
+    
+    def _evict_expired(self, now: float):
+        """Eliminar el historial de tareas terminadas hace más de `history_ttl` o inactivas"""
+        self._next_eviction = now + min(self.history_ttl, self.idle_ttl) / 10
+        expired = [
+            task_id for task_id, last_activity in self._last_activity.items()
+            if now - self._finished_at.get(task_id, float("inf")) > self.history_ttl
+            or now - last_activity > self.idle_ttl
+        ]
+        for task_id in expired:
+            self.event_history.pop(task_id, None)
+            self._last_activity.pop(task_id, None)
+            self._finished_at.pop(task_id, None)
+        if expired:
+            logger.debug(f"Historial SSE eliminado para {len(expired)} tareas")
     
     async def send_event(self, task_id: str, event_type: str, data: Dict[str, Any]):
         """Enviar un evento SSE a una tarea específica"""
         try:
+            now = datetime.now()
             event = {
-                "id": f"{task_id}_{int(datetime.now().timestamp())}",
+                "id": f"{task_id}_{int(now.timestamp())}_{next(self._sequence)}",
                 "event": event_type,
                 "data": json.dumps(data),
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now.isoformat()
             }
             
             # Agregar a historial
-            if task_id in self.event_history:
-                self.event_history[task_id].append(event)
-                # Mantener solo los últimos 100 eventos
-                if len(self.event_history[task_id]) > 100:
-                    self.event_history[task_id] = self.event_history[task_id][-100:]
+            self._record_history(task_id, event)
+            
+            # Publicar hacia otros procesos (API) en lotes
+            if self.publisher is not None:
+                self.publisher.publish(task_id, event)
             
             # Enviar a conexiones activas
-            if task_id in self.active_connections:
-                await self.active_connections[task_id].put(event)
-                logger.debug(f"Evento SSE enviado a tarea {task_id}: {event_type}")
+            queues = self.active_connections.get(task_id)
+            if queues:
+                for queue in queues:
+                    queue.put_nowait(event)
+                logger.debug(f"Evento SSE enviado a {len(queues)} conexiones de la tarea {task_id}: {event_type}")
             
         except Exception as e:
             logger.error(f"Error enviando evento SSE a tarea {task_id}: {e}")
@@ -93,17 +225,21 @@ class SSEService:
     
     def get_event_history(self, task_id: str) -> list:
         """Obtener historial de eventos de una tarea"""
-        return self.event_history.get(task_id, [])
+        return list(self.event_history.get(task_id, ()))
     
     async def close(self):
         """Cerrar todas las conexiones SSE"""
         try:
             for task_id in list(self.active_connections.keys()):
                 await self.unregister_connection(task_id)
+            if self.publisher is not None:
+                self.publisher.close()
             logger.info("Servicio SSE cerrado")
         except Exception as e:
             logger.error(f"Error cerrando servicio SSE: {e}")
 
 
 # Instancia global del servicio SSE
-sse_service = SSEService() 
\ No newline at end of file
+sse_service = SSEService(publisher=build_event_publisher(SSE_TRANSPORT))
+if sse_service.publisher is not None:
+    atexit.register(sse_service.publisher.close)
@@ -0,0 +1,110 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from ps3_worker.constants import TASK_STATE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Estados tras los que la tarea no recibirá más actualizaciones en esta entrega
+TERMINAL_STATUSES = {"completed", "failed", "retrying"}
+
+
+class TaskStateWriter:
+    """
+    Agrupa las actualizaciones de estado de las tareas y las escribe en MongoDB en bloque.
+
+    Las actualizaciones de una misma tarea se fusionan en un único `$set` por flush,
+    el progreso intermedio se escribe como mucho una vez por intervalo y todas las
+    tareas pendientes se envían juntas con `bulk_write`. Los estados terminales
+    fuerzan un flush inmediato.
+    """
+
+    def __init__(self, mongo_service=None, flush_interval: float = TASK_STATE_FLUSH_INTERVAL):
+        self._mongo_service = mongo_service
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def mongo_service(self):
+        if self._mongo_service is None:
+            from ps3_worker.services.mongo_service import MongoService
+            self._mongo_service = MongoService()
+        return self._mongo_service
+
+    @mongo_service.setter
+    def mongo_service(self, mongo_service):
+        self._mongo_service = mongo_service
+
+    def _ensure_flusher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="task-state-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def update(self, task_id: str, **fields):
+        """Encolar campos a actualizar en la tarea (se fusionan con los pendientes)"""
+        with self._lock:
+            self._pending.setdefault(task_id, {}).update(fields)
+        self._ensure_flusher()
+
+    def set_status(self, task_id: str, status: str, **fields):
+        """Encolar un cambio de estado; los estados terminales se escriben inmediatamente"""
+        now = datetime.now()
+        fields["status"] = status
+        if status == "processing":
+            fields["processing_started_at"] = now
+        elif status in ("completed", "failed"):
+            fields["completed_at"] = now
+
+        self.update(task_id, **fields)
+        if status in TERMINAL_STATUSES:
+            self.flush()
+
+    def progress(self, task_id: str, stage: str, progress: int, message: str):
+        """Encolar el progreso de la tarea; solo se escribe el último valor de cada intervalo"""
+        self.update(task_id, progress={"stage": stage, "progress": progress, "message": message})
+
+    def flush(self) -> int:
+        """Escribir en bloque todas las actualizaciones pendientes"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            now = datetime.now()
+            for fields in pending.values():
+                fields["updated_at"] = now
+
+            try:
+                return self.mongo_service.bulk_update_tasks(pending)
+            except Exception as e:
+                logger.error(f"Error escribiendo el estado de {len(pending)} tareas: {e}")
+                # Reencolar sin pisar actualizaciones más recientes
+                with self._lock:
+                    for task_id, fields in pending.items():
+                        self._pending[task_id] = {**fields, **self._pending.get(task_id, {})}
+                return 0
+
+    def close(self):
+        """Detener el flush periódico y escribir lo pendiente"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+# Instancia global del escritor de estado
+task_state_writer = TaskStateWriter()
+atexit.register(task_state_writer.close)
@@ -0,0 +1,219 @@
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from ps3_worker.constants import TRACING_EXPORTER
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("ps3_worker.trace")
+
+# Atributos de los spans de LLM que se suman en el resumen de la tarea
+LLM_COUNTERS = ("images", "input_tokens", "output_tokens", "cached_tokens", "retries")
+
+_current_trace: ContextVar[Optional["TaskTrace"]] = ContextVar("ps3_current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("ps3_current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """Intervalo medido dentro de una tarea, con el formato de un span de OpenTelemetry"""
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_span_id", "attributes",
+        "start_time_ns", "end_time_ns", "_start_perf", "duration_s", "status", "error", "_otel_span"
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self._start_perf = time.perf_counter()
+        self.duration_s = 0.0
+        self.status = "OK"
+        self.error: Optional[str] = None
+        self._otel_span = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        self.duration_s = time.perf_counter() - self._start_perf
+        self.end_time_ns = self.start_time_ns + int(self.duration_s * 1e9)
+        if error is not None:
+            self.status = "ERROR"
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time_ns,
+            "end_time_unix_nano": self.end_time_ns,
+            "duration_ms": round(self.duration_s * 1000, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class TaskTrace:
+    """Spans de una tarea y su resumen agregado (tiempos por etapa y consumo de tokens)"""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.trace_id = _new_id(128)
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+
+    def summary(self) -> Dict[str, Any]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        llm_totals: Dict[str, int] = {"calls": 0, "errors": 0, **{key: 0 for key in LLM_COUNTERS}}
+        by_model: Dict[tuple, Dict[str, Any]] = {}
+
+        for span in self.spans:
+            if span is self.root:
+                continue
+            stage = stages.setdefault(span.name, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            stage["count"] += 1
+            stage["total_s"] = round(stage["total_s"] + span.duration_s, 4)
+            stage["max_s"] = round(max(stage["max_s"], span.duration_s), 4)
+
+            if not span.name.startswith("llm."):
+                continue
+            key = (span.attributes.get("provider"), span.attributes.get("model"))
+            model_totals = by_model.setdefault(key, {
+                "provider": key[0], "model": key[1], "calls": 0, "errors": 0, "latency_s": 0.0,
+                **{counter: 0 for counter in LLM_COUNTERS}
+            })
+            for totals in (llm_totals, model_totals):
+                totals["calls"] += 1
+                totals["errors"] += int(span.status == "ERROR")
+                for counter in LLM_COUNTERS:
+                    totals[counter] += int(span.attributes.get(counter) or 0)
+            model_totals["latency_s"] = round(model_totals["latency_s"] + span.duration_s, 4)
+
+        duration_s = None
+        if self.root is not None:
+            # La traza puede seguir abierta cuando se guarda el resumen
+            duration_s = self.root.duration_s if self.root.end_time_ns else time.perf_counter() - self.root._start_perf
+
+        return {
+            "trace_id": self.trace_id,
+            "duration_s": round(duration_s, 4) if duration_s is not None else None,
+            "status": self.root.status if self.root else None,
+            "stages": stages,
+            "llm": {**llm_totals, "by_model": list(by_model.values())},
+        }
+
+
+class Tracer:
+    """
+    Trazas por tarea con spans anidados.
+
+    Los spans se exportan como líneas JSON en el logger `ps3_worker.trace`
+    (`TRACING_EXPORTER=json`), como spans de OpenTelemetry (`otel`) o no se
+    exportan (`none`); en todos los casos alimentan el resumen de la tarea.
+    Fuera de una tarea, `span` no registra nada.
+    """
+
+    def __init__(self, exporter: str = TRACING_EXPORTER):
+        self.exporter = exporter
+        self.span_listeners: List[Callable[[Span], None]] = []
+        self._otel_tracer = None
+        if exporter == "otel":
+            try:
+                from opentelemetry import trace as otel_trace
+                self._otel_tracer = otel_trace.get_tracer("ps3_worker")
+            except ImportError:
+                logger.warning("opentelemetry no está instalado; se exportarán los spans como JSON")
+                self.exporter = "json"
+
+    def current_trace(self) -> Optional[TaskTrace]:
+        return _current_trace.get()
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def _start(self, trace: TaskTrace, name: str, attributes: Dict[str, Any]) -> Span:
+        parent = _current_span.get()
+        span = Span(name, trace.trace_id, parent.span_id if parent else None, attributes)
+        if self._otel_tracer is not None:
+            from opentelemetry import trace as otel_trace
+            context = otel_trace.set_span_in_context(parent._otel_span) if parent and parent._otel_span else None
+            span._otel_span = self._otel_tracer.start_span(name, context=context, start_time=span.start_time_ns)
+        trace.spans.append(span)
+        return span
+
+    def _finish(self, span: Span, error: Optional[BaseException]):
+        span.end(error)
+        if span._otel_span is not None:
+            span._otel_span.set_attributes({
+                key: value for key, value in span.attributes.items()
+                if isinstance(value, (str, bool, int, float))
+            })
+            span._otel_span.end(end_time=span.end_time_ns)
+        elif self.exporter == "json":
+            trace_logger.info(json.dumps(span.to_dict(), default=str))
+        for listener in self.span_listeners:
+            try:
+                listener(span)
+            except Exception as e:
+                logger.error(f"Error en listener de spans: {e}")
+
+    @contextmanager
+    def task(self, task_id: str, **attributes) -> Iterator[TaskTrace]:
+        """Abre la traza de una tarea; todos los spans dentro del bloque cuelgan de ella"""
+        trace = TaskTrace(task_id)
+        trace.root = self._start(trace, "task", {"task_id": task_id, **attributes})
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(trace.root)
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace.root, error)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Mide un bloque dentro de la tarea actual"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+
+        span = self._start(trace, name, attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span, error)
+
+
+# Instancia global del tracer
+tracer = Tracer()
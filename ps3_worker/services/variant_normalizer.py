@@ -0,0 +1,246 @@
+import logging
+import re
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from ps3_worker.constants import GENE_ALIASES_PATH
+
+logger = logging.getLogger(__name__)
+
+THREE_TO_ONE = {
+    "Ala": "A", "Arg": "R", "Asn": "N", "Asp": "D", "Cys": "C", "Gln": "Q", "Glu": "E", "Gly": "G",
+    "His": "H", "Ile": "I", "Leu": "L", "Lys": "K", "Met": "M", "Phe": "F", "Pro": "P", "Ser": "S",
+    "Thr": "T", "Trp": "W", "Tyr": "Y", "Val": "V", "Sec": "U", "Pyl": "O", "Ter": "*", "Xaa": "X",
+}
+ONE_TO_THREE = {one: three for three, one in THREE_TO_ONE.items()}
+# En la notación antigua "X" es un codón de parada (p. ej. R1443X)
+ONE_TO_THREE["X"] = "Ter"
+_THREE = {three.lower(): three for three in THREE_TO_ONE}
+
+_AA = rf"(?:{'|'.join(THREE_TO_ONE)}|[ACDEFGHIKLMNPQRSTVWYUOX*])"
+PROTEIN_PATTERN = re.compile(
+    rf"(?<![\w.>])(?P<prefix>p\.)?\(?(?P<ref>{_AA})(?P<pos>\d+)(?P<range>_{_AA}\d+)?"
+    rf"(?P<alt>{_AA}|=)?(?P<tail>fs(?:Ter|\*|X)?\d*|delins[A-Za-z*]+|del|dup|ins[A-Za-z*]+|ext\S*)?\)?(?![\w>])"
+)
+NUCLEOTIDE_PATTERN = re.compile(
+    r"(?<![\w.])(?:(?P<transcript>N[MRCGP]_\d+(?:\.\d+)?)(?:\([^)]*\))?:)?(?P<kind>[cgmnr])\.\s*"
+    r"(?P<body>[-*+]?\d[\w*+\-_>?]*(?:\s*>\s*[ACGTUacgtu]+)?)"
+)
+# Alternativas separadas por "/" en la misma posición: "Q62H/R", "p.Gln62His/Arg", "c.184C>T/G"
+PROTEIN_ALTERNATIVES_PATTERN = re.compile(
+    rf"(?<![\w.>])(?P<head>(?:p\.)?\(?{_AA}\d+)(?P<alts>{_AA}(?:/{_AA})+)(?![\w>])"
+)
+NUCLEOTIDE_ALTERNATIVES_PATTERN = re.compile(
+    r"(?<![\w.])(?P<head>[cgmnr]\.\s*[-*+]?\d[\w*+\-_?]*?[ACGTUacgtu]+\s*>\s*)"
+    r"(?P<alts>[ACGTUacgtu]+(?:/[ACGTUacgtu]+)+)(?![\w])"
+)
+SUBSTITUTION_PATTERN = re.compile(r"^(?P<position>.*?\d)(?P<ref>[ACGTUacgtu]+)\s*>\s*(?P<alt>[ACGTUacgtu]+)$")
+EDIT_PATTERN = re.compile(r"^(?P<position>.*?\d)(?P<edit>delins|del|dup|ins|inv)(?P<sequence>[ACGTUacgtu\d]*)$", re.IGNORECASE)
+DNA_LETTERS = set("ACGT")
+
+
+def _aa_three(code: str) -> Optional[str]:
+    if len(code) == 1:
+        return ONE_TO_THREE.get(code)
+    return _THREE.get(code.lower())
+
+
+def canonical_protein(match: re.Match) -> Optional[str]:
+    """p. en notación de tres letras (p.Arg123Cys, p.Arg123Ter, p.Arg123GlyfsTer5, p.Lys45del)"""
+    ref, alt, tail = match.group("ref"), match.group("alt"), match.group("tail") or ""
+    one_letter = len(ref) == 1 and (alt is None or len(alt) <= 1)
+    # Sin "p.", "C367T" o "G1691A" son sustituciones de ADN en notación antigua
+    if not match.group("prefix") and one_letter and ref in DNA_LETTERS and alt in DNA_LETTERS:
+        return None
+    if alt is None and not tail:
+        return None
+
+    parts = [_aa_three(ref), match.group("pos")]
+    if match.group("range"):
+        parts.append("_" + _range_end(match.group("range")[1:]))
+    if alt == "=":
+        parts.append("=")
+    elif alt is not None:
+        parts.append(_aa_three(alt))
+    if tail.startswith("fs"):
+        count = re.sub(r"\D", "", tail)
+        parts.append(f"fsTer{count}" if count else "fs")
+    elif tail.startswith(("delins", "ins")):
+        keyword = "delins" if tail.startswith("delins") else "ins"
+        sequence = tail[len(keyword):]
+        residues = re.findall(_AA, sequence)
+        parts.append(keyword + "".join(_aa_three(residue) or residue for residue in residues))
+    elif tail:
+        parts.append(tail)
+    if any(part is None for part in parts):
+        return None
+    return "p." + "".join(parts)
+
+
+def _range_end(end: str) -> str:
+    match = re.match(rf"({_AA})(\d+)$", end)
+    if not match:
+        return end
+    return f"{_aa_three(match.group(1)) or match.group(1)}{match.group(2)}"
+
+
+def canonical_nucleotide(match: re.Match) -> str:
+    """c./g./m./n./r. sin espacios, bases en mayúsculas (minúsculas en r.) y sin la secuencia de del/dup"""
+    kind, body = match.group("kind"), re.sub(r"\s+", "", match.group("body"))
+    substitution = SUBSTITUTION_PATTERN.match(body)
+    edit = EDIT_PATTERN.match(body)
+    if substitution:
+        ref, alt = substitution.group("ref"), substitution.group("alt")
+        body = f"{substitution.group('position')}{ref}>{alt}"
+    elif edit:
+        keyword = edit.group("edit").lower()
+        sequence = edit.group("sequence")
+        # HGVS recomienda no repetir la secuencia eliminada o duplicada (c.68_69delAG = c.68_69del)
+        if keyword in ("del", "dup", "inv"):
+            sequence = ""
+        body = f"{edit.group('position')}{keyword}{sequence}"
+    body = body.lower() if kind == "r" else re.sub(r"[acgtu]+(?=>|$)", lambda m: m.group(0).upper(), body)
+    return f"{kind}.{body}"
+
+
+def expand_alternatives(text: str) -> str:
+    """Separa las alternativas de una misma posición: "Q62H/R" -> "Q62H Q62R" """
+    def expand(match: re.Match) -> str:
+        return " ".join(match.group("head") + alt for alt in match.group("alts").split("/"))
+
+    text = NUCLEOTIDE_ALTERNATIVES_PATTERN.sub(expand, text)
+    return PROTEIN_ALTERNATIVES_PATTERN.sub(expand, text)
+
+
+def parse_variant(text: str) -> List[str]:
+    """
+    Notaciones canónicas que aparecen en `text`: "c.367C>T (p.Arg123Cys)"
+    devuelve ambas. Si no se reconoce ninguna, el texto sin espacios ni
+    mayúsculas, de modo que solo se agrupa con la misma grafía; varias
+    variantes en el mismo texto, incluidas las alternativas "Q62H/R",
+    forman una sola clave.
+    """
+    notations: List[str] = []
+    expanded = expand_alternatives(text)
+    for match in NUCLEOTIDE_PATTERN.finditer(expanded):
+        notations.append(canonical_nucleotide(match))
+    # Las notaciones de ADN no se vuelven a leer como proteína ("c.367C>T" no es Cys367Thr)
+    remaining = NUCLEOTIDE_PATTERN.sub(" ", expanded)
+    for match in PROTEIN_PATTERN.finditer(remaining):
+        notation = canonical_protein(match)
+        if notation:
+            notations.append(notation)
+    notations = list(dict.fromkeys(notations))
+    if not notations:
+        return ["raw:" + re.sub(r"\s+", "", text).lower()]
+    # Dos notaciones del mismo tipo son variantes distintas (compuesto heterocigoto, haplotipo...)
+    kinds = [notation[0] for notation in notations]
+    if len(set(kinds)) < len(kinds):
+        return ["compound:" + ";".join(sorted(notations))]
+    return notations
+
+
+def load_gene_aliases(path: str = GENE_ALIASES_PATH) -> Dict[str, str]:
+    """
+    Tabla alias -> símbolo aprobado de un TSV "símbolo<TAB>alias,alias" (formato
+    de las descargas de HGNC). Los símbolos aprobados tienen prioridad sobre los
+    alias y los alias que apuntan a varios genes se descartan.
+    """
+    approved: Dict[str, str] = {}
+    aliases: Dict[str, str] = {}
+    ambiguous = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            symbol, _, alias_list = line.rstrip("\n").partition("\t")
+            symbol = sys.intern(symbol.strip().upper())
+            approved[symbol] = symbol
+            for alias in filter(None, (alias.strip().upper() for alias in alias_list.split(","))):
+                if aliases.get(alias, symbol) != symbol:
+                    ambiguous.add(alias)
+                aliases[alias] = symbol
+    lookup = {alias: symbol for alias, symbol in aliases.items() if alias not in ambiguous and alias not in approved}
+    lookup.update(approved)
+    logger.info(f"Tabla de alias de genes cargada: {len(approved)} símbolos, {len(lookup) - len(approved)} alias")
+    return lookup
+
+
+_gene_aliases: Optional[Dict[str, str]] = None
+_gene_aliases_lock = threading.Lock()
+
+
+def get_gene_aliases() -> Dict[str, str]:
+    """Tabla de alias del proceso, cargada una sola vez"""
+    global _gene_aliases
+    with _gene_aliases_lock:
+        if _gene_aliases is None:
+            try:
+                _gene_aliases = load_gene_aliases()
+            except OSError as e:
+                logger.warning(f"No se pudo cargar la tabla de alias de genes {GENE_ALIASES_PATH}: {e}")
+                _gene_aliases = {}
+        return _gene_aliases
+
+
+def normalize_gene(gene: str) -> str:
+    """Símbolo aprobado del gen (HERG -> KCNH2) o el símbolo en mayúsculas si no está en la tabla"""
+    symbol = re.sub(r"\s+", "", gene or "").strip("*").upper()
+    return get_gene_aliases().get(symbol, symbol)
+
+
+class VariantIndex:
+    """
+    Agrupa las variantes de un documento que son la misma con distinta grafía
+    (p.Arg123Cys, R123C, "c.367C>T (p.Arg123Cys)"...). Dos variantes del mismo
+    gen (normalizado con la tabla de alias) son la misma si comparten alguna
+    notación canónica; una variante con varias notaciones une sus grupos.
+    """
+
+    def __init__(self):
+        self._parent: List[int] = []
+        self._spellings: List[List[Tuple[str, str]]] = []
+        self._notations: List[List[str]] = []
+        self._groups_by_key: Dict[Tuple[str, str], int] = {}
+
+    def find(self, group: int) -> int:
+        while self._parent[group] != group:
+            self._parent[group] = self._parent[self._parent[group]]
+            group = self._parent[group]
+        return group
+
+    def add(self, gene: str, variant: str) -> Tuple[int, bool]:
+        """Grupo de la variante y si es nuevo (hay que extraerla) o una grafía más de uno existente"""
+        symbol = normalize_gene(gene)
+        notations = parse_variant(variant or "")
+        groups = sorted({self.find(self._groups_by_key[(symbol, n)]) for n in notations if (symbol, n) in self._groups_by_key})
+
+        if groups:
+            group = groups[0]
+            for other in groups[1:]:
+                # La nueva grafía demuestra que dos grupos ya extraídos son la misma variante
+                self._parent[other] = group
+                self._spellings[group].extend(self._spellings[other])
+                self._notations[group].extend(self._notations[other])
+        else:
+            group = len(self._parent)
+            self._parent.append(group)
+            self._spellings.append([])
+            self._notations.append([])
+
+        self._spellings[group].append((gene, variant))
+        self._notations[group].extend(n for n in notations if n not in self._notations[group])
+        for notation in notations:
+            self._groups_by_key[(symbol, notation)] = group
+        return group, not groups
+
+    def aliases(self, group: int) -> List[str]:
+        """Todas las grafías originales del grupo, sin repetir"""
+        return list(dict.fromkeys(variant for _, variant in self._spellings[self.find(group)]))
+
+    def notations(self, group: int) -> List[str]:
+        return [n for n in self._notations[self.find(group)] if not n.startswith(("raw:", "compound:"))]
+
+    def __len__(self) -> int:
+        return sum(1 for group in range(len(self._parent)) if self.find(group) == group)
@@ -1,52 +1,76 @@
-from typing import Optional, List, Any, Type, Dict
-from pydantic import BaseModel
-import google.generativeai as genai
-from ollama import chat
-from openai import OpenAI
-from anthropic import Anthropic
-import os
+from functools import lru_cache
+from typing import Optional, List, Any, Type, Dict, Iterator, Tuple
+from pydantic import BaseModel, TypeAdapter, ValidationError
+import logging
+import threading
 import time
 import json
-import base64
 import re
-import mimetypes
 from enum import Enum
 
-# Para Google Colab
-try:
-    from google.colab import userdata
-    GOOGLE_API_KEY = userdata.get('GEMINI_API_KEY')
-    OPENAI_API_KEY = userdata.get('OPENAI_API_KEY')
-    ANTHROPIC_API_KEY = userdata.get('CLAUDE_API_KEY')
-except ImportError:
-    # Para entorno local, usar variables de entorno
-    from ps3_worker.constants import GOOGLE_API_KEY, OPENAI_API_KEY, ANTHROPIC_API_KEY
-
-genai.configure(api_key=GOOGLE_API_KEY)
-
-
-def get_image_mime_type(file_path: str) -> str:
-    """Detecta el tipo MIME de una imagen basado en su extensión y contenido."""
-    # Intentar detectar por extensión
-    mime_type, _ = mimetypes.guess_type(file_path)
-    
-    if mime_type and mime_type.startswith('image/'):
-        return mime_type
-    
-    # Fallback a tipos comunes basado en extensión
-    ext = file_path.lower().split('.')[-1] if '.' in file_path else ''
-    mime_map = {
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'png': 'image/png',
-        'gif': 'image/gif',
-        'bmp': 'image/bmp',
-        'webp': 'image/webp',
-        'tiff': 'image/tiff',
-        'svg': 'image/svg+xml'
-    }
-    
-    return mime_map.get(ext, 'image/png')  # Fallback a PNG si no se puede determinar
+from ps3_worker.constants import (
+    LLM_PROVIDER, LLM_MODEL_NAME, LLM_ROUTES, LLM_RECORD_MODE, LLM_ARCHIVE_PATH, LLM_CASCADE_MODEL
+)
+from ps3_worker.errors import error_status_code
+from ps3_worker.services.json_stream import IncrementalArrayParser
+from ps3_worker.services.metrics import LLM_ERRORS, LLM_REQUESTS
+from ps3_worker.services.page_image import ImageInput, load_page_images
+from ps3_worker.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+# Los SDK de los proveedores se importan al crear su cliente: importarlos todos
+# al arrancar el worker cuesta segundos y solo se usa uno (o los del router)
+@lru_cache(maxsize=None)
+def get_api_keys() -> Dict[str, str]:
+    """Claves de API de los secretos de Google Colab o, en local, de las variables de entorno"""
+    try:
+        from google.colab import userdata
+        return {
+            "google": userdata.get('GEMINI_API_KEY'),
+            "openai": userdata.get('OPENAI_API_KEY'),
+            "anthropic": userdata.get('CLAUDE_API_KEY'),
+        }
+    except ImportError:
+        from ps3_worker.constants import GOOGLE_API_KEY, OPENAI_API_KEY, ANTHROPIC_API_KEY
+        return {"google": GOOGLE_API_KEY, "openai": OPENAI_API_KEY, "anthropic": ANTHROPIC_API_KEY}
+
+
+@lru_cache(maxsize=None)
+def get_genai():
+    """SDK de Gemini, configurado con la clave de API en el primer uso"""
+    import google.generativeai as genai
+    genai.configure(api_key=get_api_keys()["google"])
+    return genai
+
+
+# Bloque ```json ... ``` en respuestas de texto libre
+JSON_BLOCK_PATTERN = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+
+
+@lru_cache(maxsize=None)
+def get_type_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    """TypeAdapter por schema, construido una sola vez por proceso"""
+    return TypeAdapter(model)
+
+
+def validate_response(model: Type[BaseModel], response: Any) -> BaseModel:
+    """
+    Valida la respuesta de un proveedor sin pasos redundantes: los modelos ya
+    validados se devuelven tal cual, el texto se valida directamente como JSON
+    y los diccionarios como objetos Python.
+    """
+    if isinstance(response, model):
+        return response
+    adapter = get_type_adapter(model)
+    if isinstance(response, (str, bytes, bytearray)):
+        return adapter.validate_json(response)
+    if isinstance(response, dict):
+        return adapter.validate_python(response)
+    if isinstance(response, BaseModel):
+        return adapter.validate_python(response.model_dump())
+    return adapter.validate_json(str(response))
 
 
 class LLMProvider(Enum):
@@ -54,27 +78,69 @@ class LLMProvider(Enum):
     ollama = "ollama"
     openai = "openai"
     claude = "claude"
+    fake = "fake"
+    router = "router"
 
 class BaseChatClient:
+    """
+    Cliente de un proveedor. `last_usage` guarda los tokens de la última llamada
+    del hilo actual (input_tokens, output_tokens, cached_tokens), de modo que un
+    mismo cliente puede usarse desde varios hilos a la vez. Las imágenes
+    (`image_paths`) pueden ser rutas o `PageImage` en memoria.
+    """
+
+    @property
+    def last_usage(self) -> Dict[str, int]:
+        return getattr(self._usage_local(), "value", {})
+
+    @last_usage.setter
+    def last_usage(self, value: Dict[str, int]):
+        self._usage_local().value = value
+
+    def _usage_local(self) -> threading.local:
+        local = self.__dict__.get("_usage_state")
+        if local is None:
+            local = self.__dict__.setdefault("_usage_state", threading.local())
+        return local
+
+    def _set_usage(self, input_tokens: Any = 0, output_tokens: Any = 0, cached_tokens: Any = 0):
+        self.last_usage = {
+            "input_tokens": int(input_tokens or 0),
+            "output_tokens": int(output_tokens or 0),
+            "cached_tokens": int(cached_tokens or 0),
+        }
+
     def send_message_once(
         self,
         prompt_text: str,
-        image_paths: Optional[List[str]] = None,
+        image_paths: Optional[List[ImageInput]] = None,
         model: Optional[Type[BaseModel]] = None
     ) -> str:
         raise NotImplementedError
 
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        """
+        Fragmentos de texto de la respuesta a medida que se generan. Cerrar el
+        generador cancela la petición. Por defecto, la respuesta completa en un fragmento.
+        """
+        response = self.send_message_once(prompt_text, image_paths, model)
+        yield response.model_dump_json() if hasattr(response, "model_dump_json") else str(response)
+
 class GeminiChatClient(BaseChatClient):
     def __init__(self, model_name: str = "gemini-2.5-pro"):
         self.model_name = model_name
 
-    def send_message_once(
+    def _build_request(
         self,
         prompt_text: str,
-        image_paths: Optional[List[str]] = None,
-        model: Optional[Type[BaseModel]] = None
-    ) -> Any:
-        generative_model = genai.GenerativeModel(self.model_name)
+        image_paths: Optional[List[ImageInput]],
+        model: Optional[Type[BaseModel]]
+    ) -> Tuple[List[Any], Dict[str, Any]]:
         generation_config = {
             "temperature": 0.4,
             "max_output_tokens": 10000,
@@ -83,18 +149,33 @@ class GeminiChatClient(BaseChatClient):
             generation_config["response_mime_type"] = "application/json"
             generation_config["response_schema"] = model
 
-        if image_paths:
-            image_parts = [self._load_image_as_part(path) for path in image_paths if os.path.exists(path)]
-            response = generative_model.generate_content(
-                [prompt_text] + image_parts,
-                generation_config=generation_config,
-            )
-        else:
-            response = generative_model.generate_content(
-                [prompt_text],
-                generation_config=generation_config,
+        # El SDK acepta los bytes tal cual: sin copia ni base64 en el cliente
+        image_parts = [{"mime_type": image.mime_type, "data": image.data} for image in load_page_images(image_paths)]
+        return [prompt_text] + image_parts, generation_config
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self._set_usage(
+                getattr(usage, "prompt_token_count", 0),
+                getattr(usage, "candidates_token_count", 0),
+                getattr(usage, "cached_content_token_count", 0)
             )
-        
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        generative_model = get_genai().GenerativeModel(self.model_name)
+        parts, generation_config = self._build_request(prompt_text, image_paths, model)
+        response = generative_model.generate_content(
+            parts,
+            generation_config=generation_config,
+        )
+        self._record_usage(response)
+
         # Verificar si la respuesta es válida
         if response.text:
             return response.text
@@ -115,67 +196,127 @@ class GeminiChatClient(BaseChatClient):
             # Si no se puede extraer texto, devolver un mensaje de error
             raise ValueError("Gemini no devolvió una respuesta válida")
 
-    def _load_image_as_part(self, path: str):
-        with open(path, "rb") as f:
-            image_data = f.read()
-        mime_type = get_image_mime_type(path)
-        return {
-            "mime_type": mime_type,
-            "data": image_data,
-        }
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        generative_model = get_genai().GenerativeModel(self.model_name)
+        parts, generation_config = self._build_request(prompt_text, image_paths, model)
+        response = generative_model.generate_content(
+            parts,
+            generation_config=generation_config,
+            stream=True
+        )
+        try:
+            for chunk in response:
+                self._record_usage(chunk)
+                text = getattr(chunk, "text", "")
+                if text:
+                    yield text
+        finally:
+            # Dejar de consumir el iterador cierra la conexión del stream
+            close = getattr(getattr(response, "_iterator", None), "close", None)
+            if close:
+                close()
 
 class OllamaChatClient(BaseChatClient):
-    def __init__(self, model_name: str = "gemma:7b"):
+    """
+    Modelo local servido por Ollama. Las peticiones van por el runtime asíncrono
+    compartido (`services/ollama_runtime.py`), que mantiene el modelo cargado con
+    `keep_alive`, fija `num_ctx`/`num_thread` y limita las peticiones simultáneas
+    a `OLLAMA_NUM_PARALLEL`.
+    """
+
+    def __init__(self, model_name: str = "gemma:7b", runtime=None):
         self.model_name = model_name
+        self._runtime = runtime
+
+    @property
+    def runtime(self):
+        if self._runtime is None:
+            from ps3_worker.services.ollama_runtime import get_ollama_runtime
+            self._runtime = get_ollama_runtime()
+        return self._runtime
+
+    def _build_messages(self, prompt_text: str, image_paths: Optional[List[ImageInput]]) -> List[Dict[str, Any]]:
+        messages = [{
+            "role": "user",
+            "content": prompt_text
+        }]
+        images = load_page_images(image_paths)
+        if images:
+            # base64 ya calculado: el SDK lo envía sin volver a codificar los bytes
+            messages[0]["images"] = [image.base64 for image in images]
+        return messages
 
     def send_message_once(
         self,
         prompt_text: str,
-        image_paths: Optional[List[str]] = None,
+        image_paths: Optional[List[ImageInput]] = None,
         model: Optional[Type[BaseModel]] = None
     ) -> Any:
-        messages = [{
-            "role": "user",
-            "content": prompt_text
-        }]
-        valid_image_paths = [path for path in (image_paths or []) if os.path.exists(path)]
-        if valid_image_paths:
-            messages[0]["images"] = valid_image_paths
-        response = chat(
-            model=self.model_name,
-            messages=messages,
+        response = self.runtime.chat(
+            self.model_name,
+            self._build_messages(prompt_text, image_paths),
             format=model.model_json_schema() if model else None
         )
+        self._set_usage(response.get('prompt_eval_count'), response.get('eval_count'))
         return response['message']['content']
 
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        stream = self.runtime.stream_chat(
+            self.model_name,
+            self._build_messages(prompt_text, image_paths),
+            format=model.model_json_schema() if model else None
+        )
+        try:
+            for chunk in stream:
+                if chunk.get('done'):
+                    self._set_usage(chunk.get('prompt_eval_count'), chunk.get('eval_count'))
+                content = chunk['message']['content']
+                if content:
+                    yield content
+        finally:
+            stream.close()
+
+    def prewarm(self) -> float:
+        return self.runtime.prewarm(self.model_name)
+
 class OpenAIChatClient(BaseChatClient):
     def __init__(self, model_name: str = "gpt-4o"):
         self.model_name = model_name
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        from openai import OpenAI
+        self.client = OpenAI(api_key=get_api_keys()["openai"])
 
-    def send_message_once(
-        self,
-        prompt_text: str,
-        image_paths: Optional[List[str]] = None,
-        model: Optional[Type[BaseModel]] = None
-    ) -> Any:
+    def _build_messages(self, prompt_text: str, image_paths: Optional[List[ImageInput]]) -> List[Dict[str, Any]]:
         messages = [{"role": "user", "content": prompt_text}]
         
         if image_paths:
             content = [{"type": "text", "text": prompt_text}]
-            for path in image_paths:
-                if os.path.exists(path):
-                    with open(path, "rb") as f:
-                        image_data = f.read()
-                    base64_image = base64.b64encode(image_data).decode('utf-8')
-                    mime_type = get_image_mime_type(path)
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}"
-                        }
-                    })
+            for image in load_page_images(image_paths):
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image.data_url
+                    }
+                })
             messages[0]["content"] = content
+        return messages
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        messages = self._build_messages(prompt_text, image_paths)
 
         if model:
             response = self.client.chat.completions.parse(
@@ -184,6 +325,7 @@ class OpenAIChatClient(BaseChatClient):
                 response_format=model,
                 max_completion_tokens=10000
             )
+            self._record_usage(response)
             return response.choices[0].message.parsed
         else:
             response = self.client.chat.completions.create(
@@ -191,24 +333,60 @@ class OpenAIChatClient(BaseChatClient):
                 messages=messages,
                 max_completion_tokens=10000
             )
+            self._record_usage(response)
             return response.choices[0].message.content
 
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        request_params = {
+            "model": self.model_name,
+            "messages": self._build_messages(prompt_text, image_paths),
+            "max_completion_tokens": 10000,
+            "stream_options": {"include_usage": True},
+        }
+        if model:
+            request_params["response_format"] = model
+
+        # Salir del context manager cierra la respuesta HTTP y cancela la generación
+        with self.client.chat.completions.stream(**request_params) as stream:
+            for event in stream:
+                if event.type == "content.delta" and event.delta:
+                    yield event.delta
+                elif event.type == "chunk" and getattr(event.chunk, "usage", None):
+                    self._record_usage(event.chunk)
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self._set_usage(
+            usage.prompt_tokens,
+            usage.completion_tokens,
+            getattr(details, "cached_tokens", 0) if details else 0
+        )
+
 class ClaudeChatClient(BaseChatClient):
     def __init__(self, model_name: str = "claude-3-5-sonnet-20241022"):
         self.model_name = model_name
         # Configurar cliente con timeout y configuración optimizada
+        from anthropic import Anthropic
         self.client = Anthropic(
-            api_key=ANTHROPIC_API_KEY,
+            api_key=get_api_keys()["anthropic"],
             timeout=60.0,  # 60 segundos de timeout
             max_retries=2  # Reintentos automáticos
         )
 
-    def send_message_once(
+    def _build_request(
         self,
         prompt_text: str,
-        image_paths: Optional[List[str]] = None,
-        model: Optional[Type[BaseModel]] = None
-    ) -> Any:
+        image_paths: Optional[List[ImageInput]],
+        model: Optional[Type[BaseModel]]
+    ) -> Dict[str, Any]:
         if model:
             prompt_text += f"""
 
@@ -221,23 +399,17 @@ class ClaudeChatClient(BaseChatClient):
         content = [{"type": "text", "text": prompt_text}]
         
         # Agregar imágenes si se proporcionan
-        if image_paths:
-            for path in image_paths:
-                if os.path.exists(path):
-                    with open(path, "rb") as f:
-                        image_data = f.read()
-                    base64_image = base64.b64encode(image_data).decode('utf-8')
-                    mime_type = get_image_mime_type(path)
-                    content.append({
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": mime_type,
-                            "data": base64_image
-                        }
-                    })
+        for image in load_page_images(image_paths):
+            content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": image.mime_type,
+                    "data": image.base64
+                }
+            })
 
-        request_params = {
+        return {
             "model": self.model_name,
             "max_tokens": 10000,
             "temperature": 0.4,
@@ -249,93 +421,266 @@ class ClaudeChatClient(BaseChatClient):
             ]
         }
 
+    def _record_usage(self, usage):
+        if usage is not None:
+            self._set_usage(
+                usage.input_tokens,
+                usage.output_tokens,
+                getattr(usage, "cache_read_input_tokens", 0)
+            )
+
+    def send_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Any:
+        request_params = self._build_request(prompt_text, image_paths, model)
+
         try:
             response = self.client.messages.create(**request_params)
+            self._record_usage(getattr(response, "usage", None))
 
             if model:
                 text_content = response.content[0].text.strip()
 
-                json_pattern = r'```json\s*(.*?)\s*```'
-                json_match = re.search(json_pattern, text_content, re.DOTALL)
-
-                if json_match:
-                    json_content = json_match.group(1).strip()
-                    json_response = json.loads(json_content)
-                    if "data" not in json_response or len(json_response.keys()) > 1:
-                        json_response = {
-                            "data": [
-                                json_response
-                            ]
-                        }
-
-                    if not isinstance(json_response["data"], list):
-                        json_response["data"] = [json_response["data"]]
+                json_match = JSON_BLOCK_PATTERN.search(text_content)
+                json_content = json_match.group(1).strip() if json_match else text_content
+                adapter = get_type_adapter(model)
 
-                    return model.model_validate(json_response)
                 try:
-                    json_response = json.loads(text_content)
-                    return model.model_validate(json_response)
-                except json.JSONDecodeError:
-                    raise ValueError(f"No se encontró JSON válido en la respuesta: {text_content}")
+                    # Camino directo: el JSON ya tiene la forma del schema
+                    return adapter.validate_json(json_content)
+                except ValidationError as e:
+                    try:
+                        json_response = json.loads(json_content)
+                    except json.JSONDecodeError:
+                        raise ValueError(f"No se encontró JSON válido en la respuesta: {text_content}") from e
+                    if not json_match or not isinstance(json_response, dict):
+                        raise
+
+                # Respuestas sin la clave "data" o con un único objeto en lugar de una lista
+                if "data" not in json_response or len(json_response.keys()) > 1:
+                    json_response = {
+                        "data": [
+                            json_response
+                        ]
+                    }
+
+                if not isinstance(json_response["data"], list):
+                    json_response["data"] = [json_response["data"]]
+
+                return adapter.validate_python(json_response)
             else:
                 return response.content[0].text
 
         except Exception as e:
             raise e
 
+    def stream_message_once(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        request_params = self._build_request(prompt_text, image_paths, model)
+        # Salir del context manager cierra la respuesta HTTP y cancela la generación
+        with self.client.messages.stream(**request_params) as stream:
+            for text in stream.text_stream:
+                yield text
+            self._record_usage(getattr(stream.get_final_message(), "usage", None))
+
+def create_provider_client(provider: LLMProvider, model_name: str) -> BaseChatClient:
+    """Cliente del SDK de un proveedor"""
+    if provider == LLMProvider.gemini:
+        return GeminiChatClient(model_name)
+    elif provider == LLMProvider.ollama:
+        return OllamaChatClient(model_name)
+    elif provider == LLMProvider.openai:
+        return OpenAIChatClient(model_name)
+    elif provider == LLMProvider.claude:
+        return ClaudeChatClient(model_name)
+    elif provider == LLMProvider.fake:
+        from ps3_worker.services.fake_llm import FakeChatClient
+        return FakeChatClient(model_name)
+    elif provider == LLMProvider.router:
+        from ps3_worker.services.llm_router import RoutingChatClient
+        return RoutingChatClient.from_config()
+    else:
+        raise ValueError(f"Proveedor desconocido: {provider}")
+
+def prewarm_local_models() -> None:
+    """Carga en Ollama los modelos locales configurados (principal, del router y de la cascada)"""
+    from ps3_worker.services.llm_router import parse_routes
+
+    routes = [(LLMProvider(LLM_PROVIDER), LLM_MODEL_NAME)]
+    if LLM_PROVIDER == LLMProvider.router.value:
+        routes = [(provider, model_name) for provider, model_name, _ in parse_routes(LLM_ROUTES)]
+    if LLM_CASCADE_MODEL:
+        routes += [(provider, model_name) for provider, model_name, _ in parse_routes(LLM_CASCADE_MODEL)[:1]]
+    for model_name in dict.fromkeys(model_name for provider, model_name in routes if provider == LLMProvider.ollama):
+        try:
+            OllamaChatClient(model_name).prewarm()
+        except Exception as e:
+            logger.warning(f"No se pudo precargar {model_name} en Ollama: {e}")
+
 class VLLMChatClient:
-    def __init__(self, provider: LLMProvider = LLMProvider.ollama, model_name: str = 'gemma:7b'):
+    def __init__(
+        self,
+        provider: LLMProvider = LLMProvider.ollama,
+        model_name: str = 'gemma:7b',
+        client: Optional[BaseChatClient] = None
+    ):
         self.model_name = model_name
         self.provider = provider
-        self._client = self._get_client()
+        self._client = client or self._get_client()
 
     def _get_client(self) -> BaseChatClient:
-        if self.provider == LLMProvider.gemini:
-            return GeminiChatClient(self.model_name)
-        elif self.provider == LLMProvider.ollama:
-            return OllamaChatClient(self.model_name)
-        elif self.provider == LLMProvider.openai:
-            return OpenAIChatClient(self.model_name)
-        elif self.provider == LLMProvider.claude:
-            return ClaudeChatClient(self.model_name)
-        else:
-            raise ValueError(f"Proveedor desconocido: {self.provider}")
+        client = self._get_recorded_client(self.provider, self.model_name)
+        if LLM_CASCADE_MODEL:
+            from ps3_worker.services.llm_cascade import CascadeChatClient
+            from ps3_worker.services.llm_router import parse_routes
+            cheap_provider, cheap_model, _ = parse_routes(LLM_CASCADE_MODEL)[0]
+            client = CascadeChatClient(self._get_recorded_client(cheap_provider, cheap_model), client)
+        return client
+
+    def _get_recorded_client(self, provider: LLMProvider, model_name: str) -> BaseChatClient:
+        if LLM_RECORD_MODE == "off":
+            return create_provider_client(provider, model_name)
+
+        from ps3_worker.services.llm_recorder import RecordingChatClient, ReplayChatClient, get_archive
+        archive = get_archive(LLM_ARCHIVE_PATH)
+        if LLM_RECORD_MODE == "replay":
+            return ReplayChatClient(provider.value, model_name, archive)
+        return RecordingChatClient(
+            create_provider_client(provider, model_name),
+            provider.value,
+            archive,
+            replay_first=LLM_RECORD_MODE == "replay_or_record"
+        )
 
     def send_message(
         self,
         prompt_text: str,
-        image_paths: Optional[List[str]] = None,
+        image_paths: Optional[List[ImageInput]] = None,
         model: Optional[Type[BaseModel]] = None,
         retries: int = 3,
         retry_delay: int = 2
-    ) -> Optional[Type[BaseModel]] | str:
+    ) -> Type[BaseModel] | str:
+        """
+        Envía la petición reintentando los fallos de red y de validación.
+
+        Al agotar los reintentos (o ante un error no reintentable, `retryable = False`)
+        lanza la última excepción para que `classify_failure` decida si la tarea se
+        reintenta o va a la cola de dead-letter.
+        """
         attempt = 0
         last_error = None
+        usage_totals = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+        schema_name = model.__name__ if model else "text"
 
-        while attempt < retries:
+        with tracer.span(
+            f"llm.{schema_name}",
+            provider=self.provider.value,
+            model=self.model_name,
+            images=len(image_paths or [])
+        ) as span:
+            while attempt < retries:
+                try:
+                    self._client.last_usage = {}
+                    try:
+                        response = self._client.send_message_once(
+                            prompt_text=prompt_text,
+                            image_paths=image_paths,
+                            model=model
+                        )
+                    finally:
+                        for key, value in self._client.last_usage.items():
+                            usage_totals[key] += value
+
+                    # Un fallo de validación cuenta como error y se reintenta
+                    result = validate_response(model, response) if model else response
+
+                    LLM_REQUESTS.inc(provider=self.provider.value, model=self.model_name, outcome="ok")
+                    if span is not None:
+                        span.set_attributes(retries=attempt, **usage_totals)
+                    return result
+
+                except (json.JSONDecodeError, Exception) as e:
+                    last_error = e
+                    status_code = error_status_code(e)
+                    LLM_REQUESTS.inc(
+                        provider=self.provider.value,
+                        model=self.model_name,
+                        outcome="rate_limited" if status_code == 429 else "error"
+                    )
+                    LLM_ERRORS.inc(provider=self.provider.value, status_code=status_code or "none")
+                    logger.warning(f"[ERROR DE PARSE] {self.provider.value}/{self.model_name} intento {attempt + 1}: {e}")
+                    attempt += 1
+                    if not getattr(e, "retryable", True):
+                        break
+                    if attempt < retries:
+                        time.sleep(retry_delay)
+
+            logger.error(f"Fallo tras agotar los reintentos ({self.provider.value}/{self.model_name}): {last_error}")
+            if span is not None:
+                span.set_attributes(retries=attempt, error=str(last_error), **usage_totals)
+                span.status = "ERROR"
+            raise last_error
+
+    def stream_items(
+        self,
+        prompt_text: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        model: Optional[Type[BaseModel]] = None,
+        item_key: Optional[str] = "data"
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Elementos de la lista `item_key` de la respuesta (como dicts) a medida que
+        el proveedor los genera. No reintenta: si falla, el error se propaga.
+        Cerrar el generador cancela la petición en curso.
+        """
+        schema_name = model.__name__ if model else "text"
+        parser = IncrementalArrayParser(item_key)
+        items = 0
+        cancelled = False
+
+        with tracer.span(
+            f"llm.{schema_name}",
+            provider=self.provider.value,
+            model=self.model_name,
+            images=len(image_paths or []),
+            streamed=True
+        ) as span:
+            self._client.last_usage = {}
+            stream = self._client.stream_message_once(prompt_text, image_paths, model)
             try:
-                response = self._client.send_message_once(
-                    prompt_text=prompt_text,
-                    image_paths=image_paths,
-                    model=model
+                for chunk in stream:
+                    for item in parser.feed(chunk):
+                        items += 1
+                        yield item
+                    if parser.done:
+                        break
+            except GeneratorExit:
+                cancelled = True
+                raise
+            except Exception as e:
+                status_code = error_status_code(e)
+                LLM_REQUESTS.inc(
+                    provider=self.provider.value,
+                    model=self.model_name,
+                    outcome="rate_limited" if status_code == 429 else "error"
                 )
-
-                if model:
-                    if isinstance(response, str):
-                        return model.model_validate_json(response)
-                    elif hasattr(response, 'model_dump'):
-                        json_response = response.model_dump_json()
-                        return model.model_validate_json(json_response)
-                    else:
-                        return model.model_validate_json(str(response))
-                else:
-                    return response
-
-            except (json.JSONDecodeError, Exception) as e:
-                last_error = str(e)
-                print(f"[ERROR DE PARSE] Intento {attempt + 1}: {last_error}")
-                attempt += 1
-                time.sleep(retry_delay)
-
-        print("Fallo tras agotar los reintentos.")
-        return None
+                LLM_ERRORS.inc(provider=self.provider.value, status_code=status_code or "none")
+                logger.warning(f"[ERROR DE STREAM] {self.provider.value}/{self.model_name} tras {items} elementos: {e}")
+                if span is not None:
+                    span.set_attribute("error", str(e))
+                raise
+            finally:
+                stream.close()
+                if span is not None:
+                    span.set_attributes(items=items, cancelled=cancelled, **self._client.last_usage)
+
+            if not parser.done:
+                raise ValueError(f"Respuesta incompleta: no se encontró la lista '{item_key}' completa")
+            LLM_REQUESTS.inc(provider=self.provider.value, model=self.model_name, outcome="ok")